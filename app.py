@@ -5,6 +5,11 @@ import dash
 import dash_bootstrap_components as dbc
 from dash import Dash, dcc, html
 
+# read-only JSON API, downloads and vector tiles of the facility catalogue
+from facilities.api import api as facilities_api
+from facilities.export import export as facility_export
+from facilities.tiles import tiles as facility_tiles
+
 # ---------
 # Build App
 # ---------
@@ -16,6 +21,10 @@ app = Dash(
     suppress_callback_exceptions=True,
 )
 
+app.server.register_blueprint(facilities_api)
+app.server.register_blueprint(facility_export)
+app.server.register_blueprint(facility_tiles)
+
 def create_nav_bar():
     navbar = dbc.Nav(
         [
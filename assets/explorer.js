@@ -0,0 +1,656 @@
+// Browser-side code for the facilities explorer (pages/explorer.py).
+//
+// The filtering callbacks are only used when the app runs with
+// EXPLORER_CLIENTSIDE_FILTERING=1. The facet index is fetched from
+// /api/facet-index (facilities/api.py) when the dataset version changes; the
+// browser's HTTP cache revalidates it with its ETag. update_tiles is only used with
+// EXPLORER_MAP_LAYER=tiles; it draws the vector tiles of facilities/tiles.py.
+// update_export_links points the download links at facilities/export.py.
+// update_url keeps the page URL in step with the filters and selection.
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    explorer: (function () {
+        // row position of each facility_id, rebuilt when the index changes
+        var positionsVersion = null;
+        var positions = {};
+
+        function getPosition(index, facilityId) {
+            if (positionsVersion !== index.version) {
+                positions = {};
+                index.facility_id.forEach(function (id, i) {
+                    positions[id] = i;
+                });
+                positionsVersion = index.version;
+            }
+            return positions[facilityId];
+        }
+
+        // codes of the selected values; null if nothing is selected
+        function selectedCodes(facet, selected) {
+            if (!selected || selected.length === 0) {
+                return null;
+            }
+            var codes = new Set();
+            facet.values.forEach(function (value, code) {
+                if (selected.indexOf(value) >= 0) {
+                    codes.add(code);
+                }
+            });
+            return codes;
+        }
+
+        // true if row i has any of the selected values of a facet
+        function rowMatches(facet, codes, i) {
+            if (!facet.offsets) {
+                return codes.has(facet.codes[i]);
+            }
+            for (var j = facet.offsets[i]; j < facet.offsets[i + 1]; j++) {
+                if (codes.has(facet.codes[j])) {
+                    return true;
+                }
+            }
+            return false;
+        }
+
+        // add the values of row i to the counts of a facet, once per value
+        function countRow(facet, counts, seen, i) {
+            if (!facet.offsets) {
+                if (facet.codes[i] >= 0) {
+                    counts[facet.codes[i]]++;
+                }
+                return;
+            }
+            for (var j = facet.offsets[i]; j < facet.offsets[i + 1]; j++) {
+                var code = facet.codes[j];
+                if (seen[code] !== i) {
+                    seen[code] = i;
+                    counts[code]++;
+                }
+            }
+        }
+
+        // great-circle distance in km, as in facilities/spatial.py
+        function haversine(lat, lon, lat0, lon0) {
+            var rad = Math.PI / 180;
+            var a =
+                Math.pow(Math.sin(((lat - lat0) * rad) / 2), 2) +
+                Math.cos(lat * rad) * Math.cos(lat0 * rad) * Math.pow(Math.sin(((lon - lon0) * rad) / 2), 2);
+            return 2 * 6371.0088 * Math.asin(Math.sqrt(Math.min(a, 1)));
+        }
+
+        // ------------------------------------------------------------------
+        // Vector tiles: just enough of the MVT format for the point layers of
+        // facilities/tiles.py (varints, 64-bit doubles and length-delimited
+        // fields).
+
+        var MAX_TILE_ZOOM = 20;
+        // most tiles fetched for one view
+        var MAX_TILES = 64;
+
+        function readVarint(buf, pos) {
+            var value = 0;
+            var scale = 1;
+            var byte;
+            do {
+                byte = buf[pos.i++];
+                value += (byte & 0x7f) * scale;
+                scale *= 128;
+            } while (byte & 0x80);
+            return value;
+        }
+
+        function unzigzag(n) {
+            return n % 2 === 1 ? -(n + 1) / 2 : n / 2;
+        }
+
+        // call fn(field, wireType, value) for each field of a message
+        function readFields(buf, start, end, fn) {
+            var pos = { i: start };
+            while (pos.i < end) {
+                var key = readVarint(buf, pos);
+                var field = Math.floor(key / 8);
+                var wireType = key % 8;
+                var value;
+                if (wireType === 0) {
+                    value = readVarint(buf, pos);
+                } else if (wireType === 1) {
+                    value = new DataView(buf.buffer, buf.byteOffset + pos.i, 8).getFloat64(0, true);
+                    pos.i += 8;
+                } else if (wireType === 2) {
+                    var length = readVarint(buf, pos);
+                    value = [pos.i, pos.i + length];
+                    pos.i += length;
+                } else {
+                    throw new Error("unsupported wire type " + wireType);
+                }
+                fn(field, wireType, value);
+            }
+        }
+
+        function readPacked(buf, range) {
+            var pos = { i: range[0] };
+            var values = [];
+            while (pos.i < range[1]) {
+                values.push(readVarint(buf, pos));
+            }
+            return values;
+        }
+
+        function readString(buf, range) {
+            return new TextDecoder().decode(buf.subarray(range[0], range[1]));
+        }
+
+        function readValue(buf, range) {
+            var value = null;
+            readFields(buf, range[0], range[1], function (field, wireType, v) {
+                if (field === 1) {
+                    value = readString(buf, v);
+                } else if (field === 3) {
+                    value = v;
+                } else if (field === 5) {
+                    value = v;
+                } else if (field === 6) {
+                    value = unzigzag(v);
+                } else if (field === 7) {
+                    value = v === 1;
+                }
+            });
+            return value;
+        }
+
+        // GeoJSON features of the points in one tile
+        function decodeTile(buf, z, x, y) {
+            var features = [];
+            var n = Math.pow(2, z);
+            readFields(buf, 0, buf.length, function (field, wireType, layerRange) {
+                if (field !== 3) {
+                    return;
+                }
+                var name = null;
+                var extent = 4096;
+                var keys = [];
+                var values = [];
+                var encoded = [];
+                readFields(buf, layerRange[0], layerRange[1], function (f, w, v) {
+                    if (f === 1) {
+                        name = readString(buf, v);
+                    } else if (f === 2) {
+                        encoded.push(v);
+                    } else if (f === 3) {
+                        keys.push(readString(buf, v));
+                    } else if (f === 4) {
+                        values.push(readValue(buf, v));
+                    } else if (f === 5) {
+                        extent = v;
+                    }
+                });
+                encoded.forEach(function (featureRange) {
+                    var properties = { layer: name };
+                    var geometry = [];
+                    readFields(buf, featureRange[0], featureRange[1], function (f, w, v) {
+                        if (f === 2) {
+                            var tags = readPacked(buf, v);
+                            for (var j = 0; j + 1 < tags.length; j += 2) {
+                                properties[keys[tags[j]]] = values[tags[j + 1]];
+                            }
+                        } else if (f === 4) {
+                            geometry = readPacked(buf, v);
+                        }
+                    });
+                    // one MoveTo: [command, x, y]
+                    if (geometry.length < 3) {
+                        return;
+                    }
+                    var px = (x + unzigzag(geometry[1]) / extent) / n;
+                    var py = (y + unzigzag(geometry[2]) / extent) / n;
+                    var lon = px * 360 - 180;
+                    var lat = (Math.atan(Math.sinh(Math.PI * (1 - 2 * py))) * 180) / Math.PI;
+                    features.push({
+                        type: "Feature",
+                        geometry: { type: "Point", coordinates: [lon, lat] },
+                        properties: properties,
+                    });
+                });
+            });
+            return features;
+        }
+
+        // tile coordinates of a longitude / latitude at zoom z
+        function tileX(lon, z) {
+            return Math.floor(((lon + 180) / 360) * Math.pow(2, z));
+        }
+
+        function tileY(lat, z) {
+            lat = Math.max(Math.min(lat, 85.0511), -85.0511);
+            var sin = Math.sin((lat * Math.PI) / 180);
+            return Math.floor((0.5 - Math.log((1 + sin) / (1 - sin)) / (4 * Math.PI)) * Math.pow(2, z));
+        }
+
+        // the query parameters of /api/facilities for the current filters
+        function facilitiesQuery(countries, types, infrastructure, availabledata, radiusSearch, searchResults, text) {
+            var params = new URLSearchParams();
+            [
+                ["country", countries],
+                ["type", types],
+                ["infrastructure", infrastructure],
+                ["availabledata", availabledata],
+            ].forEach(function (facet) {
+                (facet[1] || []).forEach(function (value) {
+                    params.append(facet[0], value);
+                });
+            });
+            if (radiusSearch) {
+                params.append("lat", radiusSearch.lat);
+                params.append("lon", radiusSearch.lon);
+                params.append("radius_km", radiusSearch.radius_km);
+            }
+            if (searchResults && text) {
+                params.append("q", text);
+            }
+            var query = params.toString();
+            return query ? "?" + query : "";
+        }
+
+        function pathPrefix() {
+            var config = document.getElementById("_dash-config");
+            var prefix = config ? JSON.parse(config.textContent).requests_pathname_prefix : "/";
+            return prefix || "/";
+        }
+
+        return {
+            load_facet_index: function (version, icons) {
+                if (!version) {
+                    return window.dash_clientside.no_update;
+                }
+
+                return fetch(pathPrefix() + "api/facet-index")
+                    .then(function (response) {
+                        if (!response.ok) {
+                            throw new Error("api/facet-index: " + response.status);
+                        }
+                        return response.json();
+                    })
+                    .then(function (index) {
+                        // the icon images of the facility types, from the layout
+                        var names = index.icon.values;
+                        index.icon = {
+                            names: names,
+                            values: names.map(function (name) {
+                                return (icons && icons.icons[name]) || (icons && icons["default"]);
+                            }),
+                            codes: index.icon.codes,
+                            default: icons && icons["default"],
+                        };
+                        return index;
+                    });
+            },
+
+            filter_facilities: function (countries, types, infrastructure, availabledata, radiusSearch, searchResults, index) {
+                if (!index) {
+                    return [window.dash_clientside.no_update, window.dash_clientside.no_update];
+                }
+
+                var filters = [
+                    [index.country, selectedCodes(index.country, countries)],
+                    [index.type, selectedCodes(index.type, types)],
+                    [index.infrastructure, selectedCodes(index.infrastructure, infrastructure)],
+                    [index.availabledata, selectedCodes(index.availabledata, availabledata)],
+                ].filter(function (f) {
+                    return f[1] !== null;
+                });
+
+                // the ranked results of the (server-side) text search, or every row
+                var rows = [];
+                if (searchResults) {
+                    searchResults.forEach(function (id) {
+                        var i = getPosition(index, id);
+                        if (i !== undefined) {
+                            rows.push(i);
+                        }
+                    });
+                } else {
+                    for (var i = 0; i < index.facility_id.length; i++) {
+                        rows.push(i);
+                    }
+                }
+
+                var matches = [];
+                rows.forEach(function (i) {
+                    var match = filters.every(function (f) {
+                        return rowMatches(f[0], f[1], i);
+                    });
+                    if (!match) {
+                        return;
+                    }
+                    if (!radiusSearch) {
+                        matches.push({ id: index.facility_id[i] });
+                        return;
+                    }
+                    if (index.lat[i] === null || index.lon[i] === null) {
+                        return;
+                    }
+                    var distance = haversine(index.lat[i], index.lon[i], radiusSearch.lat, radiusSearch.lon);
+                    if (distance <= radiusSearch.radius_km) {
+                        matches.push({ id: index.facility_id[i], distance: distance });
+                    }
+                });
+
+                if (radiusSearch && !searchResults) {
+                    // nearest first; sort is stable, so ties keep their order
+                    matches.sort(function (a, b) {
+                        return a.distance - b.distance;
+                    });
+                }
+
+                var ids = matches.map(function (m) {
+                    return m.id;
+                });
+
+                return [ids, ids.length === 0];
+            },
+
+            // the dropdown options with the number of facilities each value
+            // would give, as get_facet_options in pages/explorer.py
+            update_facet_options: function (countries, types, infrastructure, availabledata, radiusSearch, searchResults, index) {
+                var no_update = window.dash_clientside.no_update;
+                if (!index) {
+                    return [no_update, no_update, no_update, no_update];
+                }
+
+                var selections = [countries, types, infrastructure, availabledata];
+                var facets = [index.country, index.type, index.infrastructure, index.availabledata];
+                var codes = facets.map(function (facet, k) {
+                    return selectedCodes(facet, selections[k]);
+                });
+                var counts = facets.map(function (facet) {
+                    return new Int32Array(facet.values.length);
+                });
+                var seen = facets.map(function (facet) {
+                    return new Int32Array(facet.values.length).fill(-1);
+                });
+
+                // the rows left by the text search
+                var searched = null;
+                if (searchResults) {
+                    searched = new Set();
+                    searchResults.forEach(function (id) {
+                        var i = getPosition(index, id);
+                        if (i !== undefined) {
+                            searched.add(i);
+                        }
+                    });
+                }
+
+                for (var i = 0; i < index.facility_id.length; i++) {
+                    if (searched && !searched.has(i)) {
+                        continue;
+                    }
+                    if (radiusSearch) {
+                        if (index.lat[i] === null || index.lon[i] === null) {
+                            continue;
+                        }
+                        if (haversine(index.lat[i], index.lon[i], radiusSearch.lat, radiusSearch.lon) > radiusSearch.radius_km) {
+                            continue;
+                        }
+                    }
+
+                    // a value is counted if the row matches every other facet
+                    var failed = [];
+                    for (var k = 0; k < facets.length && failed.length < 2; k++) {
+                        if (codes[k] !== null && !rowMatches(facets[k], codes[k], i)) {
+                            failed.push(k);
+                        }
+                    }
+                    for (k = 0; k < facets.length; k++) {
+                        if (failed.length === 0 || (failed.length === 1 && failed[0] === k)) {
+                            countRow(facets[k], counts[k], seen[k], i);
+                        }
+                    }
+                }
+
+                return facets.map(function (facet, k) {
+                    var selected = selections[k] || [];
+                    return facet.values.map(function (value, code) {
+                        return {
+                            label: value + " (" + counts[k][code] + ")",
+                            value: value,
+                            disabled: counts[k][code] === 0 && selected.indexOf(value) < 0,
+                        };
+                    });
+                });
+            },
+
+            update_table: function (ids, index) {
+                if (!index || !ids) {
+                    return window.dash_clientside.no_update;
+                }
+
+                var rows = [];
+                ids.forEach(function (id) {
+                    var i = getPosition(index, id);
+                    // ids of facilities removed by a reload
+                    if (i === undefined) {
+                        return;
+                    }
+                    rows.push({
+                        name: index.name[i],
+                        country: index.country.values[index.country.codes[i]],
+                        type: index.type.values[index.type.codes[i]],
+                        facility_id: id,
+                        id: id,
+                    });
+                });
+                return rows;
+            },
+
+            update_markers: function (ids, index) {
+                if (!index || !ids) {
+                    return window.dash_clientside.no_update;
+                }
+
+                var markers = [];
+                ids.forEach(function (id) {
+                    var i = getPosition(index, id);
+                    if (i === undefined || index.lat[i] === null || index.lon[i] === null) {
+                        return;
+                    }
+                    var iconCode = index.icon.codes[i];
+                    markers.push({
+                        namespace: "dash_leaflet",
+                        type: "Marker",
+                        props: {
+                            position: [index.lat[i], index.lon[i]],
+                            icon: iconCode >= 0 ? index.icon.values[iconCode] : index.icon.default,
+                            id: { type: "facility", id: "marker." + id },
+                            children: [
+                                {
+                                    namespace: "dash_leaflet",
+                                    type: "Tooltip",
+                                    props: { children: index.name[i] },
+                                },
+                            ],
+                        },
+                    });
+                });
+
+                return markers;
+            },
+
+            update_features: function (ids, index) {
+                if (!index || !ids) {
+                    return window.dash_clientside.no_update;
+                }
+
+                var features = [];
+                ids.forEach(function (id) {
+                    var i = getPosition(index, id);
+                    if (i === undefined || index.lat[i] === null || index.lon[i] === null) {
+                        return;
+                    }
+                    var iconCode = index.icon.codes[i];
+                    features.push({
+                        type: "Feature",
+                        geometry: { type: "Point", coordinates: [index.lon[i], index.lat[i]] },
+                        properties: {
+                            facility_id: id,
+                            tooltip: index.name[i],
+                            icon: iconCode >= 0 ? index.icon.names[iconCode] : null,
+                        },
+                    });
+                });
+
+                return { type: "FeatureCollection", features: features };
+            },
+
+            update_tiles: function (
+                bounds,
+                countries,
+                types,
+                infrastructure,
+                availabledata,
+                radiusSearch,
+                searchResults,
+                version, // a reload refetches the tiles
+                zoom,
+                text
+            ) {
+                if (!bounds) {
+                    return window.dash_clientside.no_update;
+                }
+
+                var south = bounds[0][0];
+                var west = Math.max(bounds[0][1], -180);
+                var north = bounds[1][0];
+                var east = Math.min(bounds[1][1], 180 - 1e-9);
+
+                // a coarser zoom than the map's if the viewport needs too many tiles
+                var z = Math.max(0, Math.min(MAX_TILE_ZOOM, Math.round(zoom || 0)));
+                while (z > 0 && (tileX(east, z) - tileX(west, z) + 1) * (tileY(south, z) - tileY(north, z) + 1) > MAX_TILES) {
+                    z--;
+                }
+                var n = Math.pow(2, z);
+
+                var prefix = pathPrefix() + "tiles/";
+                var query = facilitiesQuery(countries, types, infrastructure, availabledata, radiusSearch, searchResults, text);
+                var requests = [];
+                for (var x = Math.max(tileX(west, z), 0); x <= Math.min(tileX(east, z), n - 1); x++) {
+                    for (var y = Math.max(tileY(north, z), 0); y <= Math.min(tileY(south, z), n - 1); y++) {
+                        requests.push(
+                            (function (x, y) {
+                                var url = prefix + z + "/" + x + "/" + y + ".mvt" + query;
+                                return fetch(url)
+                                    .then(function (response) {
+                                        if (!response.ok) {
+                                            throw new Error(url + ": " + response.status);
+                                        }
+                                        return response.arrayBuffer();
+                                    })
+                                    .then(function (body) {
+                                        return decodeTile(new Uint8Array(body), z, x, y);
+                                    });
+                            })(x, y)
+                        );
+                    }
+                }
+
+                return Promise.all(requests).then(function (tiles) {
+                    return { type: "FeatureCollection", features: [].concat.apply([], tiles) };
+                });
+            },
+
+            // the download links of facilities/export.py, for the current filters
+            update_export_links: function (countries, types, infrastructure, availabledata, radiusSearch, searchResults, text) {
+                var query = facilitiesQuery(countries, types, infrastructure, availabledata, radiusSearch, searchResults, text);
+                var prefix = pathPrefix() + "api/facilities.";
+                // one output per format, with the id "export-link-<extension>"
+                return window.dash_clientside.callback_context.outputs_list.map(function (output) {
+                    return prefix + output.id.replace("export-link-", "") + query;
+                });
+            },
+
+            // the query of the page URL, to share the view: the filters and the
+            // slug of the selected facility (see get_url_state)
+            update_url: function (countries, types, infrastructure, availabledata, slug) {
+                var params = new URLSearchParams(facilitiesQuery(countries, types, infrastructure, availabledata).slice(1));
+                if (slug) {
+                    params.append("facility", slug);
+                }
+                var query = params.toString();
+                return query ? "?" + query : "";
+            },
+
+            marker_clicked: function (n_clicks) {
+                var ctx = window.dash_clientside.callback_context;
+                if (!ctx.triggered.length || !ctx.triggered[0].value) {
+                    return window.dash_clientside.no_update;
+                }
+                // prop_id looks like {"id":"marker.12","type":"facility"}.n_clicks
+                var propId = ctx.triggered[0].prop_id;
+                var markerId = JSON.parse(propId.slice(0, propId.lastIndexOf("."))).id;
+                var facilityId = parseInt(markerId.split(".").pop(), 10);
+                return { facility_id: facilityId, clicked_at: Date.now() };
+            },
+
+            feature_clicked: function (feature) {
+                // clusters have no facility_id; clicking them zooms the map instead
+                if (!feature || !feature.properties || feature.properties.facility_id === undefined) {
+                    return window.dash_clientside.no_update;
+                }
+                return { facility_id: feature.properties.facility_id, clicked_at: Date.now() };
+            },
+        };
+    })(),
+});
+
+// Functional properties of the facilities GeoJSON layer (see
+// create_facility_geojson). dash-leaflet passes the layer as the last argument.
+window.dashExtensions = Object.assign({}, window.dashExtensions, {
+    explorer: (function () {
+        // one L.icon per facility type, created on first use
+        var icons = {};
+
+        function pointToLayer(feature, latlng, context) {
+            var hideout = (context && (context.props ? context.props.hideout : context.hideout)) || {};
+            var type = feature.properties.icon;
+            var key = type in (hideout.icons || {}) ? type : "";
+            if (!(key in icons)) {
+                icons[key] = L.icon(key ? hideout.icons[key] : hideout["default"]);
+            }
+            return L.marker(latlng, { icon: icons[key] });
+        }
+
+        return {
+            pointToLayer: pointToLayer,
+
+            // the features of update_tiles: clusters, facilities and the points
+            // of any other tile layer
+            tilePointToLayer: function (feature, latlng, context) {
+                var properties = feature.properties;
+                if (properties.cluster) {
+                    var count = properties.point_count;
+                    var size = count < 10 ? 30 : count < 100 ? 36 : 44;
+                    var marker = L.marker(latlng, {
+                        icon: L.divIcon({
+                            html:
+                                '<div style="width:' + size + "px;height:" + size + "px;line-height:" + size +
+                                'px;border-radius:50%;background:rgba(49,130,189,0.8);color:#fff;' +
+                                'text-align:center;font-weight:bold">' + count + "</div>",
+                            className: "",
+                            iconSize: [size, size],
+                        }),
+                    });
+                    // zoom in on the cluster
+                    marker.on("click", function (e) {
+                        var map = e.target._map;
+                        map.setView(latlng, Math.min(map.getZoom() + 2, map.getMaxZoom()));
+                    });
+                    return marker;
+                }
+                if (properties.layer !== "facilities") {
+                    return L.circleMarker(latlng, { radius: 5 });
+                }
+                return pointToLayer(feature, latlng, context);
+            },
+        };
+    })(),
+});
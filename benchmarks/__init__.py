@@ -0,0 +1,6 @@
+"""
+Benchmarks of the facilities explorer on synthetic catalogues
+
+See benchmarks/run.py.
+
+"""
@@ -0,0 +1,403 @@
+"""
+Synthetic facility catalogues
+
+make_features generates facility features with the same structure as the
+per-facility YAML files in data/facilities: a location, a Markdown
+description and quote, infrastructure and available-data tag lists, and the
+country, name and type properties. make_catalogue turns them into the data
+frame prepare_data returns, so the explorer can be run on any number of
+facilities. write_corpus writes them as a facility directory, one YAML file
+per facility plus the concatenated facilities.yaml, to benchmark the loader
+and the build::
+
+    python -m benchmarks.catalogue /tmp/facilities 10000 --seed 1
+    python -m facilities.build /tmp/facilities --output /tmp/facilities/facilities.yaml --store-dir /tmp/facilities/compiled
+
+Countries, facility types and tags are drawn with long-tailed frequencies, and
+most data portals and datasets have no location, as in the real catalogue.
+The output only depends on the number of facilities and the seed.
+
+"""
+
+import argparse
+import itertools
+import os
+import random
+import sys
+
+# import pyyaml module
+import yaml
+
+from facilities.build import concatenate
+from facilities.schema import validate_features
+from facilities.store import features_to_frame
+
+# (country, west, south, east, north) of the areas facilities are placed in,
+# most frequent first
+COUNTRIES = [
+    ("United States of America", -124.0, 25.0, -67.0, 49.0),
+    ("Germany", 6.0, 47.5, 15.0, 55.0),
+    ("Netherlands", 3.4, 50.8, 7.2, 53.5),
+    ("United Kingdom", -7.5, 50.0, 1.7, 58.6),
+    ("Denmark", 8.0, 54.6, 12.6, 57.7),
+    ("Spain", -9.0, 36.0, 3.2, 43.7),
+    ("France", -4.5, 43.0, 7.5, 50.9),
+    ("Switzerland", 6.0, 45.8, 10.5, 47.8),
+    ("Sweden", 11.1, 55.4, 23.9, 68.9),
+    ("Norway", 5.0, 58.0, 30.0, 70.9),
+    ("Ireland", -10.4, 51.5, -6.0, 55.3),
+    ("China", 75.0, 20.0, 134.0, 53.0),
+    ("Portugal", -9.5, 37.0, -6.2, 42.1),
+    ("Belgium", 2.5, 49.5, 6.4, 51.5),
+    ("Finland", 20.6, 59.8, 31.5, 70.0),
+    ("Poland", 14.1, 49.0, 24.1, 54.8),
+    ("Italy", 6.6, 37.9, 18.5, 46.9),
+    ("Canada", -130.0, 43.0, -60.0, 60.0),
+    ("Japan", 129.0, 31.0, 145.0, 45.0),
+    ("India", 68.0, 8.0, 97.0, 35.0),
+    ("Austria", 9.5, 46.4, 17.1, 49.0),
+    ("Australia", 113.0, -39.0, 153.0, -11.0),
+    ("Brazil", -73.0, -33.0, -35.0, 5.0),
+    ("Greece", 20.1, 35.0, 28.2, 41.7),
+]
+
+# most frequent first
+TYPES = [
+    "wind farm",
+    "wind energy research center",
+    "wind turbine",
+    "data portal",
+    "dataset",
+    "satellite observation data",
+    "wind measurement site",
+    "met mast",
+    "wind atlas",
+    "drivetrain test facility",
+    "wind tunnel",
+    "marine and maritime research center",
+]
+
+# types of facility that usually have no location; they are often global
+LOCATIONLESS_TYPES = (
+    "data portal",
+    "dataset",
+    "satellite observation data",
+    "wind atlas",
+)
+
+INFRASTRUCTURE = [
+    "met mast",
+    "wind turbine",
+    "wind turbines",
+    "offshore wind turbines",
+    "lidars",
+    "nacelle lidar",
+    "scanning lidars",
+    "blade test facility",
+    "drivetrain test facility",
+    "grid connection simulator",
+    "offshore met mast",
+    "microgrid",
+    "battery storage",
+    "condition monitoring system",
+    "wind tunnel",
+    "floating lidars",
+    "sodars",
+    "radars",
+    "computing cluster",
+    "buoys",
+    "research vessels",
+    "weather stations",
+    "ceilometers",
+    "drones",
+]
+
+AVAILABLEDATA = [
+    "multiyear weather data",
+    "multiyear wind data",
+    "realtime weather observations",
+    "wind profiles",
+    "satellite observations",
+    "data portal",
+    "met mast data",
+    "lidar data",
+    "wind turbine data",
+    "SCADA data",
+    "structural data",
+    "offshore structure data",
+    "wave data",
+    "turbulence data",
+    "wake data",
+    "power curves",
+    "load measurements",
+    "electrical measurements",
+    "reanalysis data",
+    "wind atlas",
+]
+
+WORDS = (
+    "wind energy research offshore onshore measurement campaign turbine wake "
+    "boundary layer atmospheric flow lidar mast data long term validation "
+    "model testing blade drivetrain grid site complex terrain forest coastal "
+    "high resolution open access partners industry university institute"
+).split()
+
+
+def _cumulative_zipf(n, exponent=1.0):
+    # cumulative weights of a Zipf distribution over n ranked values, like the
+    # long-tailed tag frequencies of the real catalogue
+    return list(itertools.accumulate(1 / (rank + 1) ** exponent for rank in range(n)))
+
+
+COUNTRY_WEIGHTS = _cumulative_zipf(len(COUNTRIES))
+TYPE_WEIGHTS = _cumulative_zipf(len(TYPES), 0.7)
+INFRASTRUCTURE_WEIGHTS = _cumulative_zipf(len(INFRASTRUCTURE))
+AVAILABLEDATA_WEIGHTS = _cumulative_zipf(len(AVAILABLEDATA))
+
+
+def _choice(rng, values, weights):
+    return rng.choices(values, cum_weights=weights)[0]
+
+
+def _count(rng, low, mean, high):
+    # mostly low, sometimes many, as the tag lists of the real catalogue
+    return min(high, low + int(rng.expovariate(1 / (mean - low))))
+
+
+def _sentence(rng, n_words):
+    words = [rng.choice(WORDS) for _ in range(n_words)]
+    return " ".join(words).capitalize() + "."
+
+
+def _markdown(rng, name):
+    """
+    A Markdown text like the descriptions: paragraphs, emphasis, a list, a link
+
+    """
+
+    paragraphs = [
+        "**{}** {}".format(name, _sentence(rng, rng.randint(8, 20))),
+        " ".join(_sentence(rng, rng.randint(6, 18)) for _ in range(rng.randint(1, 4))),
+    ]
+    if rng.random() < 0.5:
+        paragraphs.append(
+            "\n".join(
+                "- {}".format(_sentence(rng, rng.randint(3, 8)))
+                for _ in range(rng.randint(2, 5))
+            )
+        )
+    if rng.random() < 0.5:
+        paragraphs.append(
+            "More at [the project page](https://example.org/{}).".format(
+                name.lower().replace(" ", "-")
+            )
+        )
+
+    return "\n\n".join(paragraphs)
+
+
+def _tags(rng, vocabulary, weights, n_tags):
+    # n_tags distinct tags, drawn by frequency
+    tags = []
+    while len(tags) < min(n_tags, len(vocabulary)):
+        tag = _choice(rng, vocabulary, weights)
+        if tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def make_feature(rng, i):
+    """
+    Generate one facility feature
+
+    Parameters
+    ----------
+    rng : random.Random
+        the random number generator
+    i : int
+        the facility's number, used to make its name unique
+
+    Returns
+    -------
+    dict
+        a feature as in the facility YAML files
+
+    """
+
+    facility_type = _choice(rng, TYPES, TYPE_WEIGHTS)
+    country, west, south, east, north = _choice(rng, COUNTRIES, COUNTRY_WEIGHTS)
+    name = "{} {} {}".format(rng.choice(WORDS).capitalize(), facility_type, i)
+
+    # data portals and the like mostly have no location
+    locationless = facility_type in LOCATIONLESS_TYPES
+    if rng.random() < (0.8 if locationless else 0.05):
+        coordinates = [None, None, None]
+        if locationless and rng.random() < 0.5:
+            country = "Global"
+    else:
+        coordinates = [
+            round(rng.uniform(west, east), 6),
+            round(rng.uniform(south, north), 6),
+            rng.choice([0, round(rng.uniform(0, 500), 1)]),
+        ]
+
+    homepage = "https://example.org/facilities/{}".format(i)
+    feature = {
+        "geometry": {
+            "coordinates": coordinates,
+            "type": "Point",
+            "icon": facility_type if rng.random() < 0.8 else None,
+            "note": "Location is approximate" if rng.random() < 0.1 else None,
+        },
+        "information": {
+            "description": _markdown(rng, name) if rng.random() < 0.7 else None,
+            "quote": _markdown(rng, name) if rng.random() < 0.5 else None,
+            "homepage": homepage if rng.random() < 0.9 else None,
+            "source": homepage if rng.random() < 0.6 else None,
+        },
+    }
+
+    if rng.random() < 0.75:
+        feature["infrastructure"] = {
+            "description": _sentence(rng, 10) if rng.random() < 0.3 else None,
+            "generic": _tags(
+                rng, INFRASTRUCTURE, INFRASTRUCTURE_WEIGHTS, _count(rng, 1, 2.5, 9)
+            ),
+            "specific": [
+                _sentence(rng, 3)[:-1] for _ in range(_count(rng, 0, 3.5, 18))
+            ],
+        }
+    if rng.random() < 0.45:
+        feature["availabledata"] = {
+            "description": _markdown(rng, name) if rng.random() < 0.3 else None,
+            "generic": _tags(
+                rng, AVAILABLEDATA, AVAILABLEDATA_WEIGHTS, _count(rng, 1, 1.7, 8)
+            ),
+            "specific": [_sentence(rng, 3)[:-1] for _ in range(_count(rng, 0, 3, 7))],
+            "portal": homepage + "/data" if rng.random() < 0.3 else None,
+        }
+
+    feature["properties"] = {
+        "country": country,
+        "name": name,
+        "type": facility_type,
+        "url": homepage if rng.random() < 0.2 else None,
+    }
+    feature["type"] = "Feature"
+
+    return feature
+
+
+def make_features(n_facilities, seed=0):
+    """
+    Generate facility features
+
+    Parameters
+    ----------
+    n_facilities : int
+        the number of facilities
+    seed : int
+        the random seed; the same seed gives the same features
+
+    Returns
+    -------
+    list of dict
+        features that pass facilities.schema.validate_features
+
+    """
+
+    rng = random.Random(seed)
+    features = [make_feature(rng, i) for i in range(n_facilities)]
+    validate_features(features, "synthetic")
+
+    return features
+
+
+def make_catalogue(n_facilities, seed=0):
+    """
+    Generate a facility data frame, as prepare_data returns it
+
+    """
+
+    return features_to_frame(make_features(n_facilities, seed))
+
+
+# -----------
+# Write files
+# -----------
+
+# the C dumper when PyYAML was built with libyaml, as facilities/loader.py
+Dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+
+def dump_feature(feature):
+    """
+    Write one feature as the text of a facility YAML file
+
+    """
+
+    return yaml.dump(
+        [feature], Dumper=Dumper, sort_keys=False, allow_unicode=True, width=1000
+    )
+
+
+def write_corpus(directory, n_facilities, seed=0):
+    """
+    Write a synthetic facility directory, like data/facilities
+
+    Each facility gets its own YAML file, named after the facility, and the
+    files are concatenated into facilities.yaml as python -m facilities.build
+    does. Compile the store with python -m facilities.build <directory>
+    --output <directory>/facilities.yaml.
+
+    Parameters
+    ----------
+    directory : str
+        the directory to write to; created if needed
+    n_facilities : int
+        the number of facilities
+    seed : int
+        the random seed; the same seed gives the same files
+
+    Returns
+    -------
+    str
+        the path of facilities.yaml
+
+    """
+
+    os.makedirs(directory, exist_ok=True)
+
+    texts = {}
+    for feature in make_features(n_facilities, seed):
+        name = feature["properties"]["name"] + ".yaml"
+        texts[name] = dump_feature(feature)
+        with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+            f.write(texts[name])
+
+    output = os.path.join(directory, "facilities.yaml")
+    with open(output, "w", encoding="utf-8") as f:
+        f.write(concatenate([texts[name] for name in sorted(texts)]))
+
+    return output
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.catalogue",
+        description="Write a synthetic facility directory: one YAML file per "
+        "facility and the concatenated facilities.yaml.",
+    )
+    parser.add_argument("directory")
+    parser.add_argument("n_facilities", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    output = write_corpus(args.directory, args.n_facilities, args.seed)
+    print("Wrote {} facilities to {}".format(args.n_facilities, output))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,450 @@
+"""
+Time the explorer's callbacks on synthetic catalogues
+
+Run it from the app root directory::
+
+    python -m benchmarks.run
+    python -m benchmarks.run --sizes 10 1000 --repeat 10
+    python -m benchmarks.run --baseline benchmarks/results/<earlier run>.json
+
+For each catalogue size, a synthetic dataset (see benchmarks/catalogue.py) is
+swapped into the explorer page. Each function is then called once with cold
+caches and `repeat` more times, and the size of its result as Dash would
+send it to the browser is recorded. The explorer's EXPLORER_* environment
+variables apply as in the app, so each mode can be measured.
+
+The results are written as JSON, by default to
+benchmarks/results/<git commit>.json. With --baseline the run is compared to
+an earlier one, and the exit status is 1 if any function got slower by more
+than --threshold.
+
+"""
+
+import argparse
+import datetime
+import importlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import dash
+from dash import html
+
+# import pandas (needed for the data table)
+import pandas as pd
+
+from plotly.io.json import to_json_plotly
+
+from benchmarks.catalogue import make_catalogue
+from facilities.dataset import Dataset
+
+DEFAULT_SIZES = (10, 1000, 10000, 100000)
+DEFAULT_REPEAT = 5
+RESULTS_DIR = "benchmarks/results"
+
+# a function is reported as slower if its median time grew by more than this
+# factor, and by more than MIN_REGRESSION_SECONDS (timer noise)
+DEFAULT_THRESHOLD = 1.25
+MIN_REGRESSION_SECONDS = 0.001
+
+
+# -----
+# Setup
+# -----
+
+
+def load_explorer():
+    """
+    Import the explorer page into a Dash app
+
+    Returns
+    -------
+    app : dash.Dash
+        the app
+    explorer : module
+        pages/explorer.py
+
+    """
+
+    app = dash.Dash(__name__, use_pages=True, pages_folder="")
+    explorer = importlib.import_module("pages.explorer")
+    # pages are only given their layout when Dash imports them itself
+    page = dash.page_registry[explorer.__name__]
+    page["layout"] = page["supplied_layout"] = explorer.layout
+    app.layout = html.Div(dash.page_container)
+
+    return app, explorer
+
+
+def install_catalogue(explorer, n_facilities, seed=0):
+    """
+    Make a synthetic catalogue the explorer's current dataset
+
+    Returns
+    -------
+    Dataset
+        the new snapshot
+
+    """
+
+    df = make_catalogue(n_facilities, seed)
+    data = Dataset(df, "synthetic-{}-{}".format(n_facilities, seed))
+    explorer.dataset_manager.swap(data)
+
+    return data
+
+
+def get_callback(client, output):
+    """
+    Find a callback by one of its outputs in /_dash-dependencies
+
+    """
+
+    for callback in json.loads(client.get("/_dash-dependencies").data):
+        if output in callback["output"]:
+            return callback
+
+    raise KeyError("no callback for {}".format(output))
+
+
+def dispatch(client, callback, values, triggered):
+    """
+    Run a callback through the Dash endpoint, as the browser would
+
+    Used for callbacks that read dash.callback_context.
+
+    Parameters
+    ----------
+    client : flask test client
+        a client of the app
+    callback : dict
+        the callback's entry in /_dash-dependencies
+    values : dict
+        "id.property" -> value of the inputs; missing inputs are None
+    triggered : str
+        "id.property" of the input that changed
+
+    Returns
+    -------
+    bytes
+        the response body
+
+    """
+
+    def props(dependencies):
+        return [
+            {
+                "id": d["id"],
+                "property": d["property"],
+                "value": values.get("{}.{}".format(d["id"], d["property"])),
+            }
+            for d in dependencies
+        ]
+
+    output = callback["output"]
+    outputs = [
+        {"id": o.rsplit(".", 1)[0], "property": o.rsplit(".", 1)[1]}
+        for o in output.strip(".").split("...")
+    ]
+    body = {
+        "output": output,
+        "outputs": outputs if output.startswith("..") else outputs[0],
+        "inputs": props(callback["inputs"]),
+        "state": props(callback["state"]),
+        "changedPropIds": [triggered],
+    }
+
+    response = client.post("/_dash-update-component", json=body)
+    if response.status_code != 200:
+        raise RuntimeError("{} failed: {}".format(output, response.status_code))
+
+    return response.data
+
+
+# -------
+# Timings
+# -------
+
+
+def payload_size(value):
+    """
+    Size in bytes of a callback result as Dash serializes it
+
+    """
+
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        # not sent to the browser
+        return None
+
+    return len(to_json_plotly(value).encode("utf-8"))
+
+
+def time_function(func, repeat):
+    """
+    Call a function once cold and then repeat times
+
+    Returns
+    -------
+    dict
+        "cold_seconds", "seconds" (min, median and max of the repeats) and
+        "payload_bytes"
+
+    """
+
+    start = time.perf_counter()
+    result = func()
+    cold = time.perf_counter() - start
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return {
+        "cold_seconds": cold,
+        "seconds": {
+            "min": min(times),
+            "median": statistics.median(times),
+            "max": max(times),
+        },
+        "payload_bytes": payload_size(result),
+    }
+
+
+def get_cases(explorer, client, data):
+    """
+    The functions to time on a dataset, with typical arguments
+
+    Returns
+    -------
+    list of (str, callable)
+
+    """
+
+    # a typical filter: the first two countries and the first facility type
+    countries = data.vocabularies["country"].values[:2]
+    types = data.vocabularies["type"].values[:1]
+    # the table starts with every facility
+    all_ids = explorer.get_facility_ids(data.df)
+    facility_id = int(data.df["facility_id"].iloc[0])
+    no_selection = pd.DataFrame(columns=data.df.columns)
+
+    select = get_callback(client, "selected-facility-store.data")
+
+    return [
+        (
+            "filter_facilities",
+            lambda: explorer.filter_facilities(
+                data.df, countries, types, [], [], data.facet_index
+            ),
+        ),
+        (
+            "create_facility_map_leaflet",
+            lambda: explorer.create_facility_map_leaflet(data.df, no_selection, data),
+        ),
+        ("update_table", lambda: explorer.update_table(all_ids)),
+        (
+            "select_facility",
+            lambda: dispatch(
+                client,
+                select,
+                {
+                    "clicked-facility-store.data": {
+                        "facility_id": facility_id,
+                        "clicked_at": 0,
+                    }
+                },
+                "clicked-facility-store.data",
+            ),
+        ),
+        (
+            "update_information_tabs",
+            lambda: render_information_tabs(explorer, data, facility_id),
+        ),
+    ]
+
+
+def render_information_tabs(explorer, data, facility_id):
+    """
+    Run update_information_tabs without its cache
+
+    The tabs are cached with the snapshot (and may be precomputed), so the
+    repeats would only time a cache lookup.
+
+    """
+
+    data.forget("information_tabs")
+    return explorer.update_information_tabs([facility_id])
+
+
+def run(sizes=DEFAULT_SIZES, repeat=DEFAULT_REPEAT, seed=0, log=print):
+    """
+    Time the explorer's callbacks at each catalogue size
+
+    Returns
+    -------
+    list of dict
+        one result per function and size: "function", "rows",
+        "setup_seconds" (generating and indexing the catalogue) and the
+        timings of time_function
+
+    """
+
+    app, explorer = load_explorer()
+    client = app.server.test_client()
+
+    results = []
+    for n_facilities in sizes:
+        start = time.perf_counter()
+        data = install_catalogue(explorer, n_facilities, seed)
+        setup = time.perf_counter() - start
+        log("{} facilities (setup {:.2f} s)".format(n_facilities, setup))
+
+        for name, func in get_cases(explorer, client, data):
+            result = time_function(func, repeat)
+            result.update(function=name, rows=n_facilities, setup_seconds=setup)
+            results.append(result)
+            log(
+                "  {:<28} cold {:9.4f} s  median {:9.4f} s  {:>12} bytes".format(
+                    name,
+                    result["cold_seconds"],
+                    result["seconds"]["median"],
+                    "-" if result["payload_bytes"] is None else result["payload_bytes"],
+                )
+            )
+
+    return results
+
+
+# -------
+# Results
+# -------
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def write_results(results, path, repeat, seed):
+    """
+    Write the results of a run, with what is needed to compare runs
+
+    """
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    document = {
+        "commit": get_commit(),
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "dash": dash.__version__,
+        "pandas": pd.__version__,
+        "repeat": repeat,
+        "seed": seed,
+        "environment": {
+            key: value
+            for key, value in sorted(os.environ.items())
+            if key.startswith("EXPLORER_")
+        },
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(document, f, indent=1)
+
+
+def compare(baseline, results, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare median times with an earlier run
+
+    Returns
+    -------
+    list of dict
+        the functions that got slower: "function", "rows", "baseline" and
+        "seconds" (median times) and "ratio"
+
+    """
+
+    previous = {
+        (r["function"], r["rows"]): r["seconds"]["median"] for r in baseline["results"]
+    }
+
+    slower = []
+    for result in results:
+        key = (result["function"], result["rows"])
+        if key not in previous:
+            continue
+        before, after = previous[key], result["seconds"]["median"]
+        if after > before * threshold and after - before > MIN_REGRESSION_SECONDS:
+            slower.append(
+                {
+                    "function": key[0],
+                    "rows": key[1],
+                    "baseline": before,
+                    "seconds": after,
+                    "ratio": after / before if before else float("inf"),
+                }
+            )
+
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.run",
+        description="Time the explorer's callbacks on synthetic catalogues.",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=list(DEFAULT_SIZES),
+        help="numbers of facilities (default: %(default)s)",
+    )
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output", help="results file (default: {}/<commit>.json)".format(RESULTS_DIR)
+    )
+    parser.add_argument("--baseline", help="results of an earlier run to compare to")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.repeat, args.seed)
+
+    output = args.output or os.path.join(RESULTS_DIR, "{}.json".format(get_commit()))
+    write_results(results, output, args.repeat, args.seed)
+    print("Wrote " + output)
+
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline) as f:
+        slower = compare(json.load(f), results, args.threshold)
+
+    for s in slower:
+        print(
+            "Slower: {} at {} rows: {:.4f} s -> {:.4f} s ({:.2f}x)".format(
+                s["function"], s["rows"], s["baseline"], s["seconds"], s["ratio"]
+            )
+        )
+
+    return 1 if slower else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,7 @@
+"""
+Data layer for the wind energy R&D facilities explorer
+
+Loads, compiles and indexes the facility catalogue in data/facilities so that
+the explorer page and the command-line build tools share the same code.
+
+"""
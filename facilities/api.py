@@ -0,0 +1,451 @@
+"""
+Read-only JSON API for the facility catalogue
+
+Flask routes served from the same snapshot, facet index and spatial index as
+the explorer page:
+
+    GET /api/facilities         the facilities matching the query parameters
+    GET /api/facilities/<slug>  one facility
+    GET /api/facets             the values of each facet, with their counts
+    GET /api/facet-index        the compact facet index the explorer filters
+                                with in the browser (EXPLORER_CLIENTSIDE_FILTERING)
+
+Query parameters of /api/facilities (all optional, and combined with "and"):
+
+    country, type, infrastructure, availabledata
+        facet values, as in the explorer's dropdowns. Repeat a parameter to
+        select several values; any of them may match.
+    bbox=west,south,east,north
+        only facilities inside the box, in degrees
+    lat, lon, radius_km
+        only facilities within radius_km of the point, nearest first
+    q
+        free text; only facilities whose descriptions match, best first
+        (unless there is also a radius)
+
+Each facility has a "slug", made from its name, that stays the same across
+data versions; use it to refer to a facility. The "facility_id" is a number
+made from the slug, for clients that need integer ids.
+
+Each response has a strong ETag made from the dataset hash and the query, so
+a client that sends it back in If-None-Match gets a 304 until the data
+changes. Bodies are serialized and compressed once (gzip, and brotli when the
+brotli module is installed) and kept in a small cache per snapshot.
+
+"""
+
+import gzip
+import hashlib
+import json
+import math
+
+# import numpy
+import numpy as np
+
+from flask import Blueprint, Response, jsonify, request
+
+from facilities.dataset import get_dataset_manager
+from facilities.index import (
+    FACETS,
+    bits_contain,
+    bits_to_positions,
+    encode_facet,
+    positions_to_bits,
+)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# number of serialized responses to keep per snapshot
+RESPONSE_CACHE_SIZE = 256
+
+api = Blueprint("facilities_api", __name__, url_prefix="/api")
+
+
+class QueryError(ValueError):
+    """
+    A query parameter could not be understood
+
+    """
+
+
+# -------
+# Records
+# -------
+
+
+def _value(value):
+    # NaN and missing values become null
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _list(value):
+    return value if isinstance(value, list) else []
+
+
+def get_facility_records(data, positions=None):
+    """
+    Convert the facilities of a snapshot to JSON-ready records
+
+    Parameters
+    ----------
+    data : Dataset
+        the snapshot
+    positions : array of int, optional
+        the row positions to convert; all rows by default
+
+    Returns
+    -------
+    list of dict
+        one record per row position
+
+    """
+
+    df = data.rows(positions)
+
+    records = []
+    for row in df.to_dict("records"):
+        records.append(
+            {
+                "facility_id": int(row["facility_id"]),
+                "slug": row["slug"],
+                "name": row["name"],
+                "country": row["country"],
+                "type": row["type_property"],
+                "icon": _value(row["icon"]),
+                "lat": _value(row["lat"]),
+                "lon": _value(row["lon"]),
+                "elev": _value(row["elev"]),
+                "description": _value(row["description"]),
+                "quote": _value(row["quote"]),
+                "note": _value(row["info_note"]),
+                "homepage_url": _value(row["homepage_url"]),
+                "source_url": _value(row["source_url"]),
+                "googlemaps_url": _value(row["googlemaps_url"]),
+                "infrastructure": _list(row["infrastructure_list"]),
+                "infrastructure_specific": _list(row["infrastructure_specific"]),
+                "availabledata": _list(row["availabledata_list"]),
+                "availabledata_specific": _list(row["availabledata_specific"]),
+                "availabledata_description": _value(row["availabledata_description"]),
+                "portal_url": _value(row["portal_url"]),
+            }
+        )
+
+    return records
+
+
+# -------
+# Queries
+# -------
+
+
+def _floats(text, n, name):
+    try:
+        values = [float(v) for v in text.split(",")]
+    except ValueError:
+        values = []
+    if len(values) != n or not all(math.isfinite(v) for v in values):
+        raise QueryError("{} must be {} comma-separated numbers".format(name, n))
+    return values
+
+
+def parse_query(args):
+    """
+    Read the query parameters of /api/facilities
+
+    Parameters
+    ----------
+    args : MultiDict
+        the request's query parameters
+
+    Returns
+    -------
+    dict
+        the normalized query: "facets" (facet -> sorted values), "bbox"
+        ([west, south, east, north] or None), "radius" ([lat, lon, km] or
+        None) and "q" (text or None). Equal queries give equal dicts, whatever
+        the parameter order.
+
+    Raises
+    ------
+    QueryError
+        if a parameter is malformed
+
+    """
+
+    facets = {
+        facet: sorted(set(args.getlist(facet)))
+        for facet in FACETS
+        if args.getlist(facet)
+    }
+
+    bbox = None
+    if args.get("bbox"):
+        bbox = _floats(args["bbox"], 4, "bbox")
+
+    radius = None
+    radius_args = [args.get(name) for name in ("lat", "lon", "radius_km")]
+    if any(radius_args):
+        if not all(radius_args):
+            raise QueryError("lat, lon and radius_km must be given together")
+        radius = _floats(",".join(radius_args), 3, "lat, lon and radius_km")
+        if not (-90 <= radius[0] <= 90 and radius[2] > 0):
+            raise QueryError("lat must be in [-90, 90] and radius_km positive")
+
+    q = " ".join(args.get("q", "").split()) or None
+
+    return {"facets": facets, "bbox": bbox, "radius": radius, "q": q}
+
+
+def query_facilities(data, query):
+    """
+    Find the facilities matching a query
+
+    Returns
+    -------
+    positions : numpy array
+        row positions in data.df; nearest first for radius queries, best
+        first for text queries, in table order otherwise
+    distances : numpy array or None
+        distances in km for radius queries
+
+    """
+
+    bits = data.facet_index.match(query["facets"])
+
+    found = None
+    if query.get("q"):
+        found, scores = data.search_index.search(query["q"])
+        bits &= positions_to_bits(found, len(data.df))
+
+    if query["radius"]:
+        lat, lon, radius_km = query["radius"]
+        positions, distances = data.spatial_index.query_radius(lat, lon, radius_km)
+        match = bits_contain(bits, positions)
+        positions, distances = positions[match], distances[match]
+    elif found is not None:
+        positions = found[bits_contain(bits, found)]
+        distances = None
+    else:
+        positions = bits_to_positions(bits, len(data.df))
+        distances = None
+
+    if query["bbox"]:
+        west, south, east, north = query["bbox"]
+        inside = data.spatial_index.query_bbox(south, west, north, east)
+        match = np.isin(positions, inside)
+        positions = positions[match]
+        if distances is not None:
+            distances = distances[match]
+
+    return positions, distances
+
+
+def get_facet_vocabularies(data):
+    """
+    List the values of every facet and how many facilities have each
+
+    The values come from the snapshot's vocabularies, in dropdown order.
+
+    """
+
+    counts = data.facet_index.counts({})
+
+    return {
+        "dataset_hash": data.dataset_hash,
+        "facets": {
+            facet: [
+                {"value": value, "count": count}
+                for value, count in zip(vocabulary.values, counts[facet].tolist())
+            ]
+            for facet, vocabulary in data.vocabularies.items()
+        },
+    }
+
+
+def get_browser_index(data):
+    """
+    Create the compact facet index for filtering in the browser
+
+    Each facet is dictionary-encoded (its values plus an integer code per
+    row, see Vocabulary.to_dict), so the payload grows with the number of
+    facilities but not with the length of their descriptions. Icons are
+    encoded by name; the explorer adds the icon images itself.
+
+    Returns
+    -------
+    dict
+        JSON-serialisable index used by assets/explorer.js
+
+    """
+
+    df = data.df
+
+    return {
+        "version": data.dataset_hash,
+        "facility_id": df["facility_id"].tolist(),
+        "name": df["name"].tolist(),
+        "lat": [_value(v) for v in df["lat"].tolist()],
+        "lon": [_value(v) for v in df["lon"].tolist()],
+        **{facet: data.vocabularies[facet].to_dict() for facet in FACETS},
+        "icon": encode_facet(df["icon"]),
+    }
+
+
+# ---------
+# Responses
+# ---------
+
+
+def _query_key(query):
+    return json.dumps(query, sort_keys=True)
+
+
+def get_etag(data, key):
+    """
+    Strong ETag of a response: changes with the dataset and the query
+
+    """
+
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    return "{}-{}".format(data.dataset_hash, digest)
+
+
+def get_bodies(data, key):
+    """
+    Serialize and compress one response, or take it from the snapshot's cache
+
+    The cache is kept with the snapshot, so it is dropped after a reload.
+
+    Returns
+    -------
+    dict
+        content coding ("identity", "gzip" and, with brotli, "br") -> bytes
+
+    """
+
+    return data.cached("api_bodies", key, create_bodies, RESPONSE_CACHE_SIZE)
+
+
+def create_bodies(data, key):
+    """
+    Serialize and compress one response
+
+    """
+
+    query = json.loads(key)
+
+    if "slug" in query:
+        content = get_facility_records(data, [data.slug_positions[query["slug"]]])[0]
+    elif query.get("vocabularies"):
+        content = get_facet_vocabularies(data)
+    elif query.get("facet_index"):
+        content = get_browser_index(data)
+    else:
+        positions, distances = query_facilities(data, query)
+        facilities = get_facility_records(data, positions)
+        if distances is not None:
+            facilities = [
+                dict(record, distance_km=round(float(d), 3))
+                for record, d in zip(facilities, distances)
+            ]
+        content = {
+            "dataset_hash": data.dataset_hash,
+            "count": len(facilities),
+            "facilities": facilities,
+        }
+
+    body = json.dumps(content, separators=(",", ":")).encode("utf-8")
+    bodies = {"identity": body, "gzip": gzip.compress(body, mtime=0)}
+    if brotli is not None:
+        bodies["br"] = brotli.compress(body)
+
+    return bodies
+
+
+def _choose_encoding(available):
+    accepted = request.accept_encodings
+    for coding in ("br", "gzip"):
+        if coding in available and accepted[coding]:
+            return coding
+    return "identity"
+
+
+def send_json(data, key):
+    """
+    Answer a GET with a cached body, or with 304 if the client has it
+
+    The ETag of each content coding is different, as the bytes are.
+
+    """
+
+    etag = get_etag(data, key)
+    available = (
+        ("identity", "gzip", "br") if brotli is not None else ("identity", "gzip")
+    )
+    encoding = _choose_encoding(available)
+    if encoding != "identity":
+        etag += "-" + encoding
+
+    headers = {
+        "ETag": '"{}"'.format(etag),
+        "Vary": "Accept-Encoding",
+        "Cache-Control": "no-cache",
+    }
+
+    # no serialization at all for a repeat request
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+
+    body = get_bodies(data, key)[encoding]
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+
+    return Response(body, mimetype="application/json", headers=headers)
+
+
+# ------
+# Routes
+# ------
+
+
+@api.route("/facilities")
+def facilities():
+    data = get_dataset_manager().current()
+
+    try:
+        query = parse_query(request.args)
+    except QueryError as e:
+        return jsonify(error=str(e)), 400
+
+    return send_json(data, _query_key(query))
+
+
+@api.route("/facilities/<slug>")
+def facility(slug):
+    data = get_dataset_manager().current()
+
+    if slug not in data.slug_positions:
+        return jsonify(error="no facility {!r}".format(slug)), 404
+
+    return send_json(data, _query_key({"slug": slug}))
+
+
+@api.route("/facets")
+def facets():
+    data = get_dataset_manager().current()
+
+    return send_json(data, _query_key({"vocabularies": True}))
+
+
+@api.route("/facet-index")
+def facet_index():
+    data = get_dataset_manager().current()
+
+    return send_json(data, _query_key({"facet_index": True}))
@@ -0,0 +1,344 @@
+"""
+Incremental build of facilities.yaml and its compiled store
+
+Each facility has its own YAML file in data/facilities. This module
+concatenates them into facilities.yaml (the file the explorer reads) and
+compiles the store next to it. A manifest of per-file content hashes, with
+the normalized rows of the facilities in each file, is kept in the store
+directory, so a rebuild only parses, validates and normalizes the files
+that changed. Changed files are parsed in parallel, with the C YAML loader
+when PyYAML has one (see facilities/loader.py).
+
+Run it from the app root directory::
+
+    python -m facilities.build
+
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import sys
+import time
+
+# import pyyaml module
+import yaml
+
+from facilities.loader import Loader, load_yaml
+from facilities.schema import SchemaError, validate_features
+from facilities.store import (
+    DEFAULT_DATA_SOURCE,
+    DEFAULT_STORE_DIR,
+    feature_to_row,
+    hash_sources,
+    remove_stale_stores,
+    rows_to_frame,
+    store_lock,
+    write_store,
+)
+
+# bump this whenever the manifest layout or the facility rows change
+MANIFEST_FORMAT = 5
+MANIFEST_NAME = "sources.json"
+
+HEADER = "---\ntype: FeatureCollection\nfeatures:\n"
+
+
+class BuildError(Exception):
+    """
+    A facility file could not be parsed or does not match the schema
+
+    """
+
+
+# --------------
+# Facility files
+# --------------
+
+
+def find_sources(source_dir, output):
+    """
+    List the facility files to concatenate
+
+    The output file is never one of them, even when it lies in source_dir.
+
+    Returns
+    -------
+    list of str
+        file names in source_dir, sorted so that the output is reproducible
+
+    """
+
+    output = os.path.abspath(output)
+
+    return sorted(
+        entry.name
+        for entry in os.scandir(source_dir)
+        if entry.is_file()
+        and entry.name.endswith(".yaml")
+        and os.path.abspath(entry.path) != output
+    )
+
+
+def parse_source(path):
+    """
+    Parse, validate and normalize one facility file
+
+    Runs in the worker processes, so it only takes and returns plain data.
+
+    Returns
+    -------
+    list of list
+        the rows of the facilities in the file (see
+        facilities.store.feature_to_row)
+
+    """
+
+    name = os.path.basename(path)
+    try:
+        features = load_yaml(path)
+    except yaml.YAMLError as e:
+        raise BuildError("{}: {}".format(name, e)) from None
+
+    # check the schema once, here, rather than when the page renders
+    try:
+        validate_features(features, name)
+    except SchemaError as e:
+        raise BuildError(str(e)) from None
+
+    rows = [feature_to_row(feature) for feature in features]
+
+    # the rows are cached as JSON, so check now that they can be
+    json.dumps(rows)
+
+    return rows
+
+
+def parse_sources(paths, jobs=None):
+    """
+    Parse facility files, in parallel if there are several
+
+    Returns
+    -------
+    list
+        the rows of each file, in the order of paths
+
+    """
+
+    if len(paths) < 2 or jobs == 1:
+        return [parse_source(path) for path in paths]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(parse_source, paths))
+
+
+# --------
+# Manifest
+# --------
+
+
+def read_manifest(path):
+    """
+    Read the manifest of a previous build; empty if there is none
+
+    """
+
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if manifest.get("format") != MANIFEST_FORMAT:
+        return {}
+
+    return manifest.get("files", {})
+
+
+def write_manifest(path, files):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = "{}.tmp-{}".format(path, os.getpid())
+    with open(tmp, "w") as f:
+        # json.dump encodes in Python; dumps uses the C encoder
+        f.write(json.dumps({"format": MANIFEST_FORMAT, "files": files}))
+    os.replace(tmp, path)
+
+
+def concatenate(texts):
+    """
+    Join the texts of facility files into the text of facilities.yaml
+
+    """
+
+    return HEADER + "".join(text + "\n\n" for text in texts)
+
+
+def _write_if_changed(path, text):
+    """
+    Write a file unless it already has this content
+
+    Leaving an unchanged file alone keeps its modification time, so running
+    apps do not reload it.
+
+    """
+
+    data = text.encode("utf-8")
+    try:
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return False
+    except OSError:
+        pass
+
+    tmp = "{}.tmp-{}".format(path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+    return True
+
+
+# -----
+# Build
+# -----
+
+
+def build(
+    source_dir=None,
+    output=DEFAULT_DATA_SOURCE,
+    store_dir=DEFAULT_STORE_DIR,
+    jobs=None,
+    force=False,
+):
+    """
+    Build facilities.yaml and the compiled store from the facility files
+
+    The build holds the store_lock of store_dir, so when several worker
+    processes see the same change, one builds and the others wait for it and
+    then find the manifest up to date.
+
+    Parameters
+    ----------
+    source_dir : str, optional
+        directory of the facility files; defaults to the directory of output
+    output : str
+        path of the concatenated facilities YAML file
+    store_dir : str
+        directory holding the compiled stores and the build manifest
+    jobs : int, optional
+        number of parser processes; defaults to the number of CPUs
+    force : bool
+        parse every file, ignoring the manifest
+
+    Returns
+    -------
+    dict
+        "files" (number of facility files), "parsed" (number re-parsed),
+        "facilities", "dataset_hash", "store" (path of the compiled store),
+        "parse_seconds" (time spent parsing) and "seconds" (total time)
+
+    """
+
+    with store_lock(store_dir, exclusive=True):
+        return _build(source_dir, output, store_dir, jobs, force)
+
+
+def _build(source_dir, output, store_dir, jobs, force):
+    start = time.perf_counter()
+
+    if source_dir is None:
+        source_dir = os.path.dirname(output) or "."
+
+    manifest_path = os.path.join(store_dir, MANIFEST_NAME)
+    previous = {} if force else read_manifest(manifest_path)
+
+    names = find_sources(source_dir, output)
+    texts = {}
+    hashes = {}
+    for name in names:
+        with open(os.path.join(source_dir, name), "rb") as f:
+            data = f.read()
+        texts[name] = data.decode("utf-8")
+        hashes[name] = hashlib.sha256(data).hexdigest()
+
+    changed = [
+        name for name in names if previous.get(name, {}).get("sha256") != hashes[name]
+    ]
+    parse_start = time.perf_counter()
+    parsed = parse_sources([os.path.join(source_dir, name) for name in changed], jobs)
+    parse_seconds = time.perf_counter() - parse_start
+
+    files = {name: previous[name] for name in names if name not in changed}
+    for name, rows in zip(changed, parsed):
+        files[name] = {"sha256": hashes[name], "rows": rows}
+
+    # the header followed by every facility file, in a stable order
+    _write_if_changed(output, concatenate([texts[name] for name in names]))
+
+    rows = [row for name in names for row in files[name]["rows"]]
+    dataset_hash = hash_sources(output)
+    store = os.path.join(store_dir, dataset_hash)
+    if not os.path.exists(os.path.join(store, "manifest.json")):
+        store = write_store(rows_to_frame(rows), store_dir, dataset_hash)
+    remove_stale_stores(store_dir, keep=dataset_hash)
+
+    # only once everything has been written, so a failed build is retried
+    if changed or set(previous) != set(names):
+        write_manifest(manifest_path, files)
+
+    return {
+        "files": len(names),
+        "parsed": len(changed),
+        "facilities": len(rows),
+        "dataset_hash": dataset_hash,
+        "store": store,
+        "parse_seconds": parse_seconds,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m facilities.build",
+        description="Concatenate the facility files into facilities.yaml and "
+        "compile the store the explorer loads.",
+    )
+    parser.add_argument(
+        "source_dir",
+        nargs="?",
+        help="directory of the facility files (default: the output's directory)",
+    )
+    parser.add_argument("--output", default=DEFAULT_DATA_SOURCE)
+    parser.add_argument("--store-dir", default=DEFAULT_STORE_DIR)
+    parser.add_argument("--jobs", type=int, help="number of parser processes")
+    parser.add_argument(
+        "--force", action="store_true", help="re-parse every facility file"
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        result = build(
+            args.source_dir, args.output, args.store_dir, args.jobs, args.force
+        )
+    except BuildError as e:
+        print("Error: {}".format(e), file=sys.stderr)
+        return 1
+
+    print(
+        "Parsed {} of {} files in {:.2f} s with {}".format(
+            result["parsed"], result["files"], result["parse_seconds"], Loader.__name__
+        )
+    )
+    print(
+        "Wrote {} facilities to {} and {} in {:.2f} s".format(
+            result["facilities"], args.output, result["store"], result["seconds"]
+        )
+    )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
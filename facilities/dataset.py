@@ -0,0 +1,396 @@
+"""
+Immutable snapshots of the facility data, reloaded when the files change
+
+A Dataset bundles the facility data frame with every index built from it.
+The DatasetManager holds the current snapshot and, when started, polls the
+modification times of the files in data/facilities. When they change it
+rebuilds facilities.yaml and the compiled store from the per-facility files
+(incrementally, see facilities/build.py; with several worker processes, one
+of them builds while the others wait for it), builds a new snapshot in a
+background thread and swaps it in with a single assignment. Code that took a
+snapshot keeps using it until it is done, so a request never sees a mix of
+two dataset versions.
+
+"""
+
+import collections
+import os
+import sys
+import threading
+import traceback
+
+# import numpy
+import numpy as np
+
+from facilities.build import build, find_sources
+from facilities.index import get_facet_index
+from facilities.search import get_search_index
+from facilities.spatial import get_spatial_index
+from facilities.store import (
+    DEFAULT_DATA_SOURCE,
+    DEFAULT_STORE_DIR,
+    hash_sources,
+    load_facilities,
+    remove_stale_stores,
+    store_lock,
+)
+from facilities.table import get_table_index
+from facilities.vocabulary import get_vocabularies
+
+
+class Dataset:
+    """
+    One version of the facility data and its indexes
+
+    Treat it as read-only: it may be used by several requests at once.
+    Snapshots compare equal when they hold the same dataset version.
+
+    Parameters
+    ----------
+    df : data frame
+        the facility data, as returned by load_facilities
+    dataset_hash : str
+        content hash of the data
+    store_path : str, optional
+        the compiled store of this version, for the saved search index and
+        vocabularies
+    details : EncodedColumns, optional
+        the columns of the store not in df, decoded by rows
+
+    """
+
+    def __init__(self, df, dataset_hash, store_path=None, details=None):
+        self.df = df
+        self.dataset_hash = dataset_hash
+        self.details = details
+
+        self.vocabularies = get_vocabularies(df, dataset_hash, store_path)
+        self.facet_index = get_facet_index(df, dataset_hash, self.vocabularies)
+        self.spatial_index = get_spatial_index(df, dataset_hash)
+        self.search_index = get_search_index(df, dataset_hash, store_path)
+        self.table_index = get_table_index(df, dataset_hash)
+
+        # facility_id -> row position
+        self.facility_positions = {
+            int(facility_id): position
+            for position, facility_id in enumerate(df["facility_id"])
+        }
+
+        # slug -> row position; slugs (and the facility_id made from them)
+        # stay the same across reloads
+        self.slug_positions = {
+            slug: position for position, slug in enumerate(df["slug"])
+        }
+
+        self._derived = {}
+        self._lock = threading.RLock()
+
+    def __eq__(self, other):
+        return isinstance(other, Dataset) and other.dataset_hash == self.dataset_hash
+
+    def __hash__(self):
+        return hash(self.dataset_hash)
+
+    def positions(self, facility_ids):
+        """
+        Get the row positions of facilities; unknown ids are skipped
+
+        """
+
+        return np.array(
+            [
+                self.facility_positions[i]
+                for i in facility_ids
+                if i in self.facility_positions
+            ],
+            dtype=np.int64,
+        )
+
+    def rows(self, positions=None):
+        """
+        Get some rows with every column, including the details
+
+        Use it for the facilities being shown or exported; df lacks the
+        columns that are left encoded in the compiled store.
+
+        Parameters
+        ----------
+        positions : array of int, optional
+            the row positions; all rows by default
+
+        Returns
+        -------
+        dff : data frame
+            the rows, in the order of positions
+
+        """
+
+        if positions is None:
+            positions = np.arange(len(self.df))
+
+        dff = self.df.iloc[positions]
+        if self.details is None:
+            return dff
+
+        return dff.assign(**self.details.take(positions))
+
+    def derived(self, name, func):
+        """
+        Compute something from this snapshot once
+
+        Parameters
+        ----------
+        name : hashable
+            key of the result
+        func : callable
+            called with the snapshot the first time name is requested
+
+        """
+
+        with self._lock:
+            if name not in self._derived:
+                self._derived[name] = func(self)
+
+            return self._derived[name]
+
+    def cached(self, name, key, func, maxsize=None):
+        """
+        Compute something from this snapshot once per key
+
+        The results are kept with the snapshot, so they are dropped with it
+        after a reload instead of holding on to old data.
+
+        Parameters
+        ----------
+        name : hashable
+            name of the cache
+        key : hashable
+            key of the result within the cache
+        func : callable
+            called as func(snapshot, key) when the key is not cached
+        maxsize : int, optional
+            keep at most this many results, dropping the least recently used;
+            no limit by default
+
+        """
+
+        with self._lock:
+            cache = self._derived.setdefault(name, collections.OrderedDict())
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key]
+
+        # outside the lock, so that requests do not wait for each other
+        value = func(self, key)
+
+        with self._lock:
+            cache[key] = value
+            if maxsize is not None and len(cache) > maxsize:
+                cache.popitem(last=False)
+
+        return value
+
+    def forget(self, name):
+        """
+        Drop a result of derived or a cache of cached, so it is computed again
+
+        """
+
+        with self._lock:
+            self._derived.pop(name, None)
+
+
+def load_dataset(data_source=DEFAULT_DATA_SOURCE, store_dir=DEFAULT_STORE_DIR):
+    """
+    Load the facilities and build a snapshot
+
+    The compiled store is used if it is up to date. It is read under a shared
+    store_lock, so a build in another worker cannot delete it meanwhile.
+
+    """
+
+    with store_lock(store_dir):
+        df, details, dataset_hash = load_facilities(data_source, store_dir)
+        dataset = Dataset(
+            df, dataset_hash, os.path.join(store_dir, dataset_hash), details
+        )
+
+    # load_facilities may have compiled a new store; drop the old ones, unless
+    # another worker is reading one (the next build or load will)
+    with store_lock(store_dir, exclusive=True, blocking=False) as locked:
+        if locked:
+            remove_stale_stores(store_dir, keep=dataset_hash)
+
+    return dataset
+
+
+class DatasetManager:
+    """
+    Hold the current Dataset and reload it when the facility files change
+
+    Parameters
+    ----------
+    data_source : str
+        path to the concatenated facilities YAML file
+    store_dir : str
+        directory holding the compiled stores
+    interval : float
+        seconds between checks of the modification times
+
+    """
+
+    def __init__(
+        self,
+        data_source=DEFAULT_DATA_SOURCE,
+        store_dir=DEFAULT_STORE_DIR,
+        interval=5.0,
+    ):
+        self.data_source = data_source
+        self.store_dir = store_dir
+        self.watch_dir = os.path.dirname(data_source) or "."
+        self.interval = interval
+
+        self._listeners = []
+        self._thread = None
+        self._stop = threading.Event()
+
+        self._mtimes = self.scan()
+        self._snapshot = load_dataset(data_source, store_dir)
+
+    def current(self):
+        """
+        Return the current snapshot
+
+        Take it once per request and use it throughout.
+
+        """
+
+        return self._snapshot
+
+    def on_reload(self, func):
+        """
+        Register a function to call with each new snapshot
+
+        The function runs in the reloading thread before the snapshot is
+        swapped in, so it can warm caches. Can be used as a decorator.
+
+        """
+
+        self._listeners.append(func)
+        return func
+
+    def scan(self):
+        """
+        Get the modification times of the watched YAML files
+
+        """
+
+        mtimes = {}
+        with os.scandir(self.watch_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith((".yaml", ".yml")):
+                    mtimes[entry.name] = entry.stat().st_mtime_ns
+
+        return mtimes
+
+    def check(self):
+        """
+        Reload the dataset if any watched file has changed
+
+        Returns
+        -------
+        bool
+            True if a new snapshot was swapped in
+
+        """
+
+        if self.scan() == self._mtimes:
+            return False
+
+        # concatenate and compile the changed facility files, if the data
+        # comes from per-facility files. The parsing is done in this thread: a
+        # web worker should not start processes. The build holds the store
+        # lock, so the other workers wait for it and then find nothing to do.
+        if find_sources(self.watch_dir, self.data_source):
+            build(output=self.data_source, store_dir=self.store_dir, jobs=1)
+
+        # the build may have rewritten facilities.yaml
+        mtimes = self.scan()
+
+        if hash_sources(self.data_source) == self._snapshot.dataset_hash:
+            # only touched
+            self._mtimes = mtimes
+            return False
+
+        dataset = load_dataset(self.data_source, self.store_dir)
+
+        # only remember the times once the files could be built and loaded,
+        # so that a half-written file is tried again
+        self._mtimes = mtimes
+
+        self.swap(dataset)
+
+        return True
+
+    def swap(self, dataset):
+        """
+        Make a snapshot the current one
+
+        The reload listeners run first, as for a reload from the files. Used
+        by check, and by the benchmarks to install synthetic data.
+
+        """
+
+        for func in self._listeners:
+            func(dataset)
+
+        self._snapshot = dataset
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                # keep serving the current snapshot
+                traceback.print_exc(file=sys.stderr)
+
+    def start(self):
+        """
+        Start checking for changes in a background thread
+
+        """
+
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="facilities-reload", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+# one manager per data source, shared by the explorer page and the API
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_dataset_manager(
+    data_source=DEFAULT_DATA_SOURCE, store_dir=DEFAULT_STORE_DIR, interval=5.0
+):
+    """
+    Return the DatasetManager of a data source, creating it on first use
+
+    The interval only applies to the call that creates the manager.
+
+    """
+
+    key = (os.path.abspath(data_source), os.path.abspath(store_dir))
+    with _managers_lock:
+        if key not in _managers:
+            _managers[key] = DatasetManager(data_source, store_dir, interval)
+
+        return _managers[key]
@@ -0,0 +1,297 @@
+"""
+Downloads of the filtered facilities as CSV, GeoJSON or Parquet
+
+    GET /api/facilities.csv
+    GET /api/facilities.geojson
+    GET /api/facilities.parquet     only if pyarrow is installed
+
+take the query parameters of /api/facilities (see facilities/api.py) and
+return every field of the matching facilities, including the infrastructure
+and available-data lists. The file is written while it is sent: the matching
+rows are converted EXPORT_CHUNK_ROWS at a time, so memory use does not grow
+with the size of the export and the first bytes go out at once. The snapshot
+of the request is used until the end, even if the data is reloaded meanwhile.
+
+In CSV files, lists are JSON text. Parquet files have list columns, with
+nested lists flattened.
+
+"""
+
+import csv
+import io
+import json
+
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+
+from facilities.api import (
+    QueryError,
+    get_etag,
+    get_facility_records,
+    parse_query,
+    query_facilities,
+)
+from facilities.dataset import get_dataset_manager
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+EXPORT_CHUNK_ROWS = 1000
+
+# the fields of get_facility_records, in file order, and their kinds
+FIELDS = [
+    ("facility_id", "int"),
+    ("slug", "str"),
+    ("name", "str"),
+    ("country", "str"),
+    ("type", "str"),
+    ("icon", "str"),
+    ("lat", "float"),
+    ("lon", "float"),
+    ("elev", "float"),
+    ("description", "str"),
+    ("quote", "str"),
+    ("note", "str"),
+    ("homepage_url", "str"),
+    ("source_url", "str"),
+    ("googlemaps_url", "str"),
+    ("infrastructure", "list"),
+    ("infrastructure_specific", "list"),
+    ("availabledata", "list"),
+    ("availabledata_specific", "list"),
+    ("availabledata_description", "str"),
+    ("portal_url", "str"),
+]
+
+export = Blueprint("facility_export", __name__)
+
+
+def iter_records(data, positions, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Convert facilities to records a chunk at a time
+
+    Yields
+    ------
+    list of dict
+        the records of up to chunk_rows positions, in order
+
+    """
+
+    for start in range(0, len(positions), chunk_rows):
+        yield get_facility_records(data, positions[start : start + chunk_rows])
+
+
+# -------
+# Writers
+# -------
+
+
+def _csv_value(value):
+    if isinstance(value, list):
+        return json.dumps(value, ensure_ascii=False)
+    return "" if value is None else value
+
+
+def write_csv(chunks):
+    """
+    Write records as CSV
+
+    Yields
+    ------
+    str
+        the header, then the rows of each chunk
+
+    """
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow([name for name, kind in FIELDS])
+    for records in chunks:
+        for record in records:
+            writer.writerow([_csv_value(record[name]) for name, kind in FIELDS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+def to_feature(record):
+    """
+    Turn a record into a GeoJSON feature; no geometry without a location
+
+    """
+
+    properties = {
+        name: record[name]
+        for name, kind in FIELDS
+        if name not in ("lat", "lon", "elev")
+    }
+
+    geometry = None
+    if record["lat"] is not None and record["lon"] is not None:
+        coordinates = [record["lon"], record["lat"]]
+        if record["elev"] is not None:
+            coordinates.append(record["elev"])
+        geometry = {"type": "Point", "coordinates": coordinates}
+
+    return {
+        "type": "Feature",
+        "id": record["slug"],
+        "geometry": geometry,
+        "properties": properties,
+    }
+
+
+def write_geojson(chunks):
+    """
+    Write records as a GeoJSON feature collection
+
+    Yields
+    ------
+    str
+        the opening of the collection, the features of each chunk and the end
+
+    """
+
+    yield '{"type":"FeatureCollection","features":['
+
+    separator = ""
+    for records in chunks:
+        features = [
+            json.dumps(to_feature(record), separators=(",", ":")) for record in records
+        ]
+        if features:
+            yield separator + ",".join(features)
+            separator = ","
+
+    yield "]}"
+
+
+class _StreamSink:
+    """
+    A write-only file that hands out what has been written so far
+
+    Parquet writers need the position in the file, so it is counted here
+    rather than taken from a buffer that is emptied.
+
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _flatten(value):
+    if not isinstance(value, list):
+        return value
+    items = []
+    for item in value:
+        items.extend(_flatten(item) if isinstance(item, list) else [item])
+    return items
+
+
+def get_parquet_schema():
+    types = {
+        "int": pa.int64(),
+        "float": pa.float64(),
+        "str": pa.string(),
+        "list": pa.list_(pa.string()),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in FIELDS])
+
+
+def write_parquet(chunks):
+    """
+    Write records as Parquet, one row group per chunk
+
+    Yields
+    ------
+    bytes
+        the file, as each row group is written
+
+    """
+
+    schema = get_parquet_schema()
+    sink = _StreamSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+
+    for records in chunks:
+        columns = {
+            name: [_flatten(r[name]) if kind == "list" else r[name] for r in records]
+            for name, kind in FIELDS
+        }
+        writer.write_table(pa.table(columns, schema=schema))
+        yield sink.drain()
+
+    writer.close()
+    yield sink.drain()
+
+
+# (writer, MIME type) of each file extension
+FORMATS = {
+    "csv": (write_csv, "text/csv"),
+    "geojson": (write_geojson, "application/geo+json"),
+}
+if pa is not None:
+    FORMATS["parquet"] = (write_parquet, "application/vnd.apache.parquet")
+
+
+# -----
+# Route
+# -----
+
+
+@export.route("/api/facilities.<extension>")
+def download(extension):
+    if extension not in FORMATS:
+        return jsonify(error="no export format {}".format(extension)), 404
+
+    try:
+        query = parse_query(request.args)
+    except QueryError as e:
+        return jsonify(error=str(e)), 400
+
+    data = get_dataset_manager().current()
+
+    etag = get_etag(data, json.dumps(dict(query, export=extension), sort_keys=True))
+    headers = {
+        "ETag": '"{}"'.format(etag),
+        "Cache-Control": "no-cache",
+        "Content-Disposition": 'attachment; filename="facilities.{}"'.format(extension),
+    }
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+
+    positions, distances = query_facilities(data, query)
+    write, mimetype = FORMATS[extension]
+
+    return Response(
+        stream_with_context(write(iter_records(data, positions))),
+        mimetype=mimetype,
+        headers=headers,
+    )
@@ -0,0 +1,236 @@
+"""
+Bitset inverted index over the explorer's filter facets
+
+Every value of every facet (country, facility type, infrastructure tag and
+available-data tag) maps to a packed bitset of the facility rows that have
+it, stored as NumPy uint64 words. Filtering is then an OR of the selected
+values within a facet and an AND across facets.
+
+The bitsets are built from the facet vocabularies (facilities/vocabulary.py),
+so row i of bits[facet] is the i-th value of the facet's sorted vocabulary.
+
+"""
+
+# import numpy
+import numpy as np
+
+from facilities.vocabulary import FACETS, build_vocabularies, encode_vocabulary
+
+
+def n_words(n_rows):
+    return (n_rows + 63) // 64
+
+
+def positions_to_bits(positions, n_rows):
+    """
+    Pack row positions into a bitset of uint64 words
+
+    """
+
+    bits = np.zeros(n_words(n_rows), dtype=np.uint64)
+    positions = np.asarray(positions, dtype=np.int64)
+    np.bitwise_or.at(
+        bits,
+        positions >> 6,
+        np.left_shift(np.uint64(1), (positions & 63).astype(np.uint64)),
+    )
+    return bits
+
+
+def bits_to_positions(bits, n_rows):
+    """
+    Unpack a bitset of uint64 words into sorted row positions
+
+    """
+
+    flags = np.unpackbits(bits.view(np.uint8), bitorder="little")[:n_rows]
+    return np.flatnonzero(flags)
+
+
+def bits_contain(bits, positions):
+    """
+    Check which row positions are set in a bitset
+
+    """
+
+    positions = np.asarray(positions, dtype=np.int64)
+    words = bits[positions >> 6]
+    return (words >> (positions & 63).astype(np.uint64)) & np.uint64(1) == 1
+
+
+def popcount(bits):
+    """
+    Count the set bits in each row of a bitset array
+
+    """
+
+    bits = np.atleast_2d(bits)
+    return np.unpackbits(bits.view(np.uint8), axis=1).sum(axis=1)
+
+
+class FacetIndex:
+    """
+    Packed bitsets for every value of every facet
+
+    Row positions in the bitsets are positions in the data frame the index
+    was built from (not its index labels).
+
+    Parameters
+    ----------
+    df_in : data frame
+        the facility data, as returned by load_facilities
+    dataset_hash : str, optional
+        the dataset version the index was built for
+    vocabularies : dict, optional
+        the facet vocabularies of df_in; built from it if not given
+
+    """
+
+    def __init__(self, df_in, dataset_hash=None, vocabularies=None):
+        self.n_rows = len(df_in)
+        self.dataset_hash = dataset_hash
+        self.all_bits = positions_to_bits(np.arange(self.n_rows), self.n_rows)
+
+        if vocabularies is None:
+            vocabularies = build_vocabularies(df_in)
+
+        # facet -> (value -> row in bits), facet -> 2D array of bitsets
+        self.values = {}
+        self.bits = {}
+
+        for facet in FACETS:
+            vocabulary = vocabularies[facet]
+            positions, codes = vocabulary.row_positions()
+            bits = np.zeros((len(vocabulary), n_words(self.n_rows)), dtype=np.uint64)
+            np.bitwise_or.at(
+                bits,
+                (codes, positions >> 6),
+                np.left_shift(np.uint64(1), (positions & 63).astype(np.uint64)),
+            )
+
+            self.values[facet] = vocabulary.lookup
+            self.bits[facet] = bits
+
+    def facet_bits(self, facet, selected):
+        """
+        Rows matching any of the selected values of one facet
+
+        An empty selection matches every row.
+
+        """
+
+        if not selected:
+            return self.all_bits
+
+        lookup = self.values[facet]
+        rows = [lookup[v] for v in selected if v in lookup]
+        if not rows:
+            return np.zeros_like(self.all_bits)
+
+        return np.bitwise_or.reduce(self.bits[facet][rows], axis=0)
+
+    def match(self, selections):
+        """
+        Rows matching every facet's selection
+
+        Parameters
+        ----------
+        selections : dict
+            facet name -> list of selected values
+
+        Returns
+        -------
+        numpy array
+            bitset of the matching rows
+
+        """
+
+        bits = self.all_bits.copy()
+        for facet, selected in selections.items():
+            if selected:
+                bits &= self.facet_bits(facet, selected)
+
+        return bits
+
+    def positions(self, selections):
+        return bits_to_positions(self.match(selections), self.n_rows)
+
+    def counts(self, selections, restrict=None):
+        """
+        Count the rows each facet value would match under the other facets
+
+        The count of a value is the number of rows that have it and match the
+        selections of every other facet, i.e. what the filter would return if
+        only this value were selected in its own facet.
+
+        Parameters
+        ----------
+        selections : dict
+            facet name -> list of selected values
+        restrict : numpy array, optional
+            bitset of the rows that may be counted at all (e.g. the result
+            of a text or radius search)
+
+        Returns
+        -------
+        dict
+            facet name -> counts, one per row of bits[facet]
+
+        """
+
+        base = self.all_bits if restrict is None else restrict
+        selected = {
+            facet: self.facet_bits(facet, values)
+            for facet, values in selections.items()
+            if values
+        }
+
+        counts = {}
+        for facet in FACETS:
+            others = base.copy()
+            for other, bits in selected.items():
+                if other != facet:
+                    others &= bits
+            counts[facet] = popcount(self.bits[facet] & others)
+
+        return counts
+
+
+def encode_facet(series, is_list=False):
+    """
+    Dictionary-encode a facet column for shipping to the browser
+
+    Parameters
+    ----------
+    series : pandas series
+        a facet column; list columns hold several values per row
+    is_list : bool
+        True if each row holds a list of values
+
+    Returns
+    -------
+    dict
+        "values" (the distinct values, sorted) and "codes" (an index into
+        values per row, -1 for missing). List columns also get "offsets": the
+        codes of row i are codes[offsets[i]:offsets[i + 1]].
+
+    """
+
+    return encode_vocabulary(series, is_list).to_dict()
+
+
+# one index per dataset version
+_indexes = {}
+
+
+def get_facet_index(df_in, dataset_hash, vocabularies=None):
+    """
+    Return the facet index for a dataset version, building it only once
+
+    """
+
+    if dataset_hash not in _indexes:
+        _indexes.clear()
+        _indexes[dataset_hash] = FacetIndex(df_in, dataset_hash, vocabularies)
+
+    return _indexes[dataset_hash]
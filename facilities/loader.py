@@ -0,0 +1,163 @@
+"""
+Fast YAML loading for the facility files
+
+PyYAML's pure Python SafeLoader is slow. When PyYAML was built with libyaml
+the C loader is used instead, which is many times faster; otherwise the pure
+Python loader is the fallback, so the results are the same either way.
+
+The features of a facility collection can also be read one at a time with
+iter_features. Only one facility's YAML node tree is held in memory at once,
+instead of the node tree of the whole file.
+
+"""
+
+import logging
+import time
+
+# import pyyaml module
+import yaml
+from yaml.composer import Composer
+from yaml.events import (
+    MappingEndEvent,
+    MappingStartEvent,
+    SequenceEndEvent,
+    SequenceStartEvent,
+    StreamEndEvent,
+)
+from yaml.loader import SafeLoader
+
+log = logging.getLogger(__name__)
+
+HAS_LIBYAML = hasattr(yaml, "CSafeLoader")
+
+if HAS_LIBYAML:
+    Loader = yaml.CSafeLoader
+
+    class StreamLoader(yaml.CSafeLoader, Composer):
+        """
+        The C loader, composing one node at a time
+
+        libyaml composes whole documents only; Composer.compose_node builds
+        single nodes from the events it emits.
+
+        """
+
+        def __init__(self, stream):
+            yaml.CSafeLoader.__init__(self, stream)
+            Composer.__init__(self)
+
+else:
+    Loader = SafeLoader
+    StreamLoader = SafeLoader
+
+
+def load_yaml(path):
+    """
+    Parse a YAML file, with the C loader if there is one
+
+    Parameters
+    ----------
+    path : str
+        the file to parse
+
+    Returns
+    -------
+    the parsed document
+
+    """
+
+    with open(path, "rb") as f:
+        return yaml.load(f, Loader=Loader)
+
+
+def iter_features(path):
+    """
+    Parse the features of a facility collection one at a time
+
+    Parameters
+    ----------
+    path : str
+        a YAML file holding a mapping with a "features" list, like
+        data/facilities/facilities.yaml
+
+    Yields
+    ------
+    dict
+        each facility feature, in file order
+
+    """
+
+    with open(path, "rb") as f:
+        loader = StreamLoader(f)
+        try:
+            # StreamStart, then DocumentStart unless the file is empty
+            loader.get_event()
+            if loader.check_event(StreamEndEvent):
+                return
+            loader.get_event()
+
+            if not loader.check_event(MappingStartEvent):
+                raise yaml.YAMLError(
+                    "{}: expected a mapping with a features list".format(path)
+                )
+            loader.get_event()
+
+            while not loader.check_event(MappingEndEvent):
+                key = loader.construct_document(loader.compose_node(None, None))
+
+                if key != "features" or not loader.check_event(SequenceStartEvent):
+                    # skip the value
+                    loader.compose_node(None, None)
+                    continue
+
+                loader.get_event()
+                while not loader.check_event(SequenceEndEvent):
+                    yield loader.construct_document(loader.compose_node(None, None))
+                loader.get_event()
+        finally:
+            loader.dispose()
+
+
+def load_features(path, stream=True):
+    """
+    Parse the features of a facility collection and report how long it took
+
+    Parameters
+    ----------
+    path : str
+        a YAML file holding a mapping with a "features" list
+    stream : bool
+        parse the features one at a time (lower peak memory) instead of
+        parsing the whole file at once
+
+    Returns
+    -------
+    features : list of dict
+        the facility features, in file order
+    report : dict
+        "records" (number of features), "seconds" (parse time) and "loader"
+        (name of the loader class)
+
+    """
+
+    start = time.perf_counter()
+
+    if stream:
+        features = list(iter_features(path))
+    else:
+        features = (load_yaml(path) or {}).get("features") or []
+
+    report = {
+        "records": len(features),
+        "seconds": time.perf_counter() - start,
+        "loader": Loader.__name__,
+    }
+    log.info(
+        "Parsed %d records from %s in %.3f s (%s)",
+        report["records"],
+        path,
+        report["seconds"],
+        report["loader"],
+    )
+
+    return features, report
@@ -0,0 +1,206 @@
+"""
+Markdown of the facility files, pre-rendered to sanitized HTML
+
+The descriptions, quotes and specific infrastructure / available-data items
+of the facility files are Markdown, with some inline HTML (mostly <br>). They
+are rendered to HTML once, when the facility data is compiled, so the
+explorer's cards show ready fragments (as html components, see
+create_html_element in pages/explorer.py) instead of parsing Markdown in the
+browser. White space, including the blank lines of <pre> blocks, is kept.
+
+Markdown is rendered with markdown-it-py, a CommonMark parser like the one
+dcc.Markdown uses. The HTML is then sanitized: only the tags and attributes in
+ALLOWED_TAGS are kept, links must be http(s) or mailto, and the contents of
+script and style elements are dropped.
+
+"""
+
+import html
+import re
+from html.parser import HTMLParser
+
+from markdown_it import MarkdownIt
+
+# tag -> allowed attributes
+ALLOWED_TAGS = {
+    "a": ("href", "title"),
+    "abbr": ("title",),
+    "b": (),
+    "blockquote": (),
+    "br": (),
+    "code": (),
+    "del": (),
+    "em": (),
+    "h1": (),
+    "h2": (),
+    "h3": (),
+    "h4": (),
+    "h5": (),
+    "h6": (),
+    "hr": (),
+    "i": (),
+    "li": (),
+    "ol": ("start",),
+    "p": (),
+    "pre": (),
+    "s": (),
+    "small": (),
+    "strong": (),
+    "sub": (),
+    "sup": (),
+    "table": (),
+    "tbody": (),
+    "td": (),
+    "th": (),
+    "thead": (),
+    "tr": (),
+    "u": (),
+    "ul": (),
+}
+
+VOID_TAGS = ("br", "hr")
+
+# elements dropped with their contents
+DROPPED_TAGS = ("script", "style", "iframe", "object", "embed", "template")
+
+_SAFE_URL = re.compile(r"^(https?:|mailto:|#|/(?!/))", re.IGNORECASE)
+
+_markdown = MarkdownIt("commonmark", {"html": True})
+
+
+class _Sanitizer(HTMLParser):
+    """
+    Re-emits HTML with only the allowed tags and attributes
+
+    Disallowed tags are removed but their text is kept. The output is well
+    formed: stray end tags are dropped and open tags are closed at the end.
+
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out = []
+        self.open = []
+        self.dropping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROPPED_TAGS:
+            self.dropping += 1
+            return False
+        if self.dropping or tag not in ALLOWED_TAGS:
+            return False
+
+        kept = []
+        for name, value in attrs:
+            if name not in ALLOWED_TAGS[tag] or value is None:
+                continue
+            if name == "href" and not _SAFE_URL.match(value.strip()):
+                continue
+            kept.append(' {}="{}"'.format(name, html.escape(value, quote=True)))
+        self.out.append("<{}{}>".format(tag, "".join(kept)))
+
+        if tag not in VOID_TAGS:
+            self.open.append(tag)
+        return True
+
+    def handle_startendtag(self, tag, attrs):
+        # <tag/> has no contents
+        if tag in DROPPED_TAGS:
+            return
+        if self.handle_starttag(tag, attrs) and tag not in VOID_TAGS:
+            self.close_tag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROPPED_TAGS:
+            self.dropping = max(0, self.dropping - 1)
+            return
+        if self.dropping or tag not in self.open:
+            return
+        self.close_tag(tag)
+
+    def close_tag(self, tag):
+        # close the tags opened inside this one too
+        while self.open:
+            top = self.open.pop()
+            self.out.append("</{}>".format(top))
+            if top == tag:
+                break
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.out.append(html.escape(data, quote=False))
+
+    def get_html(self):
+        while self.open:
+            self.out.append("</{}>".format(self.open.pop()))
+        return "".join(self.out)
+
+
+def sanitize_html(fragment):
+    """
+    Keep only the allowed tags and attributes of an HTML fragment
+
+    """
+
+    sanitizer = _Sanitizer()
+    sanitizer.feed(fragment)
+    sanitizer.close()
+
+    return sanitizer.get_html().strip()
+
+
+def render_markdown(text):
+    """
+    Render Markdown to a sanitized HTML fragment
+
+    Parameters
+    ----------
+    text : str or None
+        Markdown, possibly with inline HTML
+
+    Returns
+    -------
+    str or None
+        the HTML, None if there is no text
+
+    """
+
+    if not text:
+        return None
+
+    return sanitize_html(_markdown.render(text)) or None
+
+
+def render_list(items):
+    """
+    Render a list of Markdown items to a sanitized HTML list
+
+    Nested lists become nested <ul> elements, as the explorer has always
+    shown them.
+
+    Parameters
+    ----------
+    items : list or None
+        Markdown strings and nested lists
+
+    Returns
+    -------
+    str or None
+        a <ul> fragment, None if items is not a list
+
+    """
+
+    if not isinstance(items, list):
+        return None
+
+    return sanitize_html(_render_items(items))
+
+
+def _render_items(items):
+    parts = []
+    for item in items:
+        if isinstance(item, list):
+            parts.append(_render_items(item))
+        else:
+            parts.append("<li>{}</li>".format(_markdown.render(item)))
+    return "<ul>{}</ul>".format("".join(parts))
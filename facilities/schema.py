@@ -0,0 +1,339 @@
+"""
+Schema of the facility YAML files, and the normalized fields derived from it
+
+validate_feature checks one facility feature against the schema; the build
+step runs it once per changed facility file. normalize_feature derives the
+typed fields the explorer renders from, so the page does not have to clean
+the data on every request:
+
+    lat, lon, elev              float, NaN when missing
+    description, quote,         text with surrounding white space removed,
+    info_note,                  None when missing or empty
+    availabledata_description
+    homepage_url, source_url,   absolute http(s) URLs, None when missing or
+    eawe_pdf_url, portal_url    empty (never "")
+    source_domain               the host name of source_url
+    googlemaps_url              a Google Maps search for the location, None
+                                without one
+    has_infrastructure,         whether there is a list of infrastructure /
+    has_availabledata           available data to show
+    description_html,           description, quote (as a blockquote) and
+    quote_html,                 availabledata_description rendered from
+    availabledata_description_html
+                                Markdown to sanitized HTML (see
+                                facilities/markup.py), None when missing
+    infrastructure_html,        the specific infrastructure / available data
+    availabledata_html          items as a sanitized HTML list, None without
+                                a list
+    slug                        the name as lower-case ASCII words joined by
+                                hyphens (see get_slug); a key of the
+                                facility that does not change when other
+                                facilities are added (facility_id is made
+                                from it, see get_facility_id)
+
+"""
+
+import hashlib
+import math
+import re
+import unicodedata
+
+# get domain from URLs
+from urllib.parse import urlparse
+
+from facilities.markup import render_list, render_markdown
+
+# block -> field -> kind; "required" fields must be present and not null
+SCHEMA = {
+    "geometry": {
+        "coordinates": "coordinates",
+        "type": "str",
+        "icon": "str",
+        "note": "str",
+    },
+    "information": {
+        "description": "str",
+        "quote": "str",
+        "note": "str",
+        "homepage": "url",
+        "hompage": "url",
+        "source": "url",
+        "eawe-pdf": "url",
+        "copied": "bool",
+    },
+    "infrastructure": {
+        "description": "str",
+        "generic": "list",
+        "specific": "list",
+        "homepage": "url",
+    },
+    "availabledata": {
+        "description": "str",
+        "generic": "list",
+        "specific": "list",
+        "portal": "url",
+        "homepage": "url",
+    },
+    "properties": {
+        "name": "required",
+        "country": "required",
+        "type": "required",
+        "url": "url",
+    },
+}
+
+REQUIRED_BLOCKS = ("geometry", "information", "properties")
+
+# columns added to the facility data frame by normalize_feature
+NORMALIZED_COLUMNS = (
+    "lat",
+    "lon",
+    "elev",
+    "description",
+    "quote",
+    "info_note",
+    "availabledata_description",
+    "homepage_url",
+    "source_url",
+    "source_domain",
+    "eawe_pdf_url",
+    "portal_url",
+    "googlemaps_url",
+    "has_infrastructure",
+    "has_availabledata",
+    "description_html",
+    "quote_html",
+    "availabledata_description_html",
+    "infrastructure_html",
+    "availabledata_html",
+    "slug",
+)
+
+GOOGLE_MAPS_URL = "https://www.google.com/maps/search/?api=1&query={}%2C{}"
+
+_URL = re.compile(r"^https?://\S+$")
+
+_NOT_SLUG = re.compile(r"[^a-z0-9]+")
+
+# facility ids are below 2**FACILITY_ID_BITS, so they are exact in JavaScript
+FACILITY_ID_BITS = 48
+
+
+class SchemaError(ValueError):
+    """
+    A facility feature does not match the schema
+
+    """
+
+
+# ----------
+# Validation
+# ----------
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _check_list(value, where):
+    # lists of strings; the specific lists may be nested (see render_list)
+    if not isinstance(value, list):
+        raise SchemaError("{}: expected a list".format(where))
+    for item in value:
+        if isinstance(item, list):
+            _check_list(item, where)
+        elif not isinstance(item, str):
+            raise SchemaError("{}: expected a list of strings".format(where))
+
+
+def _check_field(kind, value, where):
+    if value is None:
+        if kind == "required":
+            raise SchemaError("{}: must not be empty".format(where))
+        return
+
+    if kind == "coordinates":
+        if not isinstance(value, list) or len(value) not in (2, 3):
+            raise SchemaError(
+                "{}: expected [lon, lat] or [lon, lat, elev]".format(where)
+            )
+        for v in value:
+            if v is not None and not _is_number(v):
+                raise SchemaError("{}: expected numbers or null".format(where))
+        lon, lat = value[0], value[1]
+        if (lat is None) != (lon is None):
+            raise SchemaError("{}: lat and lon must both be given".format(where))
+        if lat is not None and not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise SchemaError("{}: out of range".format(where))
+    elif kind == "bool":
+        if not isinstance(value, bool):
+            raise SchemaError("{}: expected true or false".format(where))
+    elif kind == "list":
+        _check_list(value, where)
+    elif not isinstance(value, str):
+        raise SchemaError("{}: expected text".format(where))
+    elif kind == "required" and not value.strip():
+        raise SchemaError("{}: must not be empty".format(where))
+    elif kind == "url" and value.strip() and not _URL.match(value.strip()):
+        raise SchemaError("{}: not an http(s) URL: {!r}".format(where, value))
+
+
+def validate_feature(feature, where="facility"):
+    """
+    Check a facility feature against the schema
+
+    Parameters
+    ----------
+    feature : dict
+        one item of the "features" list
+    where : str
+        prefix of the error messages, e.g. the file name
+
+    Raises
+    ------
+    SchemaError
+        naming the first field that does not match
+
+    """
+
+    if not isinstance(feature, dict):
+        raise SchemaError("{}: expected a mapping".format(where))
+
+    for key, value in feature.items():
+        if key == "type":
+            if value != "Feature":
+                raise SchemaError("{}.type: expected Feature".format(where))
+            continue
+        if key not in SCHEMA:
+            raise SchemaError("{}: unknown key {!r}".format(where, key))
+        if value is None and key not in REQUIRED_BLOCKS:
+            continue
+        if not isinstance(value, dict):
+            raise SchemaError("{}.{}: expected a mapping".format(where, key))
+
+        fields = SCHEMA[key]
+        for field in value:
+            if field not in fields:
+                raise SchemaError("{}.{}: unknown key {!r}".format(where, key, field))
+        for field, kind in fields.items():
+            field_where = "{}.{}.{}".format(where, key, field)
+            if kind == "required" and field not in value:
+                raise SchemaError("{}: missing".format(field_where))
+            _check_field(kind, value.get(field), field_where)
+
+    for key in REQUIRED_BLOCKS:
+        if key not in feature:
+            raise SchemaError("{}: missing {!r}".format(where, key))
+
+    if "coordinates" not in feature["geometry"]:
+        raise SchemaError("{}.geometry.coordinates: missing".format(where))
+
+
+def validate_features(features, where="facilities"):
+    """
+    Check a list of facility features against the schema
+
+    """
+
+    if not isinstance(features, list) or not features:
+        raise SchemaError("{}: expected a list of facilities".format(where))
+
+    for i, feature in enumerate(features):
+        validate_feature(feature, "{}[{}]".format(where, i))
+
+
+# -------------
+# Normalization
+# -------------
+
+
+def _text(value):
+    if not isinstance(value, str):
+        return None
+    return value.strip() or None
+
+
+def _float(value):
+    return float(value) if _is_number(value) else math.nan
+
+
+def get_slug(name):
+    """
+    URL-safe key of a facility name
+
+    "Saint-Hilaire-de-Chaléons" becomes "saint-hilaire-de-chaleons". Names
+    without any letters or digits become "facility"; rows_to_frame in
+    facilities/store.py makes the slugs of a dataset unique.
+
+    """
+
+    text = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode()
+    return _NOT_SLUG.sub("-", text.lower()).strip("-") or "facility"
+
+
+def get_facility_id(slug):
+    """
+    Number of a facility, made from its slug
+
+    The explorer keeps facility ids in the browser, so they must mean the
+    same facility in every version of the data. rows_to_frame in
+    facilities/store.py resolves the (unlikely) clashes.
+
+    """
+
+    digest = hashlib.sha256(slug.encode("utf-8")).hexdigest()
+    return int(digest, 16) >> (256 - FACILITY_ID_BITS)
+
+
+def normalize_feature(feature):
+    """
+    Derive the normalized fields of a valid facility feature
+
+    Returns
+    -------
+    dict
+        one value per name in NORMALIZED_COLUMNS
+
+    """
+
+    coordinates = (feature["geometry"].get("coordinates") or []) + [None] * 3
+    information = feature.get("information") or {}
+    infrastructure = feature.get("infrastructure") or {}
+    availabledata = feature.get("availabledata") or {}
+
+    lon, lat, elev = (_float(v) for v in coordinates[:3])
+
+    description = _text(information.get("description"))
+    quote = _text(information.get("quote"))
+    availabledata_description = _text(availabledata.get("description"))
+    source_url = _text(information.get("source"))
+
+    googlemaps_url = None
+    if not (math.isnan(lat) or math.isnan(lon)):
+        googlemaps_url = GOOGLE_MAPS_URL.format(lat, lon)
+
+    return {
+        "lat": lat,
+        "lon": lon,
+        "elev": elev,
+        "description": description,
+        "quote": quote,
+        "info_note": _text(information.get("note")),
+        "availabledata_description": availabledata_description,
+        # "hompage" is a common misspelling in the facility files
+        "homepage_url": _text(information.get("homepage"))
+        or _text(information.get("hompage")),
+        "source_url": source_url,
+        "source_domain": urlparse(source_url).netloc if source_url else None,
+        "eawe_pdf_url": _text(information.get("eawe-pdf")),
+        "portal_url": _text(availabledata.get("portal")),
+        "googlemaps_url": googlemaps_url,
+        "has_infrastructure": isinstance(infrastructure.get("generic"), list),
+        "has_availabledata": isinstance(availabledata.get("generic"), list),
+        "description_html": render_markdown(description),
+        "quote_html": render_markdown("> " + quote) if quote else None,
+        "availabledata_description_html": render_markdown(availabledata_description),
+        "infrastructure_html": render_list(infrastructure.get("specific")),
+        "availabledata_html": render_list(availabledata.get("specific")),
+        "slug": get_slug(feature["properties"]["name"]),
+    }
@@ -0,0 +1,257 @@
+"""
+Ranked full-text search over the facility descriptions
+
+An inverted index from terms to the facility rows that contain them, ranked
+with Okapi BM25. The postings are kept as flat NumPy arrays (one slice per
+term), so the index can be saved next to the compiled store and loaded
+without re-tokenising every description.
+
+"""
+
+import collections
+import json
+import math
+import os
+import re
+
+# import numpy
+import numpy as np
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+STOP_WORDS = frozenset(
+    """
+    a an and are as at be by for from has have in is it its of on or that the
+    their this to was were which with
+    """.split()
+)
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """
+    Split text into lower-case search terms
+
+    """
+
+    return [t for t in _TOKEN.findall(text.lower()) if t not in STOP_WORDS]
+
+
+def _field_texts(value):
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, list):
+        return [v for v in value if isinstance(v, str)]
+    return []
+
+
+def get_search_texts(df_in):
+    """
+    Collect the searchable text of each facility
+
+    The description and quote of the information block, the specific
+    infrastructure and available data items, and the available data
+    description.
+
+    Parameters
+    ----------
+    df_in : data frame
+        the facility data, as returned by load_facilities
+
+    Returns
+    -------
+    list of str
+        one text per row
+
+    """
+
+    texts = []
+    for information, *fields in zip(
+        df_in["information"],
+        df_in["infrastructure_specific"],
+        df_in["availabledata_specific"],
+        df_in["availabledata_desc"],
+    ):
+        parts = []
+        if isinstance(information, dict):
+            parts += _field_texts(information.get("description"))
+            parts += _field_texts(information.get("quote"))
+        for field in fields:
+            parts += _field_texts(field)
+        texts.append("\n".join(parts))
+
+    return texts
+
+
+class SearchIndex:
+    """
+    BM25 inverted index over the facility rows
+
+    Row positions are positions in the data frame the index was built from.
+
+    Parameters
+    ----------
+    terms : list of str
+        the vocabulary, sorted
+    offsets : array
+        the postings of term i are rows[offsets[i]:offsets[i + 1]]
+    rows, freqs : array
+        row position and term frequency of each posting
+    doc_lengths : array
+        number of terms in each row
+
+    """
+
+    def __init__(self, terms, offsets, rows, freqs, doc_lengths):
+        self.terms = {t: i for i, t in enumerate(terms)}
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.rows = np.asarray(rows, dtype=np.int32)
+        self.freqs = np.asarray(freqs, dtype=np.int32)
+        self.doc_lengths = np.asarray(doc_lengths, dtype=np.int32)
+        self.n_rows = len(self.doc_lengths)
+        self.avg_length = 1.0
+        if self.n_rows:
+            self.avg_length = max(float(self.doc_lengths.mean()), 1.0)
+
+    @classmethod
+    def build(cls, texts):
+        """
+        Build the index from one text per row
+
+        """
+
+        postings = {}
+        doc_lengths = np.zeros(len(texts), dtype=np.int32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths[row] = len(tokens)
+            for term, freq in collections.Counter(tokens).items():
+                postings.setdefault(term, []).append((row, freq))
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings[t]) for t in terms])
+        pairs = [p for t in terms for p in postings[t]]
+        rows = np.array([p[0] for p in pairs], dtype=np.int32)
+        freqs = np.array([p[1] for p in pairs], dtype=np.int32)
+
+        return cls(terms, offsets, rows, freqs, doc_lengths)
+
+    def save(self, path):
+        """
+        Save the index into a compiled store directory
+
+        """
+
+        terms = sorted(self.terms, key=self.terms.get)
+        with open(os.path.join(path, "search.terms.json"), "w") as f:
+            json.dump(terms, f)
+        np.save(os.path.join(path, "search.offsets.npy"), self.offsets)
+        np.save(os.path.join(path, "search.rows.npy"), self.rows)
+        np.save(os.path.join(path, "search.freqs.npy"), self.freqs)
+        np.save(os.path.join(path, "search.lengths.npy"), self.doc_lengths)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load an index saved by save; the postings are memory-mapped
+
+        """
+
+        with open(os.path.join(path, "search.terms.json")) as f:
+            terms = json.load(f)
+
+        return cls(
+            terms,
+            np.load(os.path.join(path, "search.offsets.npy")),
+            np.load(os.path.join(path, "search.rows.npy"), mmap_mode="r"),
+            np.load(os.path.join(path, "search.freqs.npy"), mmap_mode="r"),
+            np.load(os.path.join(path, "search.lengths.npy")),
+        )
+
+    def search(self, query, limit=None):
+        """
+        Rank the rows by their BM25 score for a query
+
+        Parameters
+        ----------
+        query : str
+            free text; every term contributes to the score
+        limit : int, optional
+            return at most this many rows
+
+        Returns
+        -------
+        positions : numpy array
+            row positions of the rows containing any query term, best first
+        scores : numpy array
+            their scores
+
+        """
+
+        scores = np.zeros(self.n_rows, dtype=np.float64)
+        norm = K1 * (1 - B + B * self.doc_lengths / self.avg_length)
+
+        for term in set(tokenize(query)):
+            i = self.terms.get(term)
+            if i is None:
+                continue
+            start, stop = self.offsets[i], self.offsets[i + 1]
+            rows = self.rows[start:stop]
+            freqs = self.freqs[start:stop]
+
+            n = stop - start
+            idf = math.log(1 + (self.n_rows - n + 0.5) / (n + 0.5))
+            scores[rows] += idf * freqs * (K1 + 1) / (freqs + norm[rows])
+
+        positions = np.flatnonzero(scores)
+        order = np.argsort(-scores[positions], kind="stable")
+        positions = positions[order]
+        if limit is not None:
+            positions = positions[:limit]
+
+        return positions, scores[positions]
+
+
+def build_search_index(df_in):
+    return SearchIndex.build(get_search_texts(df_in))
+
+
+# one index per dataset version
+_indexes = {}
+
+
+def get_search_index(df_in, dataset_hash, store_path=None):
+    """
+    Return the search index for a dataset version, building it only once
+
+    Parameters
+    ----------
+    df_in : data frame
+        the facility data
+    dataset_hash : str
+        the dataset version
+    store_path : str, optional
+        the compiled store of this version; its saved index is used if there
+        is one
+
+    """
+
+    if dataset_hash not in _indexes:
+        index = None
+        saved = store_path and os.path.join(store_path, "search.terms.json")
+        if saved and os.path.exists(saved):
+            try:
+                index = SearchIndex.load(store_path)
+            except (OSError, ValueError):
+                index = None
+        if index is None or index.n_rows != len(df_in):
+            index = build_search_index(df_in)
+
+        _indexes.clear()
+        _indexes[dataset_hash] = index
+
+    return _indexes[dataset_hash]
@@ -0,0 +1,258 @@
+"""
+Spatial grid index over the facility coordinates
+
+Facilities are bucketed into a regular latitude/longitude grid. A bounding
+box or radius query only looks at the grid rows and columns it overlaps, then
+checks the exact coordinates of the facilities found there.
+
+"""
+
+# import numpy
+import numpy as np
+
+# mean radius of the Earth
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine(lat, lon, lat_0, lon_0):
+    """
+    Great-circle distance from one point to many
+
+    Parameters
+    ----------
+    lat, lon : array
+        coordinates in degrees
+    lat_0, lon_0 : float
+        the reference point in degrees
+
+    Returns
+    -------
+    numpy array
+        distances in km
+
+    """
+
+    lat, lon = np.radians(lat), np.radians(lon)
+    lat_0, lon_0 = np.radians(lat_0), np.radians(lon_0)
+
+    a = (
+        np.sin((lat - lat_0) / 2) ** 2
+        + np.cos(lat) * np.cos(lat_0) * np.sin((lon - lon_0) / 2) ** 2
+    )
+
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class GridIndex:
+    """
+    A regular lat/lon grid over facility row positions
+
+    Parameters
+    ----------
+    lat, lon : array
+        coordinates in degrees, one per facility row; NaN for facilities
+        without a location
+    cell_size : float
+        size of a grid cell in degrees
+
+    """
+
+    def __init__(self, lat, lon, cell_size=1.0):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.cell_size = cell_size
+        self.n_rows = int(np.ceil(180.0 / cell_size))
+        self.n_cols = int(np.ceil(360.0 / cell_size))
+
+        located = np.flatnonzero(~(np.isnan(self.lat) | np.isnan(self.lon)))
+        keys = self.cell_keys(self.lat[located], self.lon[located])
+
+        # positions sorted by cell, so each cell is a contiguous run
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.positions = located[order]
+
+    def cell_rows(self, lat):
+        rows = np.floor((np.asarray(lat) + 90.0) / self.cell_size).astype(np.int64)
+        return np.clip(rows, 0, self.n_rows - 1)
+
+    def cell_cols(self, lon):
+        # wrap longitudes into [-180, 180)
+        lon = (np.asarray(lon) + 180.0) % 360.0 - 180.0
+        cols = np.floor((lon + 180.0) / self.cell_size).astype(np.int64)
+        return np.clip(cols, 0, self.n_cols - 1)
+
+    def cell_keys(self, lat, lon):
+        return self.cell_rows(lat) * self.n_cols + self.cell_cols(lon)
+
+    def _candidates(self, south, north, west, width):
+        rows = np.arange(self.cell_rows(south), self.cell_rows(north) + 1)
+
+        if width >= 360.0:
+            col_ranges = [(0, self.n_cols - 1)]
+        else:
+            col_0, col_1 = self.cell_cols(west), self.cell_cols(west + width)
+            if col_0 <= col_1:
+                col_ranges = [(col_0, col_1)]
+            else:
+                # the box crosses the antimeridian
+                col_ranges = [(col_0, self.n_cols - 1), (0, col_1)]
+
+        # each grid row of a column range is one contiguous run of keys
+        runs = []
+        for col_0, col_1 in col_ranges:
+            starts = np.searchsorted(self.keys, rows * self.n_cols + col_0, "left")
+            stops = np.searchsorted(self.keys, rows * self.n_cols + col_1, "right")
+            runs.extend(self.positions[a:b] for a, b in zip(starts, stops) if b > a)
+
+        if not runs:
+            return np.zeros(0, dtype=np.int64)
+
+        return np.concatenate(runs)
+
+    def query_bbox(self, south, west, north, east, margin=0.0):
+        """
+        Find the facilities inside a bounding box
+
+        Parameters
+        ----------
+        south, west, north, east : float
+            the box in degrees, as reported by Leaflet. Longitudes may lie
+            outside [-180, 180] when the map has been panned around the world.
+        margin : float
+            fraction of the box's size added on every side
+
+        Returns
+        -------
+        numpy array
+            sorted row positions of the facilities inside the box
+
+        """
+
+        width = east - west
+        if width < 0:
+            width += 360.0
+
+        dlat = (north - south) * margin
+        dlon = width * margin
+        south, north = max(south - dlat, -90.0), min(north + dlat, 90.0)
+        west, width = west - dlon, width + 2 * dlon
+
+        # wrap the western edge into [-180, 180)
+        west = (west + 180.0) % 360.0 - 180.0
+
+        candidates = self._candidates(south, north, west, width)
+
+        lat = self.lat[candidates]
+        inside = (lat >= south) & (lat <= north)
+        if width < 360.0:
+            inside &= (self.lon[candidates] - west) % 360.0 <= width
+
+        return np.sort(candidates[inside])
+
+    def query_radius(self, lat, lon, radius_km):
+        """
+        Find the facilities within a distance of a point
+
+        Only the grid cells overlapping the circle's bounding box are
+        checked, with the exact great-circle distance.
+
+        Parameters
+        ----------
+        lat, lon : float
+            the centre in degrees
+        radius_km : float
+            the search radius in km
+
+        Returns
+        -------
+        positions : numpy array
+            row positions of the facilities within the radius, nearest first
+        distances : numpy array
+            their distances in km
+
+        """
+
+        angle = radius_km / EARTH_RADIUS_KM
+        dlat = np.degrees(angle)
+        south, north = lat - dlat, lat + dlat
+
+        if south <= -90.0 or north >= 90.0 or angle >= np.pi / 2:
+            # the circle contains a pole
+            south, north = max(south, -90.0), min(north, 90.0)
+            west, width = -180.0, 360.0
+        else:
+            # widest longitude span of the circle
+            dlon = np.degrees(np.arcsin(np.sin(angle) / np.cos(np.radians(lat))))
+            west = (lon - dlon + 180.0) % 360.0 - 180.0
+            width = 2 * dlon
+
+        candidates = self._candidates(south, north, west, width)
+        distances = haversine(self.lat[candidates], self.lon[candidates], lat, lon)
+
+        inside = distances <= radius_km
+        candidates, distances = candidates[inside], distances[inside]
+        order = np.argsort(distances, kind="stable")
+
+        return candidates[order], distances[order]
+
+    def summarize(self, positions, cell_size):
+        """
+        Summarise facilities as clusters on a coarse grid
+
+        Parameters
+        ----------
+        positions : array
+            row positions of the facilities to summarise
+        cell_size : float
+            size of the summary cells in degrees
+
+        Returns
+        -------
+        list of dict
+            one entry per non-empty cell with the number of facilities and
+            their mean position ("count", "lat", "lon")
+
+        """
+
+        positions = np.asarray(positions, dtype=np.int64)
+        lat = self.lat[positions]
+        lon = self.lon[positions]
+        located = ~(np.isnan(lat) | np.isnan(lon))
+        lat, lon = lat[located], lon[located]
+        if not len(lat):
+            return []
+
+        n_cols = int(np.ceil(360.0 / cell_size))
+        keys = np.floor((lat + 90.0) / cell_size).astype(np.int64) * n_cols
+        keys += np.floor((lon + 180.0) / cell_size).astype(np.int64)
+
+        cells, inverse, counts = np.unique(
+            keys, return_inverse=True, return_counts=True
+        )
+        mean_lat = np.bincount(inverse, weights=lat) / counts
+        mean_lon = np.bincount(inverse, weights=lon) / counts
+
+        return [
+            {"count": int(n), "lat": float(y), "lon": float(x)}
+            for n, y, x in zip(counts, mean_lat, mean_lon)
+        ]
+
+
+# one index per dataset version
+_indexes = {}
+
+
+def get_spatial_index(df_in, dataset_hash, cell_size=1.0):
+    """
+    Return the spatial index for a dataset version, building it only once
+
+    """
+
+    if dataset_hash not in _indexes:
+        _indexes.clear()
+        _indexes[dataset_hash] = GridIndex(
+            df_in["lat"].values, df_in["lon"].values, cell_size
+        )
+
+    return _indexes[dataset_hash]
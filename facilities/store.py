@@ -0,0 +1,768 @@
+"""
+Compiled, columnar facility store
+
+The explorer used to parse data/facilities/facilities.yaml on every import.
+This module compiles the YAML into a directory of NumPy arrays, keyed by a
+content hash of the YAML, and only falls back to the YAML when the compiled
+copy is missing or stale. Loading a store decodes the columns every facility
+needs; the longer text columns stay on disk until a facility is shown or
+exported (see read_store).
+
+Layout of a compiled store (one directory per dataset hash)::
+
+    <store_dir>/<dataset_hash>/
+        manifest.json           column names, kinds and row count
+        strings.offsets.npy     int64 offsets into strings.blob.npy
+        strings.blob.npy        utf-8 bytes of every distinct string
+        <n>.npy                 column n of the manifest: float64 / int64
+                                values, or int32 codes into the strings
+        <n>.lengths.npy         per-row list lengths (-1 for missing) of
+                                list-of-string columns
+        search.*                the full-text search index (see
+                                facilities/search.py)
+        vocabulary.*            the sorted vocabularies of the filter facets
+                                (see facilities/vocabulary.py)
+
+Build it from the command line with::
+
+    python -m facilities.store data/facilities/facilities.yaml
+
+"""
+
+import contextlib
+import hashlib
+import json
+import math
+import os
+import shutil
+import sys
+
+# import pandas (needed for the data table)
+import pandas as pd
+
+# import numpy
+import numpy as np
+
+from facilities.loader import load_features
+from facilities.schema import (
+    FACILITY_ID_BITS,
+    NORMALIZED_COLUMNS,
+    get_facility_id,
+    normalize_feature,
+    validate_features,
+)
+from facilities.search import build_search_index
+from facilities.vocabulary import build_vocabularies, save_vocabularies
+
+try:
+    import fcntl
+except ImportError:
+    # no locking between processes on Windows; run a single worker there
+    fcntl = None
+
+# bump this whenever the on-disk layout changes so old stores are ignored
+STORE_FORMAT = 8
+
+DEFAULT_DATA_SOURCE = "data/facilities/facilities.yaml"
+DEFAULT_STORE_DIR = "data/facilities/compiled"
+
+# string and list columns that read_store decodes for every facility, as the
+# indexes, the table and the map use them; the other string, list and JSON
+# columns are only decoded for the facilities being shown or exported
+LOADED_COLUMNS = (
+    "name",
+    "slug",
+    "country",
+    "type_property",
+    "icon",
+    "infrastructure_list",
+    "availabledata_list",
+)
+
+# lock file of a store directory (see store_lock)
+LOCK_NAME = ".lock"
+
+# --------------------
+# Get and prepare data
+# --------------------
+
+
+def prepare_data(data_source):
+    """
+    Parse the facilities YAML into a data frame
+
+    This is the slow path: the whole file is parsed and the nested
+    dictionaries are flattened into one row per facility.
+
+    Parameters
+    ----------
+    data_source : str
+        path to the concatenated facilities YAML file
+
+    Returns
+    -------
+    df : data frame
+        one row per facility, sorted by name
+
+    """
+
+    # parse the facilities one at a time, with libyaml if it is installed
+    features, report = load_features(data_source)
+    validate_features(features, data_source)
+
+    return features_to_frame(features)
+
+
+# the columns of a facility row, before facility_id and the row number
+# "index"; (block, field) of the feature they come from, or None for the
+# normalized fields of facilities/schema.py
+ROW_FIELDS = (
+    ("type_geom", ("geometry", "type")),
+    ("icon", ("geometry", "icon")),
+    ("note", ("geometry", "note")),
+    ("country", ("properties", "country")),
+    ("name", ("properties", "name")),
+    ("type_property", ("properties", "type")),
+    ("url", ("properties", "url")),
+    ("lon", None),
+    ("lat", None),
+    ("elev", None),
+    ("information", ("information", None)),
+    ("infrastructure_desc", ("infrastructure", "description")),
+    ("infrastructure_list", ("infrastructure", "generic")),
+    ("infrastructure_specific", ("infrastructure", "specific")),
+    ("availabledata_desc", ("availabledata", "description")),
+    ("availabledata_list", ("availabledata", "generic")),
+    ("availabledata_specific", ("availabledata", "specific")),
+    ("availabledata_portal", ("availabledata", "portal")),
+) + tuple(
+    (column, None)
+    for column in NORMALIZED_COLUMNS
+    if column not in ("lon", "lat", "elev")
+)
+
+ROW_COLUMNS = tuple(column for column, source in ROW_FIELDS)
+
+
+def feature_to_row(feature):
+    """
+    Flatten one validated facility feature into the values of a row
+
+    Fields missing from the feature are NaN, as when the features are
+    flattened together by pandas. The normalized fields of facilities/schema.py
+    are computed here, which is the slow part (Markdown rendering), so the
+    build caches the rows of each facility file.
+
+    Returns
+    -------
+    list
+        one value per name in ROW_COLUMNS; plain data that can be saved as JSON
+
+    """
+
+    normalized = normalize_feature(feature)
+
+    row = []
+    for column, source in ROW_FIELDS:
+        if source is None:
+            row.append(normalized[column])
+            continue
+        block, field = source
+        value = feature.get(block, math.nan)
+        if field is not None:
+            value = value.get(field, math.nan) if isinstance(value, dict) else math.nan
+        row.append(value)
+
+    return row
+
+
+def rows_to_frame(rows):
+    """
+    Turn facility rows into the facility data frame
+
+    Parameters
+    ----------
+    rows : list of list
+        the output of feature_to_row for each feature, in file order
+
+    Returns
+    -------
+    df : data frame
+        one row per facility, sorted by name. Facilities with the same slug
+        get "-2", "-3", ... appended in file order, and facility_id is made
+        from the slug (see get_facility_id); the "index" column is the
+        position of the facility in rows
+
+    """
+
+    rows = [list(row) for row in rows]
+    slug = ROW_COLUMNS.index("slug")
+    used = set()
+    for row in rows:
+        base, n = row[slug], 1
+        while row[slug] in used:
+            n += 1
+            row[slug] = "{}-{}".format(base, n)
+        used.add(row[slug])
+
+    df = pd.DataFrame(
+        {column: [row[i] for row in rows] for i, column in enumerate(ROW_COLUMNS)},
+        columns=ROW_COLUMNS,
+    )
+    for column in ("lon", "lat", "elev"):
+        df[column] = df[column].astype(np.float64)
+    for column in ("has_infrastructure", "has_availabledata"):
+        df[column] = df[column].astype(bool)
+
+    # ids that stay the same across versions of the data; a clash takes the
+    # next free number, in file order
+    facility_ids = []
+    used = set()
+    for row in rows:
+        facility_id = get_facility_id(row[slug])
+        while facility_id in used:
+            facility_id = (facility_id + 1) % (1 << FACILITY_ID_BITS)
+        used.add(facility_id)
+        facility_ids.append(facility_id)
+
+    # create an index column - useful
+    df.insert(0, column="index", value=df.index.values)
+    df.insert(0, column="facility_id", value=np.array(facility_ids, dtype=np.int64))
+
+    # and finally, sort all by name
+    df.sort_values(by=["name"], inplace=True)
+
+    return df
+
+
+def features_to_frame(features):
+    """
+    Flatten parsed facility features into a data frame
+
+    The normalized fields of facilities/schema.py are added as columns.
+
+    Parameters
+    ----------
+    features : list of dict
+        the "features" list of the facilities YAML, in file order, already
+        validated against the schema
+
+    Returns
+    -------
+    df : data frame
+        one row per facility, sorted by name; see rows_to_frame
+
+    """
+
+    return rows_to_frame([feature_to_row(feature) for feature in features])
+
+
+# -------
+# Hashing
+# -------
+
+
+def hash_sources(paths):
+    """
+    Compute a content hash of one or more input files
+
+    Parameters
+    ----------
+    paths : str or list of str
+        the files the compiled store is built from
+
+    Returns
+    -------
+    str
+        a hex digest that changes whenever any input byte (or the store
+        format) changes
+
+    """
+
+    if isinstance(paths, str):
+        paths = [paths]
+
+    h = hashlib.sha256()
+    h.update("format={}".format(STORE_FORMAT).encode())
+    for path in paths:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+
+    return h.hexdigest()[:16]
+
+
+# ----------------
+# Column encodings
+# ----------------
+
+
+def _is_null(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def _column_kind(values):
+    """
+    Decide how a data frame column is stored
+
+    Returns one of "bool", "float", "int", "str", "strlist" (a flat list of
+    strings per row) or "json" (anything else, stored as JSON text).
+
+    """
+
+    if values.dtype.kind == "b":
+        return "bool"
+    if values.dtype.kind in "iu":
+        return "int"
+    if values.dtype.kind == "f":
+        return "float"
+
+    present = [v for v in values if not _is_null(v)]
+    if all(isinstance(v, str) for v in present):
+        return "str"
+    if all(isinstance(v, list) and all(isinstance(i, str) for i in v) for v in present):
+        return "strlist"
+    return "json"
+
+
+class _StringTable:
+    """
+    Collects distinct strings and hands out integer codes for them
+
+    """
+
+    def __init__(self):
+        self.codes = {}
+        self.strings = []
+
+    def code(self, value):
+        if _is_null(value):
+            return -1
+        if value not in self.codes:
+            self.codes[value] = len(self.strings)
+            self.strings.append(value)
+        return self.codes[value]
+
+    def to_arrays(self):
+        encoded = [s.encode("utf-8") for s in self.strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(b) for b in encoded])
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return offsets, blob
+
+
+class EncodedColumns:
+    """
+    String, list and JSON columns of a compiled store, decoded on demand
+
+    The codes, the list lengths and the string table stay memory-mapped;
+    take decodes the values of the rows asked for, and only the distinct
+    strings among them.
+
+    Parameters
+    ----------
+    path : str
+        directory of one compiled store
+    columns : list of (int, dict)
+        position and manifest entry of each column
+
+    """
+
+    def __init__(self, path, columns):
+        self.offsets = np.load(os.path.join(path, "strings.offsets.npy"), mmap_mode="r")
+        # slicing a memoryview is much cheaper than slicing a memmap
+        self.blob = memoryview(
+            np.load(os.path.join(path, "strings.blob.npy"), mmap_mode="r")
+        )
+
+        # name -> (kind, codes, list lengths, start of each row's list)
+        self.columns = {}
+        for i, column in columns:
+            codes = np.load(os.path.join(path, "{}.npy".format(i)), mmap_mode="r")
+            lengths = starts = None
+            if column["kind"] == "strlist":
+                lengths = np.load(
+                    os.path.join(path, "{}.lengths.npy".format(i)), mmap_mode="r"
+                )
+                starts = np.zeros(len(lengths), dtype=np.int64)
+                np.cumsum(np.maximum(lengths[:-1], 0), out=starts[1:])
+            self.columns[column["name"]] = (column["kind"], codes, lengths, starts)
+
+    def strings(self, codes):
+        """
+        Decode string codes; -1 marks a missing value and gives None, like a
+        null in the YAML
+
+        """
+
+        codes = np.asarray(codes)
+        present = codes >= 0
+        distinct, inverse = np.unique(codes[present], return_inverse=True)
+
+        decoded = np.empty(len(distinct), dtype=object)
+        decoded[:] = [
+            str(self.blob[start:stop], "utf-8")
+            for start, stop in zip(
+                self.offsets[distinct].tolist(), self.offsets[distinct + 1].tolist()
+            )
+        ]
+
+        values = np.empty(len(codes), dtype=object)
+        values[present] = decoded[inverse]
+        values[~present] = None
+        return values
+
+    def decode(self, name, positions):
+        """
+        Decode one column at some row positions
+
+        """
+
+        kind, codes, lengths, starts = self.columns[name]
+
+        if kind == "str":
+            return self.strings(codes[positions])
+
+        if kind == "json":
+            return [
+                np.nan if text is None else json.loads(text)
+                for text in self.strings(codes[positions])
+            ]
+
+        # the list items of each row are stored one after another
+        row_lengths = lengths[positions]
+        counts = np.maximum(row_lengths, 0)
+        ends = np.cumsum(counts)
+        items = np.arange(ends[-1] if len(ends) else 0) + np.repeat(
+            starts[positions] - (ends - counts), counts
+        )
+        values = self.strings(codes[items]).tolist()
+
+        rows = np.empty(len(positions), dtype=object)
+        for row, (length, end) in enumerate(zip(row_lengths.tolist(), ends.tolist())):
+            rows[row] = np.nan if length < 0 else values[end - length : end]
+        return rows
+
+    def take(self, positions):
+        """
+        Decode every column at some row positions
+
+        Parameters
+        ----------
+        positions : array of int
+            the row positions
+
+        Returns
+        -------
+        dict
+            column name -> values, in the order of positions
+
+        """
+
+        positions = np.asarray(positions, dtype=np.int64)
+        return {name: self.decode(name, positions) for name in self.columns}
+
+
+# ---------------------
+# Compile and load data
+# ---------------------
+
+
+def write_store(df, store_dir, dataset_hash):
+    """
+    Write a prepared data frame to a compiled store
+
+    The store is written to a temporary directory and renamed into place so
+    that concurrent workers never see a half-written store.
+
+    Parameters
+    ----------
+    df : data frame
+        the output of prepare_data
+    store_dir : str
+        directory holding the compiled stores
+    dataset_hash : str
+        content hash of the inputs, used as the store's directory name
+
+    Returns
+    -------
+    str
+        path of the compiled store
+
+    """
+
+    target = os.path.join(store_dir, dataset_hash)
+    if os.path.exists(os.path.join(target, "manifest.json")):
+        return target
+
+    os.makedirs(store_dir, exist_ok=True)
+    tmp = "{}.tmp-{}".format(target, os.getpid())
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    table = _StringTable()
+    columns = []
+
+    # keep the original row labels; filter_facilities works on them
+    frame = df.copy()
+    frame.insert(0, "__index__", df.index.values)
+
+    for name in frame.columns:
+        values = frame[name].values
+        kind = _column_kind(values)
+        stem = os.path.join(tmp, "{}.npy".format(len(columns)))
+
+        if kind == "bool":
+            np.save(stem, values.astype(np.bool_))
+        elif kind == "int":
+            np.save(stem, values.astype(np.int64))
+        elif kind == "float":
+            np.save(stem, values.astype(np.float64))
+        elif kind == "str":
+            np.save(stem, np.array([table.code(v) for v in values], dtype=np.int32))
+        elif kind == "strlist":
+            lengths = [len(v) if not _is_null(v) else -1 for v in values]
+            codes = [table.code(i) for v in values if not _is_null(v) for i in v]
+            np.save(stem, np.array(codes, dtype=np.int32))
+            np.save(
+                os.path.join(tmp, "{}.lengths.npy".format(len(columns))),
+                np.array(lengths, dtype=np.int64),
+            )
+        else:
+            np.save(
+                stem,
+                np.array(
+                    [-1 if _is_null(v) else table.code(json.dumps(v)) for v in values],
+                    dtype=np.int32,
+                ),
+            )
+
+        columns.append({"name": name, "kind": kind})
+
+    offsets, blob = table.to_arrays()
+    np.save(os.path.join(tmp, "strings.offsets.npy"), offsets)
+    np.save(os.path.join(tmp, "strings.blob.npy"), blob)
+
+    # so that workers do not have to re-tokenise the descriptions
+    build_search_index(df).save(tmp)
+    # or collect the dropdown values
+    save_vocabularies(build_vocabularies(df), tmp)
+
+    manifest = {
+        "format": STORE_FORMAT,
+        "dataset_hash": dataset_hash,
+        "n_rows": len(frame),
+        "columns": columns,
+    }
+    with open(os.path.join(tmp, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=1)
+
+    try:
+        os.rename(tmp, target)
+    except OSError:
+        # another worker got there first
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    return target
+
+
+def read_store(path):
+    """
+    Load a compiled store
+
+    Of the string, list and JSON columns, only LOADED_COLUMNS are decoded
+    here; the others stay memory-mapped as EncodedColumns and are decoded for
+    the rows being shown or exported (see Dataset.rows in
+    facilities/dataset.py). Loading still takes time in proportion to the
+    number of facilities, but much less than decoding every column.
+
+    Parameters
+    ----------
+    path : str
+        directory of one compiled store
+
+    Returns
+    -------
+    df : data frame
+        the frame prepare_data returns, without the columns of details
+    details : EncodedColumns
+        the remaining columns
+
+    """
+
+    with open(os.path.join(path, "manifest.json")) as f:
+        manifest = json.load(f)
+
+    data = {}
+    encoded = []
+    for i, column in enumerate(manifest["columns"]):
+        if column["kind"] in ("bool", "int", "float"):
+            data[column["name"]] = np.load(os.path.join(path, "{}.npy".format(i)))
+        else:
+            encoded.append((i, column))
+            if column["name"] in LOADED_COLUMNS:
+                # decoded below; set now to keep the order of the columns
+                data[column["name"]] = None
+
+    loaded = EncodedColumns(
+        path, [(i, c) for i, c in encoded if c["name"] in LOADED_COLUMNS]
+    )
+    data.update(loaded.take(np.arange(manifest["n_rows"])))
+
+    details = EncodedColumns(
+        path, [(i, c) for i, c in encoded if c["name"] not in LOADED_COLUMNS]
+    )
+
+    df = pd.DataFrame(data)
+    df.set_index("__index__", inplace=True)
+    df.index.name = None
+
+    return df, details
+
+
+@contextlib.contextmanager
+def store_lock(store_dir, exclusive=False, blocking=True):
+    """
+    Lock a store directory against the other worker processes
+
+    Builds hold the lock exclusively, as they write facilities.yaml and
+    delete old stores; loading a snapshot holds it shared, so no store is
+    deleted while a worker is reading it.
+
+    Parameters
+    ----------
+    store_dir : str
+        directory holding the compiled stores
+    exclusive : bool
+        take the lock for writing rather than for reading
+    blocking : bool
+        wait for the lock; otherwise give up if another process holds it
+
+    Yields
+    ------
+    bool
+        whether the lock was taken; always True when blocking
+
+    """
+
+    if fcntl is None:
+        yield True
+        return
+
+    try:
+        os.makedirs(store_dir, exist_ok=True)
+        f = open(os.path.join(store_dir, LOCK_NAME), "a")
+    except OSError:
+        # a read-only store directory: no process can write to it either
+        yield True
+        return
+
+    with f:
+        operation = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        try:
+            fcntl.flock(f, operation if blocking else operation | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def remove_stale_stores(store_dir, keep):
+    """
+    Delete compiled stores other than the current one
+
+    Hold the store_lock exclusively while calling it.
+
+    """
+
+    if not os.path.isdir(store_dir):
+        return
+
+    for entry in os.listdir(store_dir):
+        path = os.path.join(store_dir, entry)
+        if entry != keep and ".tmp-" not in entry and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def compile_store(data_source=DEFAULT_DATA_SOURCE, store_dir=DEFAULT_STORE_DIR):
+    """
+    Build the compiled store for a facilities YAML file
+
+    Parameters
+    ----------
+    data_source : str
+        path to the concatenated facilities YAML file
+    store_dir : str
+        directory holding the compiled stores
+
+    Returns
+    -------
+    str
+        path of the compiled store
+
+    """
+
+    with store_lock(store_dir, exclusive=True):
+        dataset_hash = hash_sources(data_source)
+        path = write_store(prepare_data(data_source), store_dir, dataset_hash)
+        remove_stale_stores(store_dir, keep=dataset_hash)
+
+    return path
+
+
+def load_facilities(data_source=DEFAULT_DATA_SOURCE, store_dir=DEFAULT_STORE_DIR):
+    """
+    Load the facilities, preferring the compiled store
+
+    Falls back to parsing the YAML when there is no store for the current
+    content hash, and then tries to write one for the next worker. Old stores
+    are left alone, as other workers may be reading them; see load_dataset in
+    facilities/dataset.py.
+
+    Parameters
+    ----------
+    data_source : str
+        path to the concatenated facilities YAML file
+    store_dir : str
+        directory holding the compiled stores
+
+    Returns
+    -------
+    df : data frame
+        one row per facility, sorted by name
+    details : EncodedColumns or None
+        the columns read_store leaves encoded; None when the YAML was parsed,
+        as df then has every column
+    dataset_hash : str
+        content hash of the data source
+
+    """
+
+    dataset_hash = hash_sources(data_source)
+    path = os.path.join(store_dir, dataset_hash)
+
+    if os.path.exists(os.path.join(path, "manifest.json")):
+        try:
+            df, details = read_store(path)
+            return df, details, dataset_hash
+        except (OSError, ValueError, KeyError):
+            # a broken store is no worse than a missing one
+            pass
+
+    df = prepare_data(data_source)
+    try:
+        write_store(df, store_dir, dataset_hash)
+    except OSError:
+        # read-only deployments still work, just without the fast path
+        pass
+
+    return df, None, dataset_hash
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_DATA_SOURCE
+    target = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_STORE_DIR
+    print("Compiled " + source + " to " + compile_store(source, target))
@@ -0,0 +1,215 @@
+"""
+Server-side sorting, filtering and paging for the facility table
+
+The table shows three text columns. Each is ranked once per dataset
+version, so sorting a page request is an np.lexsort over integer ranks, and
+the table's filter query is applied to NumPy string arrays.
+
+"""
+
+import re
+
+# import numpy
+import numpy as np
+
+# table column -> data frame column
+TABLE_COLUMNS = {
+    "name": "name",
+    "country": "country",
+    "type": "type_property",
+}
+
+# DataTable filter symbols and the operators they stand for. Operators may
+# have an "i" (case insensitive) or "s" (case sensitive) prefix.
+_OPERATORS = {
+    ">=": "ge",
+    "<=": "le",
+    "!=": "ne",
+    "<": "lt",
+    ">": "gt",
+    "=": "eq",
+}
+_FILTER_PART = re.compile(
+    r"^\s*\{(?P<column>[^}]+)\}\s*"
+    r"(?P<operator>[is]?(?:ge|le|lt|gt|ne|eq|contains|datestartswith)\b"
+    r"|>=|<=|!=|<|>|=)"
+    r"\s*(?P<value>.*?)\s*$"
+)
+
+
+class TableIndex:
+    """
+    Ranks and string values of the table columns
+
+    Row positions are positions in the data frame the index was built from.
+
+    Parameters
+    ----------
+    df_in : data frame
+        the facility data
+
+    """
+
+    def __init__(self, df_in):
+        self.values = {}
+        self.lower = {}
+        self.ranks = {}
+
+        for column, source in TABLE_COLUMNS.items():
+            values = np.array(df_in[source].fillna("").astype(str).tolist())
+            # equal values get equal ranks, so later sort keys can break ties
+            uniques, ranks = np.unique(values, return_inverse=True)
+
+            self.values[column] = values
+            self.lower[column] = np.char.lower(values)
+            self.ranks[column] = ranks.astype(np.int64)
+
+    def sort(self, positions, sort_by):
+        """
+        Sort row positions like the DataTable's multi-column sort
+
+        Parameters
+        ----------
+        positions : array
+            row positions
+        sort_by : list of dict
+            the DataTable's sort_by: "column_id" and "direction" ("asc" or
+            "desc"), most significant first
+
+        Returns
+        -------
+        numpy array
+            the sorted positions; ties keep their order
+
+        """
+
+        positions = np.asarray(positions, dtype=np.int64)
+        keys = []
+        for sort in sort_by or []:
+            if sort["column_id"] not in self.ranks:
+                continue
+            ranks = self.ranks[sort["column_id"]][positions]
+            keys.append(-ranks if sort["direction"] == "desc" else ranks)
+
+        if not keys:
+            return positions
+
+        # np.lexsort sorts by the last key first
+        return positions[np.lexsort(keys[::-1])]
+
+    def filter(self, positions, filter_query):
+        """
+        Apply the DataTable's filter query to row positions
+
+        Supports the operators the table's filter row generates (contains,
+        eq, ne, lt, le, gt, ge and datestartswith, with their i/s variants and
+        symbols), joined with "&&". Parts that cannot be parsed are ignored.
+
+        """
+
+        positions = np.asarray(positions, dtype=np.int64)
+        for part in split_filter_query(filter_query):
+            column, operator, value, case_sensitive = part
+            if column not in self.values:
+                continue
+            if case_sensitive:
+                values = self.values[column][positions]
+            else:
+                values = self.lower[column][positions]
+                value = value.lower()
+
+            if operator == "contains":
+                match = np.char.find(values, value) >= 0
+            elif operator == "datestartswith":
+                match = np.char.startswith(values, value)
+            elif operator == "eq":
+                match = values == value
+            elif operator == "ne":
+                match = values != value
+            elif operator == "lt":
+                match = values < value
+            elif operator == "le":
+                match = values <= value
+            elif operator == "gt":
+                match = values > value
+            else:
+                match = values >= value
+
+            positions = positions[match]
+
+        return positions
+
+    def page(self, positions, filter_query, sort_by, page_current, page_size):
+        """
+        Filter, sort and cut out one page of row positions
+
+        Returns
+        -------
+        page : numpy array
+            row positions of the rows on the page
+        page_count : int
+            number of pages after filtering
+
+        """
+
+        positions = self.sort(self.filter(positions, filter_query), sort_by)
+
+        page_size = max(int(page_size or 1), 1)
+        page_count = max((len(positions) + page_size - 1) // page_size, 1)
+        page_current = min(max(int(page_current or 0), 0), page_count - 1)
+        start = page_current * page_size
+
+        return positions[start : start + page_size], page_count
+
+
+def _unquote(value):
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'`":
+        return value[1:-1].replace("\\" + value[0], value[0])
+    return value
+
+
+def split_filter_query(filter_query):
+    """
+    Parse a DataTable filter query
+
+    Returns
+    -------
+    list of tuple
+        (column_id, operator, value, case_sensitive) for each part
+
+    """
+
+    parts = []
+    for part in (filter_query or "").split(" && "):
+        match = _FILTER_PART.match(part)
+        if not match:
+            continue
+
+        operator = _OPERATORS.get(match["operator"], match["operator"])
+        case_sensitive = True
+        if operator[0] in "is":
+            case_sensitive = operator[0] == "s"
+            operator = operator[1:]
+
+        parts.append(
+            (match["column"], operator, _unquote(match["value"]), case_sensitive)
+        )
+
+    return parts
+
+
+# one index per dataset version
+_indexes = {}
+
+
+def get_table_index(df_in, dataset_hash):
+    """
+    Return the table index for a dataset version, building it only once
+
+    """
+
+    if dataset_hash not in _indexes:
+        _indexes.clear()
+        _indexes[dataset_hash] = TableIndex(df_in)
+
+    return _indexes[dataset_hash]
@@ -0,0 +1,604 @@
+"""
+Mapbox Vector Tiles of the facilities and other point layers
+
+GET /tiles/<z>/<x>/<y>.mvt returns one tile in the Mapbox Vector Tile format
+(version 2), with one MVT layer per point layer: "facilities", and any layer
+added with register_point_layer. The facilities layer takes the query
+parameters of /api/facilities (see facilities/api.py), so the map can show
+the same facilities as the table.
+
+Up to CLUSTER_MAX_ZOOM, points that are close together at a zoom level are
+merged into one cluster feature ("cluster": true, "point_count": n). The
+clusters of each zoom level are computed once per dataset version and query
+and kept sorted by tile, so building a tile is a binary search and a slice.
+Encoded tiles are also kept on disk, in an LRU cache keyed by the dataset
+hash, so most requests are a file read, or a 304 for tiles the browser
+already has.
+
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import struct
+import threading
+
+# import numpy
+import numpy as np
+
+from flask import Blueprint, Response, jsonify, request
+
+from facilities.api import QueryError, get_etag, parse_query, query_facilities
+from facilities.dataset import get_dataset_manager
+
+TILE_EXTENT = 4096
+MAX_ZOOM = 20
+
+# clusters are made up to this zoom level; above it every point is shown
+CLUSTER_MAX_ZOOM = 9
+# size of a cluster cell, in pixels of a 256 pixel tile
+CLUSTER_RADIUS = 60
+# number of queries whose clusters are kept per snapshot
+CLUSTER_CACHE_SIZE = 64
+
+TILE_CACHE_DIR = "data/facilities/tile-cache"
+TILE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# the latitude limits of the Web Mercator projection
+MAX_LATITUDE = 85.0511287798
+
+tiles = Blueprint("facility_tiles", __name__)
+
+
+# ------------
+# Point layers
+# ------------
+
+
+class PointLayer:
+    """
+    Points to draw in the vector tiles
+
+    Parameters
+    ----------
+    lat, lon : array
+        coordinates in degrees; points without a location (NaN) are dropped
+    ids : array, optional
+        a non-negative integer id per point, used as the MVT feature id
+    properties : list of dict, optional
+        the properties of each point (str, int, float or bool values)
+
+    """
+
+    def __init__(self, lat, lon, ids=None, properties=None):
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        located = np.flatnonzero(~(np.isnan(lat) | np.isnan(lon)))
+
+        # Web Mercator, scaled to [0, 1)
+        lat = np.clip(lat[located], -MAX_LATITUDE, MAX_LATITUDE)
+        self.x = np.clip((lon[located] + 180.0) % 360.0 / 360.0, 0.0, 1.0 - 1e-12)
+        sin_lat = np.sin(np.radians(lat))
+        self.y = np.clip(
+            0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * np.pi),
+            0.0,
+            1.0 - 1e-12,
+        )
+
+        self.ids = None if ids is None else np.asarray(ids, dtype=np.int64)[located]
+        self.properties = (
+            None if properties is None else [properties[i] for i in located]
+        )
+
+    def subset(self, points):
+        """
+        A layer with only some of the points (positions in this layer)
+
+        """
+
+        layer = PointLayer.__new__(PointLayer)
+        layer.x = self.x[points]
+        layer.y = self.y[points]
+        layer.ids = None if self.ids is None else self.ids[points]
+        layer.properties = (
+            None
+            if self.properties is None
+            else [self.properties[i] for i in np.asarray(points).tolist()]
+        )
+        return layer
+
+
+def get_facility_point_layer(data):
+    """
+    The facilities of a snapshot as a point layer
+
+    Point i of the layer is the i-th located row of data.df; row_positions
+    maps it back.
+
+    """
+
+    df = data.df
+    layer = PointLayer(
+        df["lat"].values,
+        df["lon"].values,
+        ids=df["facility_id"].values,
+        properties=[
+            (
+                {"facility_id": int(i), "tooltip": name, "icon": icon}
+                if isinstance(icon, str)
+                else {"facility_id": int(i), "tooltip": name}
+            )
+            for i, name, icon in zip(df["facility_id"], df["name"], df["icon"])
+        ],
+    )
+    layer.row_positions = np.flatnonzero(
+        ~(np.isnan(df["lat"].values) | np.isnan(df["lon"].values))
+    )
+    return layer
+
+
+# layer name -> function of a Dataset returning a PointLayer
+_point_layers = {}
+
+
+def register_point_layer(name, func):
+    """
+    Add a point layer to every tile
+
+    Parameters
+    ----------
+    name : str
+        the MVT layer name
+    func : callable
+        called with a Dataset, returns a PointLayer. The result is kept per
+        dataset version. Query parameters do not apply to these layers.
+
+    """
+
+    _point_layers[name] = func
+
+
+# -----------------
+# Per-zoom clusters
+# -----------------
+
+
+def _spread_bits(v):
+    # insert a zero bit above each of the 20 low bits
+    v = v & 0xFFFFF
+    v = (v | (v << 16)) & 0x0000FFFF0000FFFF
+    v = (v | (v << 8)) & 0x00FF00FF00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v << 2)) & 0x3333333333333333
+    v = (v | (v << 1)) & 0x5555555555555555
+    return v
+
+
+def morton_codes(x, y, z=MAX_ZOOM):
+    """
+    Interleave the tile coordinates of positions at zoom z
+
+    The points of any tile at zoom z or lower are one contiguous range of
+    codes, so one sort by code serves every zoom level.
+
+    """
+
+    n = 1 << z
+    tx = np.floor(x * n).astype(np.int64)
+    ty = np.floor(y * n).astype(np.int64)
+    return _spread_bits(tx) | (_spread_bits(ty) << 1)
+
+
+class ClusterLevels:
+    """
+    Grid clusters of a point layer at each zoom level
+
+    Parameters
+    ----------
+    layer : PointLayer
+        the points
+    max_zoom : int
+        clusters are made up to this zoom level; above it every zoom level
+        shows the points themselves
+
+    """
+
+    def __init__(self, layer, max_zoom=CLUSTER_MAX_ZOOM):
+        self.layer = layer
+        self.max_zoom = max_zoom
+        self._levels = {}
+        self._lock = threading.Lock()
+
+    def level(self, z):
+        """
+        Get the features of a zoom level, computing them on first use
+
+        Returns
+        -------
+        dict
+            arrays "x", "y" (positions in [0, 1)), "count" (points in the
+            feature), "point" (the layer position of single points, -1 for
+            clusters) and "code" (Morton code), sorted by code
+
+        """
+
+        z = min(z, self.max_zoom + 1)
+        with self._lock:
+            if z not in self._levels:
+                self._levels[z] = self._make_level(z)
+            return self._levels[z]
+
+    def _make_level(self, z):
+        layer = self.layer
+        points = np.arange(len(layer.x))
+
+        if z > self.max_zoom:
+            level = {
+                "x": layer.x,
+                "y": layer.y,
+                "count": np.ones(len(points), dtype=np.int64),
+                "point": points,
+            }
+        else:
+            # cells of CLUSTER_RADIUS pixels at this zoom
+            n_cells = max(int((256 << z) / CLUSTER_RADIUS), 1)
+            cells = np.floor(layer.x * n_cells).astype(np.int64) * n_cells + np.floor(
+                layer.y * n_cells
+            ).astype(np.int64)
+            uniques, inverse, counts = np.unique(
+                cells, return_inverse=True, return_counts=True
+            )
+
+            # single points keep their exact position and their id
+            first = np.full(len(uniques), -1, dtype=np.int64)
+            first[inverse[::-1]] = points[::-1]
+
+            level = {
+                "x": np.bincount(inverse, weights=layer.x, minlength=len(uniques))
+                / counts,
+                "y": np.bincount(inverse, weights=layer.y, minlength=len(uniques))
+                / counts,
+                "count": counts.astype(np.int64),
+                "point": np.where(counts == 1, first, -1),
+            }
+
+        code = morton_codes(level["x"], level["y"])
+        order = np.argsort(code, kind="stable")
+        level = {name: values[order] for name, values in level.items()}
+        level["code"] = code[order]
+
+        return level
+
+    def tile_features(self, z, x, y):
+        """
+        Get the features of one tile
+
+        Returns
+        -------
+        list of tuple
+            (id or None, tile x, tile y, properties) per feature, with tile
+            coordinates in [0, TILE_EXTENT)
+
+        """
+
+        level = self.level(z)
+        # the codes of the tile's area at MAX_ZOOM
+        shift = 2 * (MAX_ZOOM - z)
+        code = _spread_bits(x) | (_spread_bits(y) << 1)
+        start, stop = np.searchsorted(
+            level["code"], [code << shift, (code + 1) << shift]
+        )
+
+        n = 1 << z
+        px = np.floor((level["x"][start:stop] * n - x) * TILE_EXTENT)
+        py = np.floor((level["y"][start:stop] * n - y) * TILE_EXTENT)
+        px = np.clip(px, 0, TILE_EXTENT - 1).astype(np.int64).tolist()
+        py = np.clip(py, 0, TILE_EXTENT - 1).astype(np.int64).tolist()
+
+        layer = self.layer
+        features = []
+        for i, point in enumerate(level["point"][start:stop].tolist()):
+            if point < 0:
+                count = int(level["count"][start + i])
+                properties = {
+                    "cluster": True,
+                    "point_count": count,
+                    "tooltip": "{} facilities".format(count),
+                }
+                features.append((None, px[i], py[i], properties))
+            else:
+                features.append(
+                    (
+                        None if layer.ids is None else int(layer.ids[point]),
+                        px[i],
+                        py[i],
+                        {} if layer.properties is None else layer.properties[point],
+                    )
+                )
+
+        return features
+
+
+def get_facility_clusters(data, key):
+    """
+    The cluster levels of the facilities matching a query
+
+    Cached with the snapshot by query key (see get_query_key), like the API's
+    responses, so they are dropped after a reload.
+
+    """
+
+    return data.cached(
+        "tile_clusters", key, create_facility_clusters, CLUSTER_CACHE_SIZE
+    )
+
+
+def create_facility_clusters(data, key):
+    layer = data.derived("tile_facilities", get_facility_point_layer)
+    if not key:
+        return ClusterLevels(layer)
+
+    positions, _ = query_facilities(data, json.loads(key))
+    # the layer only holds the located rows
+    points = np.flatnonzero(np.isin(layer.row_positions, positions))
+    return ClusterLevels(layer.subset(points))
+
+
+def get_layer_clusters(data, name):
+    return data.derived(
+        ("tile_layer", name), lambda d: ClusterLevels(_point_layers[name](d))
+    )
+
+
+# ------------
+# MVT encoding
+# ------------
+
+
+def _varint(n):
+    out = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+
+def _field(number, wire_type):
+    return _varint((number << 3) | wire_type)
+
+
+def _message(number, payload):
+    return _field(number, 2) + _varint(len(payload)) + payload
+
+
+def _packed(number, values):
+    return _message(number, b"".join(_varint(v) for v in values))
+
+
+def _encode_value(value):
+    if isinstance(value, bool):
+        return _field(7, 0) + _varint(int(value))
+    if isinstance(value, int):
+        if value >= 0:
+            return _field(5, 0) + _varint(value)
+        return _field(6, 0) + _varint(_zigzag(value))
+    if isinstance(value, float):
+        return _field(3, 1) + struct.pack("<d", value)
+    return _message(1, str(value).encode("utf-8"))
+
+
+def encode_layer(name, features, extent=TILE_EXTENT):
+    """
+    Encode point features as one MVT layer
+
+    Parameters
+    ----------
+    name : str
+        the layer name
+    features : list of tuple
+        (id or None, x, y, properties) with x, y in tile coordinates
+
+    Returns
+    -------
+    bytes
+        the encoded Tile.Layer message
+
+    """
+
+    keys, values = {}, {}
+    encoded = []
+    for feature_id, x, y, properties in features:
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault((type(value), value), len(values)))
+
+        feature = b""
+        if feature_id is not None:
+            feature += _field(1, 0) + _varint(feature_id)
+        feature += _packed(2, tags)
+        # type POINT, then one MoveTo command
+        feature += _field(3, 0) + _varint(1)
+        feature += _packed(4, [9, _zigzag(x), _zigzag(y)])
+        encoded.append(_message(2, feature))
+
+    layer = _field(15, 0) + _varint(2) + _message(1, name.encode("utf-8"))
+    layer += b"".join(encoded)
+    layer += b"".join(_message(3, key.encode("utf-8")) for key in keys)
+    layer += b"".join(_message(4, _encode_value(value)) for _, value in values)
+    layer += _field(5, 0) + _varint(extent)
+
+    return layer
+
+
+def encode_tile(layers):
+    """
+    Encode a vector tile from (name, features) pairs; empty layers are left out
+
+    """
+
+    return b"".join(
+        _message(3, encode_layer(name, features))
+        for name, features in layers
+        if features
+    )
+
+
+def build_tile(data, key, z, x, y):
+    layers = [("facilities", get_facility_clusters(data, key).tile_features(z, x, y))]
+    for name in _point_layers:
+        layers.append((name, get_layer_clusters(data, name).tile_features(z, x, y)))
+
+    return encode_tile(layers)
+
+
+# ---------------
+# Disk tile cache
+# ---------------
+
+
+class TileCache:
+    """
+    Encoded tiles on disk, least recently used first out
+
+    Tiles are stored under <root>/<dataset_hash>/; the tiles of older dataset
+    versions are deleted when a new version is first cached. Reading a tile
+    bumps its modification time, and when the cache grows past max_bytes the
+    oldest tiles are deleted.
+
+    """
+
+    def __init__(self, root=TILE_CACHE_DIR, max_bytes=TILE_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._size = None
+        self._dataset_hash = None
+        self._lock = threading.Lock()
+
+    def path(self, dataset_hash, key, z, x, y):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(
+            self.root, dataset_hash, digest, str(z), str(x), "{}.mvt".format(y)
+        )
+
+    def get(self, path):
+        try:
+            with open(path, "rb") as f:
+                tile = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return tile
+
+    def put(self, dataset_hash, path, tile):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = "{}.tmp-{}".format(path, os.getpid())
+            with open(tmp, "wb") as f:
+                f.write(tile)
+            os.replace(tmp, path)
+        except OSError:
+            # read-only deployments just encode every tile
+            return
+
+        with self._lock:
+            if dataset_hash != self._dataset_hash:
+                self._remove_other_versions(dataset_hash)
+                self._dataset_hash = dataset_hash
+                self._size = None
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._files())
+            else:
+                self._size += len(tile)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _remove_other_versions(self, dataset_hash):
+        for entry in os.listdir(self.root):
+            if entry != dataset_hash:
+                shutil.rmtree(os.path.join(self.root, entry), ignore_errors=True)
+
+    def _files(self):
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def _evict(self):
+        # down to three quarters, so that eviction does not run on every put
+        files = sorted(self._files())
+        size = sum(size for _, size, _ in files)
+        for _, file_size, path in files:
+            if size <= self.max_bytes * 3 // 4:
+                break
+            try:
+                os.remove(path)
+                size -= file_size
+            except OSError:
+                pass
+        self._size = size
+
+
+tile_cache = TileCache()
+
+
+# ------
+# Routes
+# ------
+
+
+def get_query_key(query):
+    """
+    Cache key of a facilities query; "" when nothing is filtered
+
+    """
+
+    if not (query["facets"] or query["bbox"] or query["radius"] or query["q"]):
+        return ""
+    return json.dumps(query, sort_keys=True)
+
+
+@tiles.route("/tiles/<int:z>/<int:x>/<int:y>.mvt")
+def tile(z, x, y):
+    if not (0 <= z <= MAX_ZOOM and 0 <= x < (1 << z) and 0 <= y < (1 << z)):
+        return jsonify(error="no such tile"), 404
+
+    try:
+        query = parse_query(request.args)
+    except QueryError as e:
+        return jsonify(error=str(e)), 400
+
+    data = get_dataset_manager().current()
+    key = get_query_key(query)
+
+    etag = get_etag(data, "{}/{}/{}/{}".format(key, z, x, y))
+    headers = {"ETag": '"{}"'.format(etag), "Cache-Control": "no-cache"}
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+
+    path = tile_cache.path(data.dataset_hash, key, z, x, y)
+    body = tile_cache.get(path)
+    if body is None:
+        body = build_tile(data, key, z, x, y)
+        # most of the world is empty tiles, which are cheap to build
+        if body:
+            tile_cache.put(data.dataset_hash, path, body)
+
+    return Response(
+        body, mimetype="application/vnd.mapbox-vector-tile", headers=headers
+    )
@@ -0,0 +1,235 @@
+"""
+Sorted, dictionary-encoded vocabularies of the filter facets
+
+The vocabulary of a facet (country, facility type, infrastructure tag or
+available-data tag) is the list of its distinct values in dropdown order
+(case-insensitive), with a code per facility row into that list. Vocabularies
+are built once per dataset version when the store is compiled and are saved in
+it, so the dropdown options, the facet index and the browser's filter index
+are read from them instead of being re-derived from the facility rows.
+
+"""
+
+import json
+import os
+
+# import pandas (needed for the data table)
+import pandas as pd
+
+# import numpy
+import numpy as np
+
+# facet name -> data frame column. List columns hold several tags per row.
+FACETS = {
+    "country": "country",
+    "type": "type_property",
+    "infrastructure": "infrastructure_list",
+    "availabledata": "availabledata_list",
+}
+
+LIST_FACETS = ("infrastructure", "availabledata")
+
+
+def _sort_key(value):
+    # case-insensitive, with a stable order for values that differ in case only
+    return (value.lower(), value)
+
+
+class Vocabulary:
+    """
+    The distinct values of one facet and a code per row
+
+    Parameters
+    ----------
+    values : list of str
+        the distinct values, sorted
+    codes : numpy array
+        int32 index into values; one per row (-1 if missing), or for list
+        facets one per list item
+    offsets : numpy array, optional
+        for list facets, the codes of row i are codes[offsets[i]:offsets[i + 1]]
+
+    """
+
+    def __init__(self, values, codes, offsets=None):
+        self.values = values
+        self.codes = codes
+        self.offsets = offsets
+        self.lookup = {v: i for i, v in enumerate(values)}
+
+    def __len__(self):
+        return len(self.values)
+
+    def row_positions(self):
+        """
+        Get the row position of each code
+
+        Returns
+        -------
+        positions : numpy array
+            the row of each entry of codes, skipping missing values
+        codes : numpy array
+            the matching codes
+
+        """
+
+        if self.offsets is None:
+            present = np.flatnonzero(self.codes >= 0)
+            return present, np.asarray(self.codes)[present]
+
+        lengths = np.diff(self.offsets)
+        positions = np.repeat(np.arange(len(lengths)), lengths)
+        return positions, np.asarray(self.codes)
+
+    def to_dict(self):
+        """
+        Get the vocabulary in the JSON form used by assets/explorer.js
+
+        """
+
+        encoded = {"values": list(self.values), "codes": self.codes.tolist()}
+        if self.offsets is not None:
+            encoded["offsets"] = self.offsets.tolist()
+        return encoded
+
+
+def encode_vocabulary(series, is_list=False):
+    """
+    Dictionary-encode a column with a sorted vocabulary
+
+    Parameters
+    ----------
+    series : pandas series
+        a facet column; list columns hold several values per row
+    is_list : bool
+        True if each row holds a list of values
+
+    Returns
+    -------
+    Vocabulary
+
+    """
+
+    offsets = None
+    if is_list:
+        lists = [v if isinstance(v, list) else [] for v in series]
+        series = pd.Series([i for v in lists for i in v], dtype=object)
+        offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(v) for v in lists])
+
+    codes, uniques = pd.factorize(series)
+    uniques = list(uniques)
+
+    # renumber the codes in sorted order
+    order = sorted(range(len(uniques)), key=lambda i: _sort_key(uniques[i]))
+    rank = np.empty(len(uniques) + 1, dtype=np.int32)
+    rank[order] = np.arange(len(uniques), dtype=np.int32)
+    rank[-1] = -1
+
+    return Vocabulary(
+        [uniques[i] for i in order], rank[codes].astype(np.int32), offsets
+    )
+
+
+def build_vocabularies(df_in):
+    """
+    Build the vocabulary of every facet
+
+    Returns
+    -------
+    dict
+        facet name -> Vocabulary
+
+    """
+
+    return {
+        facet: encode_vocabulary(df_in[column], facet in LIST_FACETS)
+        for facet, column in FACETS.items()
+    }
+
+
+def save_vocabularies(vocabularies, path):
+    """
+    Save vocabularies into a compiled store directory
+
+    """
+
+    with open(os.path.join(path, "vocabulary.json"), "w") as f:
+        json.dump({facet: v.values for facet, v in vocabularies.items()}, f)
+    for facet, vocabulary in vocabularies.items():
+        np.save(
+            os.path.join(path, "vocabulary.{}.codes.npy".format(facet)),
+            vocabulary.codes,
+        )
+        if vocabulary.offsets is not None:
+            np.save(
+                os.path.join(path, "vocabulary.{}.offsets.npy".format(facet)),
+                vocabulary.offsets,
+            )
+
+
+def load_vocabularies(path):
+    """
+    Load vocabularies saved by save_vocabularies
+
+    """
+
+    with open(os.path.join(path, "vocabulary.json")) as f:
+        values = json.load(f)
+
+    vocabularies = {}
+    for facet in FACETS:
+        codes = np.load(os.path.join(path, "vocabulary.{}.codes.npy".format(facet)))
+        offsets = None
+        if facet in LIST_FACETS:
+            offsets = np.load(
+                os.path.join(path, "vocabulary.{}.offsets.npy".format(facet))
+            )
+        vocabularies[facet] = Vocabulary(values[facet], codes, offsets)
+
+    return vocabularies
+
+
+# one set of vocabularies per dataset version
+_vocabularies = {}
+
+
+def get_vocabularies(df_in, dataset_hash, store_path=None):
+    """
+    Return the vocabularies of a dataset version, building them only once
+
+    Parameters
+    ----------
+    df_in : data frame
+        the facility data
+    dataset_hash : str
+        the dataset version
+    store_path : str, optional
+        the compiled store of this version; its saved vocabularies are used if
+        there are any
+
+    """
+
+    if dataset_hash not in _vocabularies:
+        vocabularies = None
+        saved = store_path and os.path.join(store_path, "vocabulary.json")
+        if saved and os.path.exists(saved):
+            try:
+                vocabularies = load_vocabularies(store_path)
+            except (OSError, ValueError, KeyError):
+                vocabularies = None
+        if vocabularies is None or any(
+            _n_rows(v) != len(df_in) for v in vocabularies.values()
+        ):
+            vocabularies = build_vocabularies(df_in)
+
+        _vocabularies.clear()
+        _vocabularies[dataset_hash] = vocabularies
+
+    return _vocabularies[dataset_hash]
+
+
+def _n_rows(vocabulary):
+    if vocabulary.offsets is None:
+        return len(vocabulary.codes)
+    return len(vocabulary.offsets) - 1
@@ -8,7 +8,7 @@ import dash
 from dash import Dash, html, Input, Output, State
 from dash import dcc
 from dash import dash_table
-from dash.dependencies import Input, Output, ALL
+from dash.dependencies import Input, Output, ALL, ClientsideFunction
 
 import dash_bootstrap_components as dbc
 
@@ -17,9 +17,10 @@ import dash_leaflet as dl
 # math routines
 import math
 
-# import pyyaml module
-import yaml
-from yaml.loader import SafeLoader
+# show the pre-rendered facility HTML as Dash components
+from html.parser import HTMLParser
+
+import os
 
 # import pandas (needed for the data table)
 import pandas as pd
@@ -27,8 +28,13 @@ import pandas as pd
 # import numpy
 import numpy as np
 
-# get domain from URLs
-from urllib.parse import urlparse
+# compiled facility data
+from facilities.dataset import get_dataset_manager
+from facilities.export import FORMATS as EXPORT_FORMATS
+from facilities.index import FacetIndex, bits_contain, positions_to_bits
+from facilities.markup import VOID_TAGS
+from facilities.search import build_search_index
+from facilities.spatial import GridIndex
 
 # ------------------------------------
 # Register this page and add meta data
@@ -46,65 +52,63 @@ dash.register_page(
 # Get and prepare data
 # --------------------
 
+# set EXPLORER_RELOAD_INTERVAL to a number of seconds to check data/facilities
+# for changes that often, and to switch to the new data without a restart
+RELOAD_INTERVAL = float(os.environ.get("EXPLORER_RELOAD_INTERVAL", "") or 0)
 
-def prepare_data(data_source):
-
-    # Open the file and load the file
-    with open(data_source) as f:
-        data = yaml.load(f, Loader=SafeLoader)
-
-    # convert data to a datatable - easier later
-    df_in = pd.DataFrame(data["features"])
-    df_in.reset_index(inplace=True)
-
-    # explode and join the dictionaries
-    df_geom = pd.DataFrame(df_in.pop("geometry").values.tolist())
-    df_geom.reset_index(inplace=True)
-
-    df_properties = pd.DataFrame(df_in.pop("properties").values.tolist())
-    df_properties.reset_index(inplace=True)
-    # pop out the coordinates from the geometry
-    df_coordinates = pd.DataFrame(
-        df_geom.pop("coordinates").values.tolist(), columns=["lon", "lat", "elev"]
-    )
-    df_coordinates.reset_index(inplace=True)
-    # join them
-    df = df_geom.join(
-        df_properties.set_index("index"), lsuffix="_geom", rsuffix="_property"
-    )
-
-    df = df.join(df_coordinates.set_index("index"))
-
-    # information
-    df_information = pd.DataFrame(df_in.pop("information"))
-    df_information.reset_index(inplace=True)
-    df = df.join(df_information.set_index("index"))
-
-    # infrastructure is a dictionary
-    df_infrastructure = pd.json_normalize(df_in["infrastructure"])
-    df_infrastructure.reset_index(inplace=True)
-    df["infrastructure_desc"] = df_infrastructure.description
-    df["infrastructure_list"] = df_infrastructure.generic
-    df["infrastructure_specific"] = df_infrastructure.specific
-
-    # data is a column of lists
-    df_availabledata = pd.json_normalize(df_in["availabledata"])
-    df_availabledata.reset_index(inplace=True)
-    df["availabledata_desc"] = df_availabledata.description
-    df["availabledata_list"] = df_availabledata.generic
-    df["availabledata_specific"] = df_availabledata.specific
-    df["availabledata_portal"] = df_availabledata.portal
-
-    # create an index column - useful
-    df.insert(0, column="facility_id", value=df.index.values)
-
-    # and finally, sort all by name
-    df.sort_values(by=["name"], inplace=True)
-
-    return df
-
+# the facility data and its indexes (filter bitsets, spatial grid, text search,
+# table ranks). The compiled store is only rebuilt from the YAML when the YAML
+# has changed. Callbacks take one snapshot with dataset_manager.current() and
+# use it throughout, so a reload never mixes two versions of the data.
+dataset_manager = get_dataset_manager(
+    "data/facilities/facilities.yaml", interval=RELOAD_INTERVAL or 5.0
+)
 
-df = prepare_data("data/facilities/facilities.yaml")
+# set EXPLORER_CLIENTSIDE_FILTERING=1 to filter in the browser instead of on the
+# server. The facet index is then sent to the browser once per dataset version.
+CLIENTSIDE_FILTERING = os.environ.get("EXPLORER_CLIENTSIDE_FILTERING", "") == "1"
+
+# set EXPLORER_MAP_LAYER=geojson to draw the facilities as one clustered GeoJSON
+# layer instead of one dl.Marker component per facility, or
+# EXPLORER_MAP_LAYER=tiles to draw the vector tiles of facilities/tiles.py, which
+# are clustered on the server and only fetched for the visible part of the map
+MAP_LAYER = os.environ.get("EXPLORER_MAP_LAYER", "markers")
+
+# set EXPLORER_PRECOMPUTE_CARDS=1 to render every facility's information card at
+# startup; otherwise the most recently used cards are kept
+PRECOMPUTE_CARDS = os.environ.get("EXPLORER_PRECOMPUTE_CARDS", "") == "1"
+CARD_CACHE_SIZE = None if PRECOMPUTE_CARDS else 1024
+
+# set EXPLORER_VIEWPORT_QUERIES=1 to only send the facilities in (and around) the
+# visible part of the map; the others are drawn as one summary marker per area.
+# Set EXPLORER_TABLE_FOLLOWS_VIEWPORT=1 to also limit the table to the viewport.
+# Both only apply to server-side filtering.
+VIEWPORT_QUERIES = os.environ.get("EXPLORER_VIEWPORT_QUERIES", "") == "1"
+TABLE_FOLLOWS_VIEWPORT = os.environ.get("EXPLORER_TABLE_FOLLOWS_VIEWPORT", "") == "1"
+
+# set EXPLORER_TABLE_PAGING=custom to sort, filter and page the table on the
+# server, so that only the visible page is sent to the browser. Only applies to
+# server-side filtering.
+TABLE_PAGING = os.environ.get("EXPLORER_TABLE_PAGING", "native")
+if CLIENTSIDE_FILTERING:
+    TABLE_PAGING = "native"
+
+# fraction of the viewport's size added on every side, so that small pans do not
+# show an empty map before the callback returns
+VIEWPORT_MARGIN = 0.25
+
+# number of filter results to keep (see get_filtered_facility_ids)
+FILTER_CACHE_SIZE = 256
+
+# query parameters of the page URL -> selector, named as in /api/facilities; the
+# selected facility is "facility", by its slug (see update_url in
+# assets/explorer.js)
+URL_FILTERS = (
+    ("country", "country_selector"),
+    ("type", "facilitytype_selector"),
+    ("infrastructure", "infrastructure_selector"),
+    ("availabledata", "availabledata_selector"),
+)
 
 # px.set_mapbox_access_token(open(".mapbox_token").read())
 
@@ -113,81 +117,60 @@ df = prepare_data("data/facilities/facilities.yaml")
 # -----------
 
 
-def get_countries(df_in):
-    countries = sorted(df_in.country.dropna().unique(), key=str.lower)
-    return countries
-
-
-def get_countries_label_value_pairs(df_in):
-    label_value_pairs = []
-    for i in get_countries(df_in):
-        label_value_pairs.append({"label": i, "value": i})
-
-    return label_value_pairs
-
-
-def get_facility_types(df_in):
-    return sorted(df_in.type_property.dropna().unique(), key=str.lower)
-
-
-def get_facility_types_label_value_pairs(df_in):
-    label_value_pairs = []
-    for i in get_facility_types(df_in):
-        label_value_pairs.append({"label": i, "value": i})
-
-    return label_value_pairs
-
-
-def get_infrastructure_info(df_in):
-
-    infrastructure_list = []
-    for sublist in df_in.infrastructure_list.dropna():
-        infrastructure_list.extend(sublist)
-
-    infrastructure_list = list(set(infrastructure_list))
-    infrastructure_list.sort(key=str.lower)
-
-    return infrastructure_list
-
-
-def get_infrastructure_label_value_pairs(df_in):
-
-    label_value_pairs = []
-    for i in get_infrastructure_info(df_in):
-        label_value_pairs.append({"label": i, "value": i})
-
-    return label_value_pairs
-
-
-def get_availabledata_info(df_in):
+def get_facet_options(selections, restrict=None, data=None):
+    """
+    Create the dropdown options with the number of facilities each would give
 
-    availabledata_list = []
-    for sublist in df.availabledata_list.dropna():
-        availabledata_list.extend(sublist)
+    Options that would give no facilities are disabled, unless they are
+    selected (so that they can still be removed).
 
-    availabledata_list = list(set(availabledata_list))
-    availabledata_list.sort(key=str.lower)
+    Parameters
+    ----------
+    selections : dict
+        as returned by get_facet_selections
+    restrict : numpy array, optional
+        bitset of the facilities left by the text and radius searches
+    data : Dataset, optional
+        the snapshot to count in; defaults to the current one
 
-    return availabledata_list
+    Returns
+    -------
+    dict
+        facet name -> list of dropdown options
 
+    """
 
-def get_availabledata_label_value_pairs(df_in):
+    if data is None:
+        data = dataset_manager.current()
+
+    # the facet index counts in vocabulary order, which is the dropdown order
+    counts = data.facet_index.counts(selections, restrict)
+
+    options = {}
+    for facet, vocabulary in data.vocabularies.items():
+        selected = selections.get(facet) or []
+        options[facet] = [
+            {
+                "label": "{} ({})".format(value, count),
+                "value": value,
+                "disabled": count == 0 and value not in selected,
+            }
+            for value, count in zip(vocabulary.values, counts[facet].tolist())
+        ]
 
-    label_value_pairs = []
-    for i in get_availabledata_info(df_in):
-        label_value_pairs.append({"label": i, "value": i})
+    return options
 
-    return label_value_pairs
 
+def create_selectors(data):
 
-def create_selectors(df):
+    options = get_facet_options(get_facet_selections(), data=data)
 
     countrySelector = dbc.Col(
         [
             dbc.Label("Country"),
             dcc.Dropdown(
                 id="country_selector",
-                options=get_countries_label_value_pairs(df),
+                options=options["country"],
                 multi=True,
                 value="",
                 optionHeight=45,
@@ -201,7 +184,7 @@ def create_selectors(df):
             dbc.Label("Facility type"),
             dcc.Dropdown(
                 id="facilitytype_selector",
-                options=get_facility_types_label_value_pairs(df),
+                options=options["type"],
                 multi=True,
                 value="",
                 optionHeight=45,
@@ -215,7 +198,7 @@ def create_selectors(df):
             dbc.Label("Infrastructure"),
             dcc.Dropdown(
                 id="infrastructure_selector",
-                options=get_infrastructure_label_value_pairs(df),
+                options=options["infrastructure"],
                 multi=True,
                 value="",
                 optionHeight=45,
@@ -229,7 +212,7 @@ def create_selectors(df):
             dbc.Label("Available data"),
             dcc.Dropdown(
                 id="availabledata_selector",
-                options=get_availabledata_label_value_pairs(df),
+                options=options["availabledata"],
                 multi=True,
                 value="",
                 optionHeight=45,
@@ -248,6 +231,124 @@ def create_selectors(df):
     return filters
 
 
+def create_text_search():
+    """
+    Create the box for searching the facility descriptions
+
+    """
+
+    text_search = dbc.Row(
+        dbc.Col(
+            [
+                dbc.Label("Search descriptions and capabilities"),
+                dbc.Input(
+                    id="text-search",
+                    type="search",
+                    placeholder="e.g., lidar wake measurements",
+                    debounce=True,
+                ),
+            ],
+            className="col-12",
+        ),
+        className="mt-1",
+    )
+
+    return text_search
+
+
+def create_radius_search():
+    """
+    Create the controls for finding facilities near a point
+
+    The point can be typed in or set by clicking on the map. The search is
+    off while any of the fields is empty.
+
+    """
+
+    radius_search = dbc.Row(
+        [
+            dbc.Col(
+                [
+                    dbc.Label("Near latitude"),
+                    dbc.Input(
+                        id="radius-lat",
+                        type="number",
+                        min=-90,
+                        max=90,
+                        step="any",
+                        debounce=True,
+                    ),
+                ],
+                className="col-6 col-md-3",
+            ),
+            dbc.Col(
+                [
+                    dbc.Label("Near longitude"),
+                    dbc.Input(
+                        id="radius-lon",
+                        type="number",
+                        min=-180,
+                        max=180,
+                        step="any",
+                        debounce=True,
+                    ),
+                ],
+                className="col-6 col-md-3",
+            ),
+            dbc.Col(
+                [
+                    dbc.Label("Within (km)"),
+                    dbc.Input(
+                        id="radius-km",
+                        type="number",
+                        min=0,
+                        step="any",
+                        debounce=True,
+                    ),
+                ],
+                className="col-6 col-md-3",
+            ),
+            dbc.Col(
+                dbc.Checklist(
+                    id="radius-pick-on-map",
+                    options=[{"label": "Set the point on the map", "value": "pick"}],
+                    value=[],
+                    switch=True,
+                ),
+                className="col-6 col-md-3 align-self-end",
+            ),
+        ],
+        className="mt-1",
+    )
+
+    return radius_search
+
+
+def get_radius_search(lat, lon, radius_km):
+    """
+    Validate the radius search fields
+
+    Returns
+    -------
+    dict or None
+        "lat", "lon" and "radius_km", or None if the search is off
+
+    """
+
+    if lat is None or lon is None or radius_km is None:
+        return None
+
+    lat, lon, radius_km = float(lat), float(lon), float(radius_km)
+    if not (-90 <= lat <= 90) or radius_km <= 0:
+        return None
+
+    return {
+        "lat": lat,
+        "lon": (lon + 180.0) % 360.0 - 180.0,
+        "radius_km": radius_km,
+    }
+
+
 def filterIcon():
     """
     Define an icon for the filter row
@@ -263,68 +364,280 @@ def filterIcon():
     return filter_icon_element
 
 
+def get_facet_selections(
+    countries_selected="",
+    facilitytypes_selected="",
+    infrastructure_selected="",
+    availabledata_selected="",
+):
+    """
+    Collect the dropdown values into the selections of a FacetIndex
+
+    """
+
+    return {
+        "country": countries_selected,
+        "type": facilitytypes_selected,
+        "infrastructure": infrastructure_selected,
+        "availabledata": availabledata_selected,
+    }
+
+
 def filter_facilities(
     df_in,
     countries_selected="",
     facilitytypes_selected="",
     infrastructure_selected="",
     availabledata_selected="",
+    facet_index=None,
 ):
     """
     Find facilities that match the filter values
 
-    """
+    Any of the selected values within a filter may match; all filters must
+    match. The work is done on the packed bitsets of a FacetIndex.
 
-    # get the indices where any of the countries match
-    if not countries_selected:
-        country_i = df_in.index
-    else:
-        country_i = df_in.index[df_in["country"].isin(countries_selected)]
+    Parameters
+    ----------
+    df_in : data frame
+        the facilities to filter
+    countries_selected, facilitytypes_selected, infrastructure_selected, availabledata_selected : list
+        the values selected in each dropdown; empty selections match everything
+    facet_index : FacetIndex, optional
+        a prebuilt index of df_in. One is built if not given.
 
-    # get the indices where any of the facility types match
-    if not facilitytypes_selected:
-        facilitytype_i = df_in.index
-    else:
-        facilitytype_i = df_in.index[
-            df_in["type_property"].isin(facilitytypes_selected)
-        ]
+    Returns
+    -------
+    dff : data frame
+        the matching rows of df_in, in the same order
 
-    # get the indices where any of the infrastructure match
-    if not infrastructure_selected:
-        infrastructure_i = df_in.index
-    else:
-        # infrastructure_i = df_in.index
-        df_infrastructure = df_in.dropna(subset=["infrastructure_list"], inplace=False)
-        infrastructure_i = df_infrastructure.index[
-            pd.DataFrame(df_infrastructure["infrastructure_list"].tolist())
-            .isin(infrastructure_selected)
-            .any(1)
-            .values
-        ]
+    """
 
-    # get the indices where any of the available data match
-    if not availabledata_selected:
-        availabledata_i = df_in.index
-    else:
-        # availabledata_i = df_in.index
-        df_availabledata = df_in.dropna(subset=["availabledata_list"], inplace=False)
-        availabledata_i = df_availabledata.index[
-            pd.DataFrame(df_availabledata["availabledata_list"].tolist())
-            .isin(availabledata_selected)
-            .any(1)
-            .values
-        ]
+    if facet_index is None:
+        facet_index = FacetIndex(df_in)
 
-    # get the intersection of the indices
-    dff_i = country_i.intersection(facilitytype_i).copy()
-    dff_i = dff_i.intersection(infrastructure_i)
-    dff_i = dff_i.intersection(availabledata_i)
+    positions = facet_index.positions(
+        get_facet_selections(
+            countries_selected,
+            facilitytypes_selected,
+            infrastructure_selected,
+            availabledata_selected,
+        )
+    )
 
-    dff = df_in.loc[dff_i].copy()
+    dff = df_in.iloc[positions].copy()
 
     return dff
 
 
+def get_filter_key(
+    countries_selected="",
+    facilitytypes_selected="",
+    infrastructure_selected="",
+    availabledata_selected="",
+):
+    """
+    Normalize the dropdown values into a hashable filter key
+
+    The order of the selected values does not change the result, so each
+    facet's values are sorted and duplicates dropped.
+
+    Returns
+    -------
+    tuple
+        one sorted tuple of values per dropdown
+
+    """
+
+    return tuple(
+        tuple(sorted(set(selected or [])))
+        for selected in (
+            countries_selected,
+            facilitytypes_selected,
+            infrastructure_selected,
+            availabledata_selected,
+        )
+    )
+
+
+def get_filtered_facility_ids(data, filter_key):
+    """
+    Get the ids of the facilities that match the dropdowns
+
+    Popular filters (and the filters of shared links) are asked for again and
+    again, so the results of filter_facilities are cached with the snapshot,
+    and dropped with it after a reload.
+
+    Parameters
+    ----------
+    data : Dataset
+        the snapshot to filter
+    filter_key : tuple
+        the output of get_filter_key
+
+    Returns
+    -------
+    tuple of int
+        the ids of the matching facilities, in table order
+
+    """
+
+    return data.cached(
+        "filtered_facility_ids", filter_key, filter_facility_ids, FILTER_CACHE_SIZE
+    )
+
+
+def filter_facility_ids(data, filter_key):
+    dff = filter_facilities(data.df, *filter_key, facet_index=data.facet_index)
+
+    return tuple(get_facility_ids(dff))
+
+
+def search_facilities(df_in, query, search_index=None, limit=None):
+    """
+    Rank facilities by how well their descriptions match a query
+
+    Searches the description and quote, the specific infrastructure and
+    available data, and the available data description, ranked with BM25.
+
+    Parameters
+    ----------
+    df_in : data frame
+        the facilities to search
+    query : str
+        free text
+    search_index : SearchIndex, optional
+        a prebuilt index of df_in. One is built if not given.
+    limit : int, optional
+        return at most this many facilities
+
+    Returns
+    -------
+    list of int
+        the facility_id of the matching facilities, best match first
+
+    """
+
+    if search_index is None:
+        search_index = build_search_index(df_in)
+
+    positions, scores = search_index.search(query, limit=limit)
+
+    return df_in["facility_id"].values[positions].tolist()
+
+
+def find_facilities_near(
+    df_in,
+    lat,
+    lon,
+    radius_km,
+    countries_selected="",
+    facilitytypes_selected="",
+    infrastructure_selected="",
+    availabledata_selected="",
+    facet_index=None,
+    spatial_index=None,
+):
+    """
+    Find facilities within a distance of a point that match the filter values
+
+    The spatial index finds the facilities within the radius; each is then
+    checked against the bitset of the filters, so no intermediate data frames
+    are created.
+
+    Parameters
+    ----------
+    df_in : data frame
+        the facilities to search
+    lat, lon : float
+        the point in degrees
+    radius_km : float
+        the search radius in km
+    countries_selected, facilitytypes_selected, infrastructure_selected, availabledata_selected : list
+        the values selected in each dropdown; empty selections match everything
+    facet_index : FacetIndex, optional
+        a prebuilt index of df_in. One is built if not given.
+    spatial_index : GridIndex, optional
+        a prebuilt index of df_in. One is built if not given.
+
+    Returns
+    -------
+    positions : numpy array
+        row positions of the matching facilities in df_in, nearest first
+    distances : numpy array
+        their distances in km
+
+    """
+
+    if facet_index is None:
+        facet_index = FacetIndex(df_in)
+
+    if spatial_index is None:
+        spatial_index = GridIndex(df_in["lat"].values, df_in["lon"].values)
+
+    positions, distances = spatial_index.query_radius(lat, lon, radius_km)
+
+    bits = facet_index.match(
+        get_facet_selections(
+            countries_selected,
+            facilitytypes_selected,
+            infrastructure_selected,
+            availabledata_selected,
+        )
+    )
+    match = bits_contain(bits, positions)
+
+    return positions[match], distances[match]
+
+
+def get_facility_ids(dff):
+    """
+    Get the compact form of a set of facilities for a dcc.Store
+
+    Parameters
+    ----------
+    dff : data frame
+        some rows of the facility data
+
+    Returns
+    -------
+    list of int
+        the facility_id of each row, in order
+
+    """
+
+    return dff["facility_id"].tolist()
+
+
+def get_facilities_by_id(facility_ids, data=None):
+    """
+    Look up facilities from the ids held in a dcc.Store
+
+    The heavy columns (descriptions, quotes, lists) stay on the server and are
+    resolved here by index instead of round-tripping through the browser. The
+    rows only have the columns of data.df; get the details of a facility being
+    shown with Dataset.rows.
+
+    Parameters
+    ----------
+    facility_ids : list of int
+        ids as returned by get_facility_ids
+    data : Dataset, optional
+        the snapshot to look in; defaults to the current one
+
+    Returns
+    -------
+    dff : data frame
+        the matching rows, in the order of facility_ids
+
+    """
+
+    if data is None:
+        data = dataset_manager.current()
+
+    return data.df.iloc[data.positions(facility_ids)]
+
+
 # -----------------
 # Utility functions
 # -----------------
@@ -332,13 +645,14 @@ def filter_facilities(
 
 def create_www_link(url):
 
-    if any(pd.isna(url)):
+    # URLs are normalized when the data is compiled: a string, or None
+    if not url:
         www_link = []
     else:
         www_link = html.A(
             [html.I(className="fa-solid fa-globe"), " link"],
             className="btn btn-outline-secondary mr-2",
-            href="".join(url),
+            href=url,
             target="_blank",
         )
 
@@ -353,7 +667,7 @@ def create_www_link_button(
     button_classes="",
 ):
 
-    if not url.strip():
+    if not url:
         return dbc.Button(
             [html.I(className=icon_classes), " ", button_text],
             href="#",
@@ -366,7 +680,7 @@ def create_www_link_button(
     else:
         return dbc.Button(
             [html.I(className=icon_classes), " ", button_text],
-            href="".join(url),
+            href=url,
             target="_blank",
             color=button_color,
             disabled=False,
@@ -376,21 +690,43 @@ def create_www_link_button(
         )
 
 
-def create_googlemaps_link_button(lat, lon):
+def create_export_links():
+    """
+    Create links to download the filtered facilities
 
-    if any(pd.isna([lat, lon])):
-        return []
-    else:
-        url_str = (
-            "https://www.google.com/maps/search/?api=1&query="
-            + lat.apply(str)
-            + "%2C"
-            + lon.apply(str)
-            + ""
+    One link per file format of facilities/export.py. The links are kept in
+    step with the filters by the update_export_links clientside callback.
+
+    Returns
+    -------
+    HTML object
+        a Dash HTML object with the download links
+
+    """
+
+    labels = {"csv": "CSV", "geojson": "GeoJSON", "parquet": "Parquet"}
+
+    links = [
+        html.A(
+            [html.I(className="fa-solid fa-download"), " ", labels[extension]],
+            id="export-link-" + extension,
+            href=dash.get_relative_path("/api/facilities." + extension),
+            className="me-1 btn btn-outline-secondary btn-sm",
         )
+        for extension in EXPORT_FORMATS
+    ]
+
+    return html.Div(["Download the filtered facilities: "] + links, className="mt-1")
+
 
+def create_googlemaps_link_button(googlemaps_url):
+
+    # built when the data is compiled; None for facilities without a location
+    if not googlemaps_url:
+        return []
+    else:
         return create_www_link_button(
-            "".join(url_str),
+            googlemaps_url,
             button_text="Google maps",
             icon_classes="fa-solid fa-map-location-dot",
             button_color="primary",
@@ -443,19 +779,51 @@ def get_map_center(df_in):
     return map_center
 
 
-def get_icon(icon):
-    def get_icon_url(icon):
-        if icon == "data portal":
-            return dash.get_asset_url("facility-icons/data-portal.png")
-        elif icon == "met mast":
-            return dash.get_asset_url("facility-icons/met-mast.png")
-        elif icon == "marine and maritime research center":
-            return dash.get_asset_url(
-                "facility-icons/marine-maritime-research-center.png"
-            )
-        elif icon == "power systems research center":
-            return dash.get_asset_url(
-                "facility-icons/power-systems-research-center.png"
+def get_map_bounds(df_in):
+    """
+    Get the bounds of the facilities with a location
+
+    Parameters
+    ----------
+    df_in : data frame
+        the facilities
+
+    Returns
+    -------
+    list or None
+        [[south, west], [north, east]] in degrees, padded so that a single
+        facility is not shown at maximum zoom. None if no facility has a
+        location.
+
+    """
+
+    # get all of the non-na coordinates
+    df_pos = df_in.dropna(subset=["lat", "lon"])
+
+    if df_pos.empty:
+        return None
+
+    padding = 1.0 if len(df_pos) == 1 else 0.0
+
+    return [
+        [df_pos["lat"].min() - padding, df_pos["lon"].min() - padding],
+        [df_pos["lat"].max() + padding, df_pos["lon"].max() + padding],
+    ]
+
+
+def get_icon(icon):
+    def get_icon_url(icon):
+        if icon == "data portal":
+            return dash.get_asset_url("facility-icons/data-portal.png")
+        elif icon == "met mast":
+            return dash.get_asset_url("facility-icons/met-mast.png")
+        elif icon == "marine and maritime research center":
+            return dash.get_asset_url(
+                "facility-icons/marine-maritime-research-center.png"
+            )
+        elif icon == "power systems research center":
+            return dash.get_asset_url(
+                "facility-icons/power-systems-research-center.png"
             )
         elif icon == "surface energy balance":
             return dash.get_asset_url("facility-icons/surface-energy-balance.png")
@@ -494,7 +862,120 @@ def get_icon(icon):
     return icon
 
 
-def create_facility_map_leaflet(df_map, dff_selected):
+def create_facility_features(df_in):
+    """
+    Create a GeoJSON point feature for every facility
+
+    Parameters
+    ----------
+    df_in : data frame
+        the facility data
+
+    Returns
+    -------
+    numpy array
+        one feature per row of df_in, or None where the facility has no
+        location
+
+    """
+
+    features = np.empty(len(df_in), dtype=object)
+    for i, (facility_id, name, icon, lat, lon) in enumerate(
+        zip(df_in.facility_id, df_in.name, df_in.icon, df_in.lat, df_in.lon)
+    ):
+        if pd.isna(lat) or pd.isna(lon):
+            continue
+        features[i] = {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+            "properties": {
+                "facility_id": int(facility_id),
+                "tooltip": name,
+                "icon": None if pd.isna(icon) else icon,
+            },
+        }
+
+    return features
+
+
+def create_icon_lookup(df_in):
+    """
+    Create the icon for every facility type, for the GeoJSON layer's hideout
+
+    """
+
+    icons = {icon: get_icon(icon) for icon in df_in.icon.dropna().unique()}
+
+    return {"icons": icons, "default": get_icon(None)}
+
+
+def get_facility_features(df_map, data=None):
+    """
+    Get the GeoJSON features of some facilities from the prebuilt features
+
+    The features only depend on the data, so they are built once per
+    snapshot.
+
+    """
+
+    if data is None:
+        data = dataset_manager.current()
+
+    positions = data.df.index.get_indexer(df_map.index)
+    if (positions < 0).any():
+        # not a subset of the loaded data (e.g., synthetic data)
+        features = create_facility_features(df_map)
+    else:
+        features = data.derived(
+            "facility_features", lambda d: create_facility_features(d.df)
+        )[positions]
+
+    return {
+        "type": "FeatureCollection",
+        "features": [f for f in features if f is not None],
+    }
+
+
+def create_facility_geojson(df_map, data=None):
+    """
+    Create a single clustered GeoJSON layer for the facilities
+
+    Clustering is done in the browser by supercluster, and the markers are
+    drawn by dashExtensions.explorer.pointToLayer in assets/explorer.js.
+
+    Parameters
+    ----------
+    df_map : data frame
+        the facilities to show
+    data : Dataset, optional
+        the snapshot df_map comes from; defaults to the current one
+
+    Returns
+    -------
+    dl.GeoJSON
+        the map layer
+
+    """
+
+    if data is None:
+        data = dataset_manager.current()
+
+    return dl.GeoJSON(
+        id="facility-geojson",
+        data=get_facility_features(df_map, data),
+        cluster=True,
+        zoomToBoundsOnClick=True,
+        superClusterOptions={"radius": 80},
+        options={"pointToLayer": {"variable": "dashExtensions.explorer.pointToLayer"}},
+        hideout=data.derived("icon_lookup", lambda d: create_icon_lookup(d.df)),
+    )
+
+
+def create_facility_markers(df_map):
+    """
+    Create a cluster group with one dl.Marker per facility
+
+    """
 
     markers = []
     # map_children.append(dl.TileLayer())
@@ -523,26 +1004,160 @@ def create_facility_map_leaflet(df_map, dff_selected):
                 )
             )
 
-    marker_cluster = dl.MarkerClusterGroup(id="markers", children=markers)
+    return dl.MarkerClusterGroup(id="markers", children=markers)
 
-    map_zoom = get_map_zoom(df_map)
-    map_center = get_map_center(df_map)
 
-    attribution = '&copy; <a href="https://www.openstreetmap.org/about/" target="_blank">OpenStreetMap</a> '
+def create_facility_tile_layer(data=None):
+    """
+    Create the GeoJSON layer the facility vector tiles are drawn in
 
-    if dff_selected.empty:
-        leaflet_map = dl.Map(
-            [
-                dl.TileLayer(attribution=attribution),
-                marker_cluster,
+    The layer starts empty. The explorer.update_tiles clientside callback
+    fetches the tiles of the visible part of the map from /tiles and decodes
+    them into its features, and dashExtensions.explorer.tilePointToLayer in
+    assets/explorer.js draws the clusters and the facilities.
+
+    Parameters
+    ----------
+    data : Dataset, optional
+        the snapshot to take the icons from; defaults to the current one
+
+    Returns
+    -------
+    dl.GeoJSON
+        the map layer
+
+    """
+
+    if data is None:
+        data = dataset_manager.current()
+
+    return dl.GeoJSON(
+        id="facility-geojson",
+        data={"type": "FeatureCollection", "features": []},
+        options={
+            "pointToLayer": {"variable": "dashExtensions.explorer.tilePointToLayer"}
+        },
+        hideout=data.derived("icon_lookup", lambda d: create_icon_lookup(d.df)),
+    )
+
+
+def get_facility_layer_data(df_map, data=None):
+    """
+    Get the data of the facility layer for some facilities
+
+    This is what changes when the filters change: the children of the marker
+    cluster group, or the features of the GeoJSON layer.
+
+    """
+
+    if MAP_LAYER == "geojson":
+        return get_facility_features(df_map, data)
+
+    return create_facility_markers(df_map).children
+
+
+def get_viewport_positions(filtered_facility_ids, bounds, margin=0.0, data=None):
+    """
+    Split the filtered facilities by whether they are inside the viewport
+
+    Parameters
+    ----------
+    filtered_facility_ids : list of int
+        the contents of filtered-facilities-store
+    bounds : list
+        the viewport as [[south, west], [north, east]]
+    margin : float
+        fraction of the viewport's size added on every side
+    data : Dataset, optional
+        the snapshot to look in; defaults to the current one
+
+    Returns
+    -------
+    inside, outside, unlocated : numpy arrays
+        row positions (in the snapshot's data) of the facilities inside and
+        outside the viewport, and of those without a location
+
+    """
+
+    if data is None:
+        data = dataset_manager.current()
+
+    spatial_index = data.spatial_index
+    positions = data.positions(filtered_facility_ids)
+
+    (south, west), (north, east) = bounds
+    in_view = np.zeros(spatial_index.lat.shape, dtype=bool)
+    in_view[spatial_index.query_bbox(south, west, north, east, margin)] = True
+
+    located = ~(
+        np.isnan(spatial_index.lat[positions]) | np.isnan(spatial_index.lon[positions])
+    )
+    inside = in_view[positions]
+
+    return (
+        positions[inside],
+        positions[located & ~inside],
+        positions[~located],
+    )
+
+
+def create_summary_markers(summaries):
+    """
+    Create one marker per summarised group of facilities outside the viewport
+
+    Parameters
+    ----------
+    summaries : list of dict
+        as returned by GridIndex.summarize
+
+    Returns
+    -------
+    list
+        the children of the summary layer
+
+    """
+
+    return [
+        dl.CircleMarker(
+            center=(summary["lat"], summary["lon"]),
+            radius=min(8 + 2 * math.log2(summary["count"]), 24),
+            color="#666",
+            fillOpacity=0.4,
+            children=[
+                dl.Tooltip(
+                    "{} {}".format(
+                        summary["count"],
+                        "facility" if summary["count"] == 1 else "facilities",
+                    )
+                ),
             ],
-            zoom=map_zoom,
-            center=map_center,
         )
+        for summary in summaries
+    ]
 
-    else:
-        for index, facility in dff_selected.iterrows():
-            selected_marker = dl.CircleMarker(
+
+def create_selected_facility_marker(dff_selected):
+    """
+    Create the highlight drawn around the selected facility
+
+    Parameters
+    ----------
+    dff_selected : data frame
+        the selected facility; may be empty
+
+    Returns
+    -------
+    list
+        the children of the selected-facility layer
+
+    """
+
+    selected_markers = []
+    for index, facility in dff_selected.iterrows():
+        if pd.isna(facility["lat"]) or pd.isna(facility["lon"]):
+            continue
+        selected_markers.append(
+            dl.CircleMarker(
                 center=(facility["lat"], facility["lon"]),
                 radius=10,
                 color="#666",
@@ -558,13 +1173,66 @@ def create_facility_map_leaflet(df_map, dff_selected):
                     # dl.Popup(facility["name"],),
                 ],
             )
-
-        leaflet_map = dl.Map(
-            [dl.TileLayer(attribution=attribution), marker_cluster, selected_marker],
-            zoom=get_map_zoom(dff_selected),
-            center=get_map_center(dff_selected),
         )
 
+    return selected_markers
+
+
+def create_facility_map_leaflet(df_map, dff_selected, data=None):
+    """
+    Create the facility map
+
+    The map is created once for the page layout. After that, callbacks only
+    patch the facility layer, the selected-facility layer and the viewport.
+
+    Parameters
+    ----------
+    df_map : data frame
+        the facilities to show
+    dff_selected : data frame
+        the selected facility; may be empty
+    data : Dataset, optional
+        the snapshot df_map comes from; defaults to the current one
+
+    Returns
+    -------
+    dl.Map
+        the map
+
+    """
+
+    if MAP_LAYER == "geojson":
+        marker_cluster = create_facility_geojson(df_map, data)
+    elif MAP_LAYER == "tiles":
+        marker_cluster = create_facility_tile_layer(data)
+    else:
+        marker_cluster = create_facility_markers(df_map)
+
+    if dff_selected.empty:
+        map_zoom = get_map_zoom(df_map)
+        map_center = get_map_center(df_map)
+    else:
+        map_zoom = get_map_zoom(dff_selected)
+        map_center = get_map_center(dff_selected)
+
+    attribution = '&copy; <a href="https://www.openstreetmap.org/about/" target="_blank">OpenStreetMap</a> '
+
+    leaflet_map = dl.Map(
+        [
+            dl.TileLayer(attribution=attribution),
+            marker_cluster,
+            dl.LayerGroup(id="facility-summary-layer"),
+            dl.LayerGroup(id="radius-search-layer"),
+            dl.LayerGroup(
+                create_selected_facility_marker(dff_selected),
+                id="selected-facility-layer",
+            ),
+        ],
+        id="facility-map",
+        zoom=map_zoom,
+        center=map_center,
+    )
+
     return leaflet_map
 
 
@@ -587,7 +1255,22 @@ def points_not_shown_warning():
 # -----------------------
 
 
-def create_sortable_facility_table(df_in):
+def get_table_records(dff):
+    """
+    Get the rows of the table for some facilities
+
+    """
+
+    df_table = dff[["name", "country", "type_property", "facility_id"]].copy()
+
+    df_table["id"] = df_table.facility_id
+
+    df_table.rename(columns={"type_property": "type"}, inplace=True)
+
+    return df_table.to_dict("records")
+
+
+def create_sortable_facility_table(df_in, data=None):
     """
     Create a sortable table for the facilities
 
@@ -597,6 +1280,8 @@ def create_sortable_facility_table(df_in):
     ----------
     df_in : data frame
         A data fram containing a subset of the data about the facilities
+    data : Dataset, optional
+        the snapshot df_in comes from; defaults to the current one
 
     Returns
     -------
@@ -605,11 +1290,21 @@ def create_sortable_facility_table(df_in):
 
     """
 
-    df_table = df_in[["name", "country", "type_property", "facility_id"]].copy()
-
-    df_table["id"] = df_table.facility_id
+    page_size = 7
 
-    df_table.rename(columns={"type_property": "type"}, inplace=True)
+    if TABLE_PAGING == "custom":
+        if data is None:
+            data = dataset_manager.current()
+        # only the first page; the rest is requested by update_table_page
+        page, page_count = data.table_index.page(
+            data.df.index.get_indexer(df_in.index), "", [], 0, page_size
+        )
+        table_data = get_table_records(data.df.iloc[page])
+        table_action = "custom"
+    else:
+        table_data = get_table_records(df_in)
+        page_count = None
+        table_action = "native"
 
     # create a list of columns to display
     show_columns = ["name", "country", "type"]
@@ -621,7 +1316,7 @@ def create_sortable_facility_table(df_in):
                 {"name": i, "id": i, "deletable": False, "selectable": False}
                 for i in show_columns  # df_table.columns
             ],
-            data=df_table.to_dict("records"),
+            data=table_data,
             # data = df_table.to_dict('index'),
             style_data={"whiteSpace": "normal", "height": "auto", "lineHeight": "15px"},
             style_cell_conditional=[
@@ -643,18 +1338,19 @@ def create_sortable_facility_table(df_in):
                 "border": "1px solid #E9E9E9",
             },
             editable=False,
-            filter_action="native",
-            sort_action="native",
+            filter_action=table_action,
+            sort_action=table_action,
             sort_mode="multi",
             column_selectable="single",
             # row_selectable="multi",
             row_deletable=False,
             selected_columns=[],
             selected_rows=[],
-            page_action="native",
+            page_action=table_action,
             style_table={"overflow-y": "none", "border": "1px solid #E9E9E9"},
             page_current=0,
-            page_size=7,
+            page_size=page_size,
+            page_count=page_count,
         ),
     )
 
@@ -726,32 +1422,25 @@ def get_card_facility_description_element(dff_selected):
 
     """
 
-    if dff_selected["information"].any():
+    # the normalized fields of facilities/schema.py: text and URLs are None
+    # when missing, never empty
+    facility = dff_selected.iloc[0]
 
-        # convert the dataframe in to a dictionary
-        info_dict = dff_selected["information"].squeeze()
+    if facility["information"]:
 
         # get the description text
-        if info_dict.get("description"):
-            description_text = info_dict.get("description")
-            description_text_element = dcc.Markdown(
-                description_text, dangerously_allow_html=True
-            )
-        else:
-            description_text_element = []
+        description_text_element = create_html_element(facility["description_html"])
 
         # check if it has a quote we want to use
-        if info_dict.get("quote"):
-            description_quote_element = dcc.Markdown(
-                "> " + info_dict.get("quote") + "", dangerously_allow_html=True
-            )
-            if info_dict.get("quote"):
+        if facility["quote_html"]:
+            description_quote_element = create_html_element(facility["quote_html"])
+            if facility["source_url"]:
                 description_source_element = html.Footer(
                     [
                         "from ",
                         html.A(
-                            urlparse(info_dict.get("source")).netloc,
-                            href="".join(info_dict.get("source")),
+                            facility["source_domain"],
+                            href=facility["source_url"],
                             target="_blank",
                         ),
                     ],
@@ -763,24 +1452,19 @@ def get_card_facility_description_element(dff_selected):
             description_quote_element = []
             description_source_element = []
 
-        if info_dict.get("note"):
-            description_note_element = html.P("N.B.: {}.".format(info_dict.get("note")))
+        if facility["info_note"]:
+            description_note_element = html.P("N.B.: {}.".format(facility["info_note"]))
         else:
             description_note_element = []
 
         # create links to go with it
-        if info_dict.get("homepage"):
-            link_button_home = create_www_link_button(
-                info_dict["homepage"], button_text="Homepage", button_color="primary"
-            )
-        else:
-            link_button_home = create_www_link_button(
-                "", button_text="Homepage", button_color="primary"
-            )
+        link_button_home = create_www_link_button(
+            facility["homepage_url"], button_text="Homepage", button_color="primary"
+        )
 
-        if info_dict.get("eawe-pdf"):
+        if facility["eawe_pdf_url"]:
             link_button_eawe_pdf = create_www_link_button(
-                info_dict["eawe-pdf"],
+                facility["eawe_pdf_url"],
                 button_text="EAWE information",
                 icon_classes="fa-solid fa-file-pdf",
                 button_color="primary",
@@ -793,12 +1477,10 @@ def get_card_facility_description_element(dff_selected):
         description_quote_element = []
         description_source_element = []
         description_note_element = []
-        link_button_home = create_www_link_button("", button_text="homepage")
+        link_button_home = create_www_link_button(None, button_text="homepage")
         link_button_eawe_pdf = []
 
-    link_button_GoogleMaps = create_googlemaps_link_button(
-        dff_selected["lat"], dff_selected["lon"]
-    )
+    link_button_GoogleMaps = create_googlemaps_link_button(facility["googlemaps_url"])
 
     link_button_feedback = create_feedback_button()
 
@@ -831,30 +1513,68 @@ def get_card_facility_description_element(dff_selected):
     return card_content
 
 
-def create_Ul(contents):
+class HTMLComponents(HTMLParser):
+    """
+    Turns a sanitized HTML fragment into Dash html components
+
+    The fragments of facilities/markup.py only hold the tags of ALLOWED_TAGS,
+    each of which has a Dash component of the same name, and every tag is
+    closed, so no Markdown parser is needed to show them.
+
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.children = [[]]
+        self.tags = []
+
+    def handle_starttag(self, tag, attrs):
+        component = getattr(html, tag.capitalize())
+        if tag in VOID_TAGS:
+            self.children[-1].append(component())
+            return
+        self.tags.append((component, dict(attrs)))
+        self.children.append([])
+
+    def handle_endtag(self, tag):
+        if tag in VOID_TAGS or not self.tags:
+            return
+        component, attrs = self.tags.pop()
+        children = self.children.pop()
+        self.children[-1].append(component(children, **attrs))
+
+    def handle_data(self, data):
+        self.children[-1].append(data)
+
+
+def create_html_element(fragment):
     """
-    Create an unordered HTML list from a list or array
+    Show a sanitized HTML fragment rendered from the facility's Markdown
 
-    Creates an unordered HTML list (<ul></ul>) from a list or array. Returns a multi-level list for nested input data.
+    The fragments are rendered once when the facility data is compiled (see
+    facilities/markup.py) and turned into html components here, so the
+    browser does not parse Markdown again.
 
     Parameters
     ----------
-    contents : list or array
-        the data to be parsed into a list
+    fragment : str or None
+        HTML from one of the *_html columns
 
     Returns
     -------
     HTML object
-        a Dash HTML.ul object
+        a Dash object showing the HTML, or an empty list without a fragment
 
     """
-    h = []
-    for i in contents:
-        if isinstance(i, list):
-            h.append(create_Ul(i))
-        else:
-            h.append(html.Li(dcc.Markdown(i, dangerously_allow_html=True)))
-    return html.Ul(h)
+
+    if not fragment:
+        return []
+
+    parser = HTMLComponents()
+    parser.feed(fragment)
+    parser.close()
+
+    return html.Div(parser.children[0])
 
 
 def get_card_infrastructure_element(dff_selected):
@@ -875,7 +1595,10 @@ def get_card_infrastructure_element(dff_selected):
 
     """
 
-    infrastructure_list = create_Ul(dff_selected["infrastructure_specific"].squeeze())
+    facility = dff_selected.iloc[0]
+
+    # empty for generic tags without specific details
+    infrastructure_list = create_html_element(facility["infrastructure_html"])
 
     infrastructure_element = [html.P("Available infrastructure:"), infrastructure_list]
     return infrastructure_element
@@ -900,11 +1623,13 @@ def get_card_availabledata_element(dff_selected):
 
     """
 
-    availabledata_list = create_Ul(dff_selected["availabledata_specific"].squeeze())
+    facility = dff_selected.iloc[0]
 
-    if dff_selected["availabledata_portal"].any():
+    availabledata_list = create_html_element(facility["availabledata_html"])
+
+    if facility["portal_url"]:
         dataportal_button = create_www_link_button(
-            dff_selected["availabledata_portal"].squeeze(),
+            facility["portal_url"],
             button_text="data portal",
             button_color="primary",
             icon_classes="fa-solid fa-database",
@@ -912,13 +1637,9 @@ def get_card_availabledata_element(dff_selected):
     else:
         dataportal_button = []
 
-    if dff_selected["availabledata_desc"].any():
-        description_text = dff_selected["availabledata_desc"]
-        description_text_element = dcc.Markdown(
-            description_text, dangerously_allow_html=True
-        )
-    else:
-        description_text_element = []
+    description_text_element = create_html_element(
+        facility["availabledata_description_html"]
+    )
 
     availabledata_element = [
         description_text_element,
@@ -1056,295 +1777,1027 @@ def toggle_collapse(n, is_open):
 # Create the layout for this page
 # -----------------------------
 
-layout = dbc.Container(
-    [
-        # title row
-        html.Div(
-            [
-                dbc.Row(
-                    [
-                        dbc.Col(
-                            [html.H1("Wind Energy R&D Facilities and Data")],
-                            width=12,
-                        ),
-                    ],
-                    className="title h-10 pt-2 mb-2",
-                ),
-            ]
-        ),
-        # content
-        html.Div(
-            [
-                # logging row
-                dbc.Row(
-                    dbc.Col([html.Div(id="log")]),
-                ),
-                # map and table content row
-                dbc.Row(
-                    [
-                        # map and warning column
-                        dbc.Col(
-                            [
-                                dbc.Row(
-                                    [
-                                        dbc.Col(
-                                            [
-                                                create_facility_map_leaflet(
-                                                    df, pd.DataFrame()
-                                                ),
-                                            ],
-                                            id="facility-map-leaflet",
-                                            className="col-12",
-                                        )
-                                    ]
-                                ),
-                                dbc.Row(
-                                    [points_not_shown_warning()],
-                                    id="points-not-shown-warning",
-                                    className="",
-                                ),
-                            ],
-                            className="col-12 col-lg-6",
-                        ),
-                        # table column
-                        dbc.Col(
-                            [html.Div(create_sortable_facility_table(df))],
-                            className="col-12 col-lg-6 mt-2 mt-lg-0",
-                        ),
-                    ],
-                    className="pb-2 h-sm-33 h-md-33 h-lg-25",
-                ),
-                # filter row
-                dbc.Row(
-                    [
-                        dbc.Col(filterIcon(), className="col-12 col-lg-2"),
-                        dbc.Col(
-                            [
-                                dbc.Row(create_selectors(df)),
-                                dbc.Alert(
-                                    [
-                                        html.I(className="fa-regular fa-face-frown"),
-                                        " ",
-                                        "No facilities found that match all filters.",
-                                    ],
-                                    color="warning",
-                                    id="no-results-warning",
-                                    className="my-1 py-1",
-                                ),
-                            ],
-                            className="col-12 col-lg-10",
-                        ),
-                    ],
-                    className="filter_row px-1 py-2 mx-0 my-2",
-                ),
-                # tabs row
-                dbc.Col(
-                    [
-                        html.H4(
-                            [
-                                html.I(className="fa-solid fa-circle-info"),
-                                " ",
-                                "Facility information",
-                            ],
-                            id="tabs-title",
-                        ),
-                        dbc.Tabs(
-                            [
-                                dbc.Tab(
-                                    html.P(
-                                        "Click on a facility on the map or in the table to find out more"
-                                    ),
-                                    label="Description",
-                                    tab_id="tab-1",
-                                    id="tab-desc",
-                                    className="p-2 info-tab",
-                                ),
-                                dbc.Tab(
-                                    label="Infrastructure",
-                                    tab_id="tab-2",
-                                    id="tab-infrastructure",
-                                    className="p-2 info-tab",
-                                ),
-                                dbc.Tab(
-                                    label="Available data",
-                                    tab_id="tab-3",
-                                    id="tab-availabledata",
-                                    className="p-2 info-tab",
-                                ),
-                            ],
-                            id="card-tabs",
-                            active_tab="tab-1",
-                        ),
-                    ],
-                    className="p-3 mb-2 info-tab-box",
-                ),
-                # button row
-                create_action_buttons(),
-                # info row
-                create_about_element(),
-                # dcc.Store stores intermediate values
-                dcc.Store(id="selected-facility-store"),
-                dcc.Store(
-                    id="filtered-facilities-store", data=df.to_json(orient="records")
-                ),
-            ],
-            className="content",
-            style={"min-height": "80vh"},
-        ),
-    ],
-    fluid=True,
-    className="dbc h-80",
-    style={"min-height": "80vh"},
-)
 
+def create_layout(data):
+    """
+    Create the page layout for one snapshot of the data
 
-@dash.callback(
-    Output("filtered-facilities-store", "data"),
-    Output("no-results-warning", "is_open"),
-    Input("country_selector", "value"),
+    """
+
+    return dbc.Container(
+        [
+            # title row
+            html.Div(
+                [
+                    dbc.Row(
+                        [
+                            dbc.Col(
+                                [html.H1("Wind Energy R&D Facilities and Data")],
+                                width=12,
+                            ),
+                        ],
+                        className="title h-10 pt-2 mb-2",
+                    ),
+                ]
+            ),
+            # content
+            html.Div(
+                [
+                    # logging row
+                    dbc.Row(
+                        dbc.Col([html.Div(id="log")]),
+                    ),
+                    # map and table content row
+                    dbc.Row(
+                        [
+                            # map and warning column
+                            dbc.Col(
+                                [
+                                    dbc.Row(
+                                        [
+                                            dbc.Col(
+                                                [
+                                                    create_facility_map_leaflet(
+                                                        data.df, pd.DataFrame(), data
+                                                    ),
+                                                ],
+                                                id="facility-map-leaflet",
+                                                className="col-12",
+                                            )
+                                        ]
+                                    ),
+                                    dbc.Row(
+                                        [points_not_shown_warning()],
+                                        id="points-not-shown-warning",
+                                        className="",
+                                    ),
+                                ],
+                                className="col-12 col-lg-6",
+                            ),
+                            # table column
+                            dbc.Col(
+                                [
+                                    html.Div(
+                                        create_sortable_facility_table(data.df, data)
+                                    ),
+                                    create_export_links(),
+                                ],
+                                className="col-12 col-lg-6 mt-2 mt-lg-0",
+                            ),
+                        ],
+                        className="pb-2 h-sm-33 h-md-33 h-lg-25",
+                    ),
+                    # filter row
+                    dbc.Row(
+                        [
+                            dbc.Col(filterIcon(), className="col-12 col-lg-2"),
+                            dbc.Col(
+                                [
+                                    dbc.Row(create_selectors(data)),
+                                    create_text_search(),
+                                    create_radius_search(),
+                                    dbc.Alert(
+                                        [
+                                            html.I(
+                                                className="fa-regular fa-face-frown"
+                                            ),
+                                            " ",
+                                            "No facilities found that match all filters.",
+                                        ],
+                                        color="warning",
+                                        id="no-results-warning",
+                                        className="my-1 py-1",
+                                    ),
+                                ],
+                                className="col-12 col-lg-10",
+                            ),
+                        ],
+                        className="filter_row px-1 py-2 mx-0 my-2",
+                    ),
+                    # tabs row
+                    dbc.Col(
+                        [
+                            html.H4(
+                                [
+                                    html.I(className="fa-solid fa-circle-info"),
+                                    " ",
+                                    "Facility information",
+                                ],
+                                id="tabs-title",
+                            ),
+                            dbc.Tabs(
+                                [
+                                    dbc.Tab(
+                                        html.P(
+                                            "Click on a facility on the map or in the table to find out more"
+                                        ),
+                                        label="Description",
+                                        tab_id="tab-1",
+                                        id="tab-desc",
+                                        className="p-2 info-tab",
+                                    ),
+                                    dbc.Tab(
+                                        label="Infrastructure",
+                                        tab_id="tab-2",
+                                        id="tab-infrastructure",
+                                        className="p-2 info-tab",
+                                    ),
+                                    dbc.Tab(
+                                        label="Available data",
+                                        tab_id="tab-3",
+                                        id="tab-availabledata",
+                                        className="p-2 info-tab",
+                                    ),
+                                ],
+                                id="card-tabs",
+                                active_tab="tab-1",
+                            ),
+                        ],
+                        className="p-3 mb-2 info-tab-box",
+                    ),
+                    # button row
+                    create_action_buttons(),
+                    # info row
+                    create_about_element(),
+                    # dcc.Store stores intermediate values
+                    dcc.Store(id="selected-facility-store"),
+                    dcc.Store(id="clicked-facility-store"),
+                    dcc.Store(
+                        id="filtered-facilities-store", data=get_facility_ids(data.df)
+                    ),
+                    dcc.Store(id="radius-search-store"),
+                    dcc.Store(id="search-results-store"),
+                    # the facility selected by a shared link
+                    dcc.Store(id="url-selection-store"),
+                    # the slug of the selected facility, for the page URL
+                    dcc.Store(id="selected-facility-slug-store"),
+                    # the page URL, kept in step with the filters and selection.
+                    # Without refresh it is only updated in the address bar.
+                    dcc.Location(id="explorer-url", refresh=False),
+                    # the bounds the map was last fitted to by update_map
+                    dcc.Store(id="map-fitted-bounds-store"),
+                    # the dataset version the page shows, checked at the
+                    # EXPLORER_RELOAD_INTERVAL so that open pages follow a
+                    # reload (see update_dataset_version)
+                    dcc.Store(id="facet-index-version", data=data.dataset_hash),
+                    dcc.Interval(
+                        id="dataset-version-interval",
+                        interval=RELOAD_INTERVAL * 1000,
+                        disabled=not RELOAD_INTERVAL,
+                    ),
+                    # the browser's copy of the facet index, for clientside
+                    # filtering: fetched from /api/facet-index when the version
+                    # changes, and revalidated by the browser with its ETag
+                    dcc.Store(id="facet-index-store"),
+                    dcc.Store(
+                        id="facet-icon-store",
+                        data=(
+                            create_icon_lookup(data.df)
+                            if CLIENTSIDE_FILTERING
+                            else None
+                        ),
+                    ),
+                ],
+                className="content",
+                style={"min-height": "80vh"},
+            ),
+        ],
+        fluid=True,
+        className="dbc h-80",
+        style={"min-height": "80vh"},
+    )
+
+
+def get_url_state(query_parameters, data):
+    """
+    Read the filters and the selected facility of a shared link
+
+    Values that are not in the data (anymore) are left out, so old links
+    still open.
+
+    Parameters
+    ----------
+    query_parameters : dict
+        the query parameters of the page URL, as Dash passes them to layout:
+        a string for a single value, a list for repeated parameters
+    data : Dataset
+        the snapshot the page shows
+
+    Returns
+    -------
+    dict or None
+        "filters" (URL_FILTERS name -> list of values) and "facility_id" (int
+        or None, of the facility whose slug the link has); None if the link
+        has neither
+
+    """
+
+    def values(name):
+        value = query_parameters.get(name) or []
+        return [value] if isinstance(value, str) else value
+
+    filters = {}
+    for name, selector in URL_FILTERS:
+        lookup = data.vocabularies[name].lookup
+        selected = [v for v in values(name) if v in lookup]
+        if selected:
+            filters[name] = selected
+
+    facility_id = None
+    for value in values("facility")[:1]:
+        if value in data.slug_positions:
+            position = data.slug_positions[value]
+            facility_id = int(data.df["facility_id"].iat[position])
+
+    if not filters and facility_id is None:
+        return None
+
+    return {"filters": filters, "facility_id": facility_id}
+
+
+def layout(**kwargs):
+    data = dataset_manager.current()
+
+    return html.Div(
+        [
+            # built once per snapshot, so that page loads after a reload show the
+            # new data
+            data.derived("layout", create_layout),
+            # the filters and selection of a shared link, for apply_url_state
+            dcc.Store(id="url-state-store", data=get_url_state(kwargs, data)),
+        ]
+    )
+
+
+filter_inputs = [
+    Input("country_selector", "value"),
     Input("facilitytype_selector", "value"),
     Input("infrastructure_selector", "value"),
     Input("availabledata_selector", "value"),
-)
+    Input("radius-search-store", "data"),
+    Input("search-results-store", "data"),
+]
+
+
 def get_filtered_facilities(
     countries_selected="",
     facilitytypes_selected="",
     infrastructure_selected="",
     availabledata_selected="",
+    radius_search=None,
+    search_results=None,
+    dataset_version=None,
 ):
 
-    dff = filter_facilities(
-        df,
-        countries_selected,
-        facilitytypes_selected,
-        infrastructure_selected,
-        availabledata_selected,
+    data = dataset_manager.current()
+    df = data.df
+
+    if search_results is not None:
+        # keep the ranking of the text search; the other filters only remove
+        positions = data.positions(search_results)
+        bits = data.facet_index.match(
+            get_facet_selections(
+                countries_selected,
+                facilitytypes_selected,
+                infrastructure_selected,
+                availabledata_selected,
+            )
+        )
+        match = bits_contain(bits, positions)
+        if radius_search:
+            near, distances = data.spatial_index.query_radius(
+                radius_search["lat"], radius_search["lon"], radius_search["radius_km"]
+            )
+            match &= np.isin(positions, near)
+        facility_ids = df["facility_id"].values[positions[match]].tolist()
+
+        return facility_ids, not facility_ids
+
+    if radius_search:
+        positions, distances = find_facilities_near(
+            df,
+            radius_search["lat"],
+            radius_search["lon"],
+            radius_search["radius_km"],
+            countries_selected,
+            facilitytypes_selected,
+            infrastructure_selected,
+            availabledata_selected,
+            facet_index=data.facet_index,
+            spatial_index=data.spatial_index,
+        )
+        facility_ids = df["facility_id"].values[positions].tolist()
+
+        return facility_ids, not facility_ids
+
+    facility_ids = get_filtered_facility_ids(
+        data,
+        get_filter_key(
+            countries_selected,
+            facilitytypes_selected,
+            infrastructure_selected,
+            availabledata_selected,
+        ),
     )
 
     # check to see if there are any facilities
-    no_results_warning = False
+    return list(facility_ids), not facility_ids
 
-    if dff.empty:
-        no_results_warning = True
 
-    return dff.to_json(orient="records"), no_results_warning
+def get_table_positions(filtered_facility_ids, viewport_bounds=None, data=None):
+    """
+    Get the row positions of the facilities to list in the table
 
+    With a viewport, the facilities outside it are left out; those without a
+    location are always listed.
 
-@dash.callback(
-    Output("sortable-facility-table", "data"),
-    Input("filtered-facilities-store", "data"),
-)
-def update_table(jsonified_filtered_facilities):
+    """
 
-    dff = pd.read_json(jsonified_filtered_facilities, orient="records")
+    if data is None:
+        data = dataset_manager.current()
 
-    df_table = dff[["name", "country", "type_property", "facility_id"]].copy()
-    df_table["id"] = df_table.facility_id
+    positions = data.positions(filtered_facility_ids)
 
-    df_table.rename(columns={"type_property": "type"}, inplace=True)
+    if viewport_bounds:
+        inside, outside, unlocated = get_viewport_positions(
+            filtered_facility_ids, viewport_bounds, data=data
+        )
+        positions = positions[~np.isin(positions, outside)]
 
-    return df_table.to_dict("records")
+    return positions
+
+
+def update_table(filtered_facility_ids, viewport_bounds=None):
+
+    data = dataset_manager.current()
+    positions = get_table_positions(filtered_facility_ids, viewport_bounds, data)
+
+    return get_table_records(data.df.iloc[positions])
+
+
+def update_table_page(
+    filtered_facility_ids,
+    page_current,
+    page_size,
+    sort_by,
+    filter_query,
+    viewport_bounds=None,
+):
+    """
+    Send one page of the table, sorted and filtered on the server
+
+    Used instead of update_table when EXPLORER_TABLE_PAGING=custom.
+
+    Parameters
+    ----------
+    filtered_facility_ids : list of int
+        the contents of filtered-facilities-store
+    page_current, page_size, sort_by, filter_query
+        the table's paging, sorting and filtering state
+    viewport_bounds : list, optional
+        the visible part of the map, if the table follows it
+
+    Returns
+    -------
+    data : list of dict
+        the rows on the page
+    page_count : int
+        the number of pages
+    page_current : int
+        the page shown; back to the first page when the filters change
+
+    """
+
+    triggered = dash.callback_context.triggered_prop_ids
+    if "sortable-facility-table.page_current" not in triggered:
+        page_current = 0
+
+    data = dataset_manager.current()
+    positions = get_table_positions(filtered_facility_ids, viewport_bounds, data)
+    page, page_count = data.table_index.page(
+        positions, filter_query, sort_by, page_current, page_size
+    )
+
+    return (
+        get_table_records(data.df.iloc[page]),
+        page_count,
+        min(page_current or 0, page_count - 1),
+    )
+
+
+def update_map(filtered_facility_ids, fitted_bounds=None):
+    """
+    Update the facilities shown on the map
+
+    The map itself is only created once. This sends the new facility layer
+    data, and new bounds only if the filtered facilities cover a different
+    area than the map was last fitted to.
+
+    Parameters
+    ----------
+    filtered_facility_ids : list of int
+        the contents of filtered-facilities-store
+    fitted_bounds : list, optional
+        the bounds the map was last fitted to. This is kept in its own store
+        because the map's bounds property follows the user's panning.
+
+    Returns
+    -------
+    layer_data : list or dict
+        the marker components or GeoJSON features
+    bounds : list or dash.no_update
+        the new map bounds
+    fitted_bounds : list or dash.no_update
+        the same, for map-fitted-bounds-store
+
+    """
+
+    data = dataset_manager.current()
+
+    # its possible this callback could be called before a filtering step has taken place.
+    if filtered_facility_ids is None:
+        dff = data.df
+    else:
+        dff = get_facilities_by_id(filtered_facility_ids, data)
+
+    bounds = get_map_bounds(dff)
+    if bounds is None or bounds == fitted_bounds:
+        bounds = dash.no_update
+
+    return get_facility_layer_data(dff, data), bounds, bounds
+
+
+def fit_map(filtered_facility_ids, fitted_bounds=None):
+    """
+    Fit the map to the filtered facilities
+
+    Used instead of update_map when EXPLORER_MAP_LAYER=tiles: the browser
+    fetches the facilities' tiles itself, so only the bounds are sent.
+
+    Returns
+    -------
+    bounds : list or dash.no_update
+        the new map bounds
+    fitted_bounds : list or dash.no_update
+        the same, for map-fitted-bounds-store
+
+    """
+
+    data = dataset_manager.current()
+
+    if filtered_facility_ids is None:
+        dff = data.df
+    else:
+        dff = get_facilities_by_id(filtered_facility_ids, data)
+
+    bounds = get_map_bounds(dff)
+    if bounds is None or bounds == fitted_bounds:
+        bounds = dash.no_update
+
+    return bounds, bounds
+
+
+def update_map_viewport(filtered_facility_ids, viewport_bounds, fitted_bounds=None):
+    """
+    Update the facilities shown in and around the visible part of the map
+
+    Used instead of update_map when EXPLORER_VIEWPORT_QUERIES=1. Only the
+    facilities inside the viewport (plus a margin) are sent as markers; the
+    filtered facilities elsewhere are summarised as one marker per area.
+
+    Parameters
+    ----------
+    filtered_facility_ids : list of int
+        the contents of filtered-facilities-store
+    viewport_bounds : list
+        the visible part of the map, as [[south, west], [north, east]]
+    fitted_bounds : list, optional
+        the bounds the map was last fitted to
+
+    Returns
+    -------
+    layer_data : list or dict
+        the marker components or GeoJSON features in the viewport
+    summary_markers : list
+        the children of the summary layer
+    bounds : list or dash.no_update
+        the new map bounds
+    fitted_bounds : list or dash.no_update
+        the same, for map-fitted-bounds-store
+
+    """
+
+    data = dataset_manager.current()
+
+    if filtered_facility_ids is None:
+        filtered_facility_ids = get_facility_ids(data.df)
+
+    bounds = dash.no_update
+    if dash.callback_context.triggered_id == "filtered-facilities-store":
+        # the filters changed: fit the map to the result, and query the area it
+        # is about to show
+        new_bounds = get_map_bounds(get_facilities_by_id(filtered_facility_ids, data))
+        if new_bounds is not None and new_bounds != fitted_bounds:
+            bounds = viewport_bounds = new_bounds
+
+    if not viewport_bounds:
+        # the map has not reported its viewport yet
+        dff = get_facilities_by_id(filtered_facility_ids, data)
+        return get_facility_layer_data(dff, data), [], bounds, bounds
+
+    inside, outside, unlocated = get_viewport_positions(
+        filtered_facility_ids, viewport_bounds, VIEWPORT_MARGIN, data
+    )
+
+    # summary areas of about the size of the viewport
+    (south, west), (north, east) = viewport_bounds
+    summaries = data.spatial_index.summarize(outside, max(north - south, 1.0))
+
+    return (
+        get_facility_layer_data(data.df.iloc[inside], data),
+        create_summary_markers(summaries),
+        bounds,
+        bounds,
+    )
+
+
+def get_search_restriction(radius_search=None, search_results=None, data=None):
+    """
+    Get the facilities left by the text and radius searches
+
+    Returns
+    -------
+    numpy array or None
+        bitset of the facilities, or None if neither search is active
+
+    """
+
+    if data is None:
+        data = dataset_manager.current()
+
+    restrict = None
+
+    if search_results is not None:
+        restrict = positions_to_bits(data.positions(search_results), len(data.df))
+
+    if radius_search:
+        near, distances = data.spatial_index.query_radius(
+            radius_search["lat"], radius_search["lon"], radius_search["radius_km"]
+        )
+        near_bits = positions_to_bits(near, len(data.df))
+        restrict = near_bits if restrict is None else restrict & near_bits
+
+    return restrict
+
+
+facet_option_outputs = [
+    Output("country_selector", "options"),
+    Output("facilitytype_selector", "options"),
+    Output("infrastructure_selector", "options"),
+    Output("availabledata_selector", "options"),
+]
+
+
+def update_facet_options(
+    countries_selected="",
+    facilitytypes_selected="",
+    infrastructure_selected="",
+    availabledata_selected="",
+    radius_search=None,
+    search_results=None,
+    dataset_version=None,
+):
+    """
+    Update the facility counts shown in the dropdowns
+
+    The counts are popcounts over the facet bitsets, so this is cheaper than
+    filtering. With clientside filtering, assets/explorer.js counts from the
+    browser's facet index instead. Also runs when the data is reloaded.
+
+    """
+
+    data = dataset_manager.current()
+    options = get_facet_options(
+        get_facet_selections(
+            countries_selected,
+            facilitytypes_selected,
+            infrastructure_selected,
+            availabledata_selected,
+        ),
+        get_search_restriction(radius_search, search_results, data),
+        data,
+    )
+
+    return (
+        options["country"],
+        options["type"],
+        options["infrastructure"],
+        options["availabledata"],
+    )
+
+
+# the part of the map that shows the (filtered) facilities
+if MAP_LAYER in ("geojson", "tiles"):
+    facility_layer_output = Output("facility-geojson", "data")
+else:
+    facility_layer_output = Output("markers", "children")
+
+
+if CLIENTSIDE_FILTERING:
+    # fetch the facet index once per dataset version. It is not kept in local
+    # storage, which is too small for large catalogues; the browser's HTTP
+    # cache keeps it instead.
+    dash.clientside_callback(
+        ClientsideFunction(namespace="explorer", function_name="load_facet_index"),
+        Output("facet-index-store", "data"),
+        Input("facet-index-version", "data"),
+        State("facet-icon-store", "data"),
+        prevent_initial_call=False,
+    )
+
+    dash.clientside_callback(
+        ClientsideFunction(namespace="explorer", function_name="filter_facilities"),
+        Output("filtered-facilities-store", "data"),
+        Output("no-results-warning", "is_open"),
+        *filter_inputs,
+        Input("facet-index-store", "data"),
+    )
+
+    dash.clientside_callback(
+        ClientsideFunction(namespace="explorer", function_name="update_facet_options"),
+        *facet_option_outputs,
+        *filter_inputs,
+        Input("facet-index-store", "data"),
+    )
+
+    dash.clientside_callback(
+        ClientsideFunction(namespace="explorer", function_name="update_table"),
+        Output("sortable-facility-table", "data"),
+        Input("filtered-facilities-store", "data"),
+        State("facet-index-store", "data"),
+    )
+
+    if MAP_LAYER == "geojson":
+        layer_function = "update_features"
+    else:
+        layer_function = "update_markers"
+
+    # with tiles, the layer follows the filters instead (see below)
+    if MAP_LAYER != "tiles":
+        dash.clientside_callback(
+            ClientsideFunction(namespace="explorer", function_name=layer_function),
+            facility_layer_output,
+            Input("filtered-facilities-store", "data"),
+            State("facet-index-store", "data"),
+        )
+else:
+    # refiltered when the data is reloaded, as the browser's facet index is
+    dash.callback(
+        Output("filtered-facilities-store", "data"),
+        Output("no-results-warning", "is_open"),
+        *filter_inputs,
+        Input("facet-index-version", "data"),
+    )(get_filtered_facilities)
+
+    dash.callback(
+        *facet_option_outputs,
+        *filter_inputs,
+        Input("facet-index-version", "data"),
+    )(update_facet_options)
+
+    if TABLE_FOLLOWS_VIEWPORT:
+        table_viewport_inputs = [Input("facility-map", "bounds")]
+    else:
+        table_viewport_inputs = []
+
+    if TABLE_PAGING == "custom":
+        dash.callback(
+            Output("sortable-facility-table", "data"),
+            Output("sortable-facility-table", "page_count"),
+            Output("sortable-facility-table", "page_current"),
+            Input("filtered-facilities-store", "data"),
+            Input("sortable-facility-table", "page_current"),
+            Input("sortable-facility-table", "page_size"),
+            Input("sortable-facility-table", "sort_by"),
+            Input("sortable-facility-table", "filter_query"),
+            *table_viewport_inputs,
+        )(update_table_page)
+    else:
+        dash.callback(
+            Output("sortable-facility-table", "data"),
+            Input("filtered-facilities-store", "data"),
+            *table_viewport_inputs,
+        )(update_table)
+
+    if MAP_LAYER == "tiles":
+        # the tiles are already limited to the viewport
+        dash.callback(
+            Output("facility-map", "bounds"),
+            Output("map-fitted-bounds-store", "data"),
+            Input("filtered-facilities-store", "data"),
+            State("map-fitted-bounds-store", "data"),
+        )(fit_map)
+    elif VIEWPORT_QUERIES:
+        dash.callback(
+            facility_layer_output,
+            Output("facility-summary-layer", "children"),
+            Output("facility-map", "bounds"),
+            Output("map-fitted-bounds-store", "data"),
+            Input("filtered-facilities-store", "data"),
+            Input("facility-map", "bounds"),
+            State("map-fitted-bounds-store", "data"),
+        )(update_map_viewport)
+    else:
+        dash.callback(
+            facility_layer_output,
+            Output("facility-map", "bounds"),
+            Output("map-fitted-bounds-store", "data"),
+            Input("filtered-facilities-store", "data"),
+            State("map-fitted-bounds-store", "data"),
+        )(update_map)
+
+
+if MAP_LAYER == "tiles":
+    # fetch the tiles of the visible part of the map whenever it moves or the
+    # filters change. The tiles are filtered on the server, with the same query
+    # parameters as /api/facilities.
+    dash.clientside_callback(
+        ClientsideFunction(namespace="explorer", function_name="update_tiles"),
+        facility_layer_output,
+        Input("facility-map", "bounds"),
+        *filter_inputs,
+        Input("facet-index-version", "data"),
+        State("facility-map", "zoom"),
+        State("text-search", "value"),
+        prevent_initial_call=False,
+    )
+
+
+# the download links follow the filters, with the query parameters of
+# /api/facilities
+dash.clientside_callback(
+    ClientsideFunction(namespace="explorer", function_name="update_export_links"),
+    [Output("export-link-" + extension, "href") for extension in EXPORT_FORMATS],
+    *filter_inputs,
+    State("text-search", "value"),
+)
 
 
 @dash.callback(
-    Output("facility-map-leaflet", "children"),
+    Output("selected-facility-layer", "children"),
+    Output("facility-map", "center"),
+    Output("facility-map", "zoom"),
     # Output('log','children'),
-    Input("filtered-facilities-store", "data"),
     Input("selected-facility-store", "data"),
 )
-def update_map(jsonified_filtered_facilities, jsonified_selected_facility):
-    # its possible this callback could be called before a filtering step has taken place.
-    try:
-        dff = pd.read_json(jsonified_filtered_facilities, orient="records")
-    except:
-        dff = df
-
-    try:
-        dff_selected = pd.read_json(jsonified_selected_facility, orient="records")
-    except:
-        dff_selected = pd.DataFrame()
+def update_selected_facility_marker(selected_facility_ids):
+    """
+    Highlight the selected facility and move the map to it
+
+    Only the highlight and the viewport are sent to the browser.
+
+    """
+
+    data = dataset_manager.current()
 
-    if not dff_selected.empty:
-        log = dff_selected.name
+    if selected_facility_ids:
+        dff_selected = get_facilities_by_id(selected_facility_ids, data)
     else:
-        log = "no site selected"
+        dff_selected = pd.DataFrame(columns=data.df.columns)
+
+    selected_markers = create_selected_facility_marker(dff_selected)
+
+    if not selected_markers:
+        # nothing (with a location) selected: leave the viewport alone
+        return selected_markers, dash.no_update, dash.no_update
+
+    return (
+        selected_markers,
+        get_map_center(dff_selected),
+        get_map_zoom(dff_selected),
+    )
 
-    leaflet_map = create_facility_map_leaflet(dff, dff_selected)
 
-    return leaflet_map  # , log
+@dash.callback(
+    Output("search-results-store", "data"),
+    Input("text-search", "value"),
+)
+def update_search_results(query):
+    """
+    Run the text search; None while the search box is empty
+
+    """
+
+    if not query or not query.strip():
+        return None
+
+    data = dataset_manager.current()
+
+    return search_facilities(data.df, query, search_index=data.search_index)
+
+
+@dash.callback(
+    Output("radius-search-store", "data"),
+    Output("radius-search-layer", "children"),
+    Input("radius-lat", "value"),
+    Input("radius-lon", "value"),
+    Input("radius-km", "value"),
+)
+def update_radius_search(lat, lon, radius_km):
+    """
+    Turn the radius search fields into a search, and draw its circle
+
+    """
+
+    radius_search = get_radius_search(lat, lon, radius_km)
+    if radius_search is None:
+        return None, []
+
+    circle = dl.Circle(
+        center=(radius_search["lat"], radius_search["lon"]),
+        radius=radius_search["radius_km"] * 1000,
+        color="#666",
+        fill=False,
+        dashArray="4",
+        interactive=False,
+    )
+
+    return radius_search, [circle]
+
+
+@dash.callback(
+    Output("radius-lat", "value"),
+    Output("radius-lon", "value"),
+    Input("facility-map", "click_lat_lng"),
+    State("radius-pick-on-map", "value"),
+)
+def set_radius_search_point(click_lat_lng, pick_on_map):
+    """
+    Set the radius search point from a click on the map
+
+    """
+
+    if not pick_on_map or not click_lat_lng:
+        return dash.no_update, dash.no_update
+
+    lat, lon = click_lat_lng
+
+    return round(lat, 4), round((lon + 180.0) % 360.0 - 180.0, 4)
+
+
+# turn a click on the map into a single {"facility_id": ...} event in the browser,
+# so the server never sees the n_clicks of every marker
+if MAP_LAYER in ("geojson", "tiles"):
+    dash.clientside_callback(
+        ClientsideFunction(namespace="explorer", function_name="feature_clicked"),
+        Output("clicked-facility-store", "data"),
+        Input("facility-geojson", "click_feature"),
+    )
+else:
+    dash.clientside_callback(
+        ClientsideFunction(namespace="explorer", function_name="marker_clicked"),
+        Output("clicked-facility-store", "data"),
+        Input({"id": ALL, "type": "facility"}, "n_clicks"),
+    )
+
+
+@dash.callback(
+    Output("facet-index-version", "data"),
+    Input("dataset-version-interval", "n_intervals"),
+    State("facet-index-version", "data"),
+)
+def update_dataset_version(n_intervals, dataset_version):
+    """
+    Let an open page follow a reload of the data
+
+    The facility ids the browser holds stay valid, as they are made from the
+    slugs; a new version refetches the facet index and refreshes the filter
+    results, dropdown counts and selection.
+
+    """
+
+    dataset_hash = dataset_manager.current().dataset_hash
+    if dataset_hash == dataset_version:
+        return dash.no_update
+
+    return dataset_hash
+
+
+@dash.callback(
+    *[Output(selector, "value") for name, selector in URL_FILTERS],
+    Output("url-selection-store", "data"),
+    Input("url-state-store", "data"),
+    prevent_initial_call=False,
+)
+def apply_url_state(url_state):
+    """
+    Open a shared link: set its filters and select its facility
+
+    Runs when the page is loaded. Dropdowns the link does not mention keep
+    their values.
+
+    """
+
+    if not url_state:
+        return (dash.no_update,) * (len(URL_FILTERS) + 1)
+
+    filters = url_state["filters"]
+    if url_state["facility_id"] is None:
+        url_selection = dash.no_update
+    else:
+        url_selection = {"facility_id": url_state["facility_id"]}
+
+    values = [filters.get(name, dash.no_update) for name, selector in URL_FILTERS]
+
+    return (*values, url_selection)
+
+
+# keep the page URL in step with the filters and selection, to share it; the
+# inverse of get_url_state
+dash.clientside_callback(
+    ClientsideFunction(namespace="explorer", function_name="update_url"),
+    Output("explorer-url", "search"),
+    *[Input(selector, "value") for name, selector in URL_FILTERS],
+    Input("selected-facility-slug-store", "data"),
+)
 
 
 @dash.callback(
     Output("selected-facility-store", "data"),
+    Output("selected-facility-slug-store", "data"),
     Output("sortable-facility-table", "selected_cells"),
     Output("sortable-facility-table", "active_cell"),
-    Input({"id": ALL, "type": "facility"}, "n_clicks"),
+    Input("clicked-facility-store", "data"),
     Input("sortable-facility-table", "active_cell"),
-    Input("country_selector", "value"),
-    Input("facilitytype_selector", "value"),
-    Input("infrastructure_selector", "value"),
-    Input("availabledata_selector", "value"),
+    Input("url-selection-store", "data"),
+    Input("facet-index-version", "data"),
+    # changing a filter clears the selected facility, also when the filtering
+    # is done in the browser
+    *filter_inputs,
+    State("selected-facility-store", "data"),
 )
 def select_facility(
-    n_clicks,
+    clicked_facility,
     active_cell,
+    url_selection=None,
+    dataset_version=None,
     countries_selected="",
     facilitytypes_selected="",
     infrastructure_selected="",
     availabledata_selected="",
+    radius_search=None,
+    search_results=None,
+    selected_facility_ids=None,
 ):
 
+    data = dataset_manager.current()
+
     # create default values; these may be overwritten
-    dff_selected = pd.DataFrame(columns=df.columns)
+    dff_selected = pd.DataFrame(columns=data.df.columns)
 
     # first establish where the trigger came from
 
     trigger = dash.callback_context.triggered_id
 
-    trigger_component = ""
-
-    if isinstance(trigger, str):
-        # active cell is associated with a string id
-        log = "string"
-        log = trigger
-        if trigger == "sortable-facility-table":
-            trigger_component = "sortable-facility-table"
-    # elif isinstance(trigger,list):
-    #    log = "list"
-    elif isinstance(trigger, dict):
-        log = "dict"
-        trigger_component = "facility-map-leaflet"
-
-    if trigger_component == "facility-map-leaflet":
+    # a shared link sets the filters and the selection at once; the selection
+    # wins over the filter change
+    if "url-selection-store.data" in dash.callback_context.triggered_prop_ids:
+        trigger = "url-selection-store"
+
+    if trigger == "url-selection-store" and url_selection:
+        dff_selected = get_facilities_by_id([url_selection["facility_id"]], data)
+
+    if trigger == "facet-index-version":
+        # the data was reloaded: show the new version of the selected facility,
+        # or nothing if it was removed
+        dff_selected = get_facilities_by_id(selected_facility_ids or [], data)
+
+    if trigger == "clicked-facility-store":
         # then the trigger was the map
         log = "triggered by the map"
-        if not any(n_clicks):
+        if not clicked_facility:
             log = "no clicks on map"
-            return
-        else:
-            log = "clicks on map"
-            # now get the selected marker
-            clickedMarker = dash.callback_context.triggered_id
-            row_id = clickedMarker["id"].rsplit(".", 1)[-1]
-            dff_selected = df[df.facility_id == int(row_id)]
-            log = "Clicked on marker.{}".format(row_id)
-
-    if trigger_component == "sortable-facility-table":
+            return (dash.no_update,) * 4
+        dff_selected = get_facilities_by_id([clicked_facility["facility_id"]], data)
+        log = "Clicked on marker.{}".format(clicked_facility["facility_id"])
+
+    if trigger == "sortable-facility-table":
         # then the trigger was the table
         log = "triggered by the table"
         # get the selected cell
         if active_cell:
-            dff_selected = df[df.facility_id == active_cell["row_id"]]
-        log = active_cell["row_id"]
+            dff_selected = get_facilities_by_id([active_cell["row_id"]], data)
+            log = active_cell["row_id"]
 
     # and finally, clear the selections
     selected_cells = []
     active_cell_out = None
 
     # update the data store (works when empty, too)
-    selected_facility_store = dff_selected.to_json(orient="records")
+    selected_facility_store = get_facility_ids(dff_selected)
+    selected_slug = dff_selected["slug"].iloc[0] if len(dff_selected) else None
 
-    return selected_facility_store, selected_cells, active_cell_out
+    return selected_facility_store, selected_slug, selected_cells, active_cell_out
 
 
 @dash.callback(
@@ -1357,7 +2810,57 @@ def select_facility(
     Output("card-tabs", "active_tab"),
     Input("selected-facility-store", "data"),
 )
-def update_information_tabs(jsonified_selected_facility):
+def update_information_tabs(selected_facility_ids):
+
+    # reset the focus
+    active_tab = "tab-1"
+
+    data = dataset_manager.current()
+
+    if (
+        not selected_facility_ids
+        or selected_facility_ids[0] not in data.facility_positions
+    ):
+        facility_id = None
+    else:
+        facility_id = selected_facility_ids[0]
+
+    return get_information_tabs(facility_id, data) + (active_tab,)
+
+
+def get_information_tabs(facility_id, data):
+    """
+    Get the contents of the facility information tabs
+
+    The result only depends on the facility and the snapshot, so it is cached
+    with the snapshot: repeat selections of a facility are a dictionary
+    lookup, and the cards of old data are dropped with it.
+
+    """
+
+    return data.cached(
+        "information_tabs", facility_id, create_information_tabs, CARD_CACHE_SIZE
+    )
+
+
+def create_information_tabs(data, facility_id):
+    """
+    Create the contents of the facility information tabs
+
+    Parameters
+    ----------
+    data : Dataset
+        the snapshot to look in
+    facility_id : int or None
+        the selected facility, or None if nothing is selected
+
+    Returns
+    -------
+    tuple
+        the title, the description tab, and the contents and disabled state
+        of the infrastructure and available data tabs
+
+    """
 
     # set default values
     tabs_title_element = html.H4(
@@ -1371,20 +2874,18 @@ def update_information_tabs(jsonified_selected_facility):
     tab_availabledata_element = []
     tab_availabledata_disabled = True
 
-    # reset the focus
-    active_tab = "tab-1"
-
-    if jsonified_selected_facility == "":
+    if facility_id is None:
         dff_selected = pd.DataFrame()
     else:
-        dff_selected = pd.read_json(jsonified_selected_facility, orient="records")
+        # with the descriptions, which are only decoded for the facility shown
+        dff_selected = data.rows(data.positions([facility_id]))
 
     if len(dff_selected) >= 1:
         tabs_title_element = get_card_facility_title_element(dff_selected)
 
         tab_description_element = get_card_facility_description_element(dff_selected)
 
-        if not dff_selected["infrastructure_list"].isnull().values.any():
+        if dff_selected["has_infrastructure"].iloc[0]:
             tab_infrastructure_element = get_card_infrastructure_element(dff_selected)
             tab_infrastructure_disabled = False
         else:
@@ -1393,7 +2894,7 @@ def update_information_tabs(jsonified_selected_facility):
             )
             tab_infrastructure_disabled = True
 
-        if not dff_selected["availabledata_list"].isnull().values.any():
+        if dff_selected["has_availabledata"].iloc[0]:
             tab_availabledata_element = get_card_availabledata_element(dff_selected)
             tab_availabledata_disabled = False
         else:
@@ -1407,5 +2908,19 @@ def update_information_tabs(jsonified_selected_facility):
         tab_infrastructure_disabled,
         tab_availabledata_element,
         tab_availabledata_disabled,
-        active_tab,
     )
+
+
+def precompute_information_tabs(data):
+    for facility_id in data.df.facility_id:
+        get_information_tabs(int(facility_id), data)
+
+
+if PRECOMPUTE_CARDS:
+    precompute_information_tabs(dataset_manager.current())
+    # render the cards of new data before it is swapped in; those of the old
+    # data go with the old snapshot
+    dataset_manager.on_reload(precompute_information_tabs)
+
+if RELOAD_INTERVAL:
+    dataset_manager.start()